@@ -0,0 +1,210 @@
+"""
+Local agent serving the actions of the command line over a Unix domain socket.
+
+The agent is a long-lived process holding a client per configuration file, with its parsed configuration, its cluster
+connection and the screens it keeps attached. The command line sends its action to the agent when one is running, and
+writes the output streamed back, such that repeated actions do not set everything up again.
+"""
+
+import os
+import sys
+import json
+import socket
+import socketserver
+import threading
+from pathlib import Path
+from typing import Dict, Tuple
+
+socket_path = Path(os.environ.get("CLUSTY_AGENT_SOCKET", "~/.clusty/agent.sock")).expanduser()
+connect_timeout = 1
+
+# Actions served by the agent, the other ones run in the command line process. Start is served only when it needs no
+# credentials, whose prompts would appear on the terminal of the agent
+actions = ['start', 'stop', 'status', 'run', 'release']
+
+
+def _send(wfile, message: Dict) -> None:
+    wfile.write((json.dumps(message) + "\n").encode())
+    wfile.flush()
+
+
+class _ConnectionStream:
+    """Text stream sending the output of an action to the command line that requested it"""
+
+    def __init__(self, wfile):
+        self._wfile = wfile
+        self._lock = threading.Lock()
+
+    def write(self, text: str) -> int:
+        # The command line may have been interrupted, the action still completes
+        with self._lock:
+            try:
+                if text:
+                    _send(self._wfile, {'output': text})
+            except OSError:
+                pass
+
+        return len(text)
+
+    def flush(self) -> None:
+        pass
+
+    def isatty(self) -> bool:
+        return False
+
+
+class _RequestHandler(socketserver.StreamRequestHandler):
+    """Run the action of a request, streaming its output and then its exit status"""
+
+    def handle(self) -> None:
+        request = json.loads(self.rfile.readline())
+
+        stdout = sys.stdout
+        sys.stdout = _ConnectionStream(self.wfile)
+        try:
+            if request['action'] not in actions:
+                raise ValueError(f"Action '{request['action']}' is not served by the agent.")
+
+            # The screens held attached by run are released before the other actions, which attach to them
+            client = self.server.client(request['config'])
+            if request['action'] == 'run':
+                client.run(batch_job=request.get('batch_job'), command=request.get('command'))
+            else:
+                client.release()
+                getattr(client, request['action'])()
+            message = {'exit': 0}
+        except Exception as e:
+            message = {'exit': 1, 'error': f"{type(e).__name__}: {e}"}
+        finally:
+            sys.stdout = stdout
+
+        try:
+            _send(self.wfile, message)
+        except OSError:
+            pass
+
+
+class Agent(socketserver.UnixStreamServer):
+    """
+    Server of the actions of the command line, run one at a time. The client of a configuration file is kept until
+    the file changes.
+    """
+
+    def __init__(self, path: Path = None):
+        self.path = socket_path if path is None else Path(path)
+        self._clients: Dict[Path, Tuple[Tuple[int, int], object]] = dict()
+
+        if available(self.path):
+            raise RuntimeError(f"An agent already listens on {self.path}.")
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        if self.path.exists():
+            self.path.unlink()
+
+        super().__init__(str(self.path), _RequestHandler)
+        os.chmod(self.path, 0o600)
+
+    def client(self, config_file: str):
+        """Client of a configuration file, created again if the file changed since the previous action"""
+
+        from clusty.clusters.client import ClusterClient
+        from clusty.configs.parser import ConfigsParser
+        from clusty.configs.state import SessionState
+
+        config_file = Path(config_file).resolve()
+        stat = config_file.stat()
+        signature = (stat.st_mtime_ns, stat.st_size)
+
+        cached = self._clients.get(config_file)
+        if cached is None or cached[0] != signature:
+            if cached is not None:
+                cached[1].release()
+            client = ClusterClient(configs=ConfigsParser.from_file(config_file),
+                                   state=SessionState.for_config(config_file))
+            self._clients[config_file] = (signature, client)
+
+        return self._clients[config_file][1]
+
+    def serve(self) -> None:
+        """Serve the actions until interrupted, then release the screens held attached"""
+
+        print(f"clusty agent listening on {self.path}")
+        try:
+            self.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            for _, client in self._clients.values():
+                client.release()
+            self.server_close()
+            if self.path.exists():
+                self.path.unlink()
+            print("clusty agent stopped.")
+
+
+def available(path: Path = None) -> bool:
+    """Whether an agent listens on the socket"""
+
+    path = socket_path if path is None else Path(path)
+    if not path.exists():
+        return False
+
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as connection:
+        connection.settimeout(connect_timeout)
+        try:
+            connection.connect(str(path))
+        except OSError:
+            return False
+
+    return True
+
+
+def logged_in(config_file: str) -> bool:
+    """
+    Whether starting a configuration file needs no credentials: none of its clusters is set up, and each has a live
+    control master connection
+    """
+
+    from clusty.clusters.registry import cluster_class
+    from clusty.configs.parser import ConfigsParser
+    from clusty.terminal.ssh import control_command
+
+    configs = ConfigsParser.from_file(config_file)
+    for cluster_configs in configs.get_clusters_configs() or [configs]:
+        cluster_id, ssh_alias, _, _, setup = cluster_configs.get_cluster_config()
+        ssh_alias = cluster_class(cluster_id)().alias if ssh_alias is None else ssh_alias
+        if setup or not control_command(ssh_alias, "check"):
+            return False
+
+    return True
+
+
+def request(action: str, config_file: str, batch_job: str = None, command: str = None, path: Path = None) -> int:
+    """
+    Send an action to the agent, writing the output streamed back to the standard output, and the error to the
+    standard error. Returns the exit status of the action.
+    """
+
+    path = socket_path if path is None else Path(path)
+    stdout = sys.stdout
+    message = {'action': action, 'config': str(Path(config_file).resolve()), 'batch_job': batch_job,
+               'command': command}
+
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as connection:
+        connection.settimeout(connect_timeout)
+        connection.connect(str(path))
+        connection.settimeout(None)
+        connection.sendall((json.dumps(message) + "\n").encode())
+
+        with connection.makefile('rb') as file:
+            for line in file:
+                response = json.loads(line)
+                if 'output' in response:
+                    stdout.write(response['output'])
+                    stdout.flush()
+                    continue
+
+                if response.get('error'):
+                    print(response['error'], file=sys.stderr)
+                return response['exit']
+
+    raise ConnectionError(f"The agent on {path} closed the connection before completing '{action}'.")
@@ -8,7 +8,8 @@ import pexpect
 from typing import List
 
 from clusty.terminal.screen import Screen
-from clusty.terminal.ssh import config_host
+from clusty.terminal.shell import Terminal
+from clusty.terminal.ssh import config_host, control_options
 from clusty.clusters.cluster import Cluster
 
 
@@ -18,6 +19,15 @@ class LeoMed2(Cluster):
     """
 
     wait_period = 0.1
+    submitted_pattern = None
+    pending_pattern = re.compile(r"srun: job (?P<job>[0-9]+) queued and waiting for resources")
+    # srun is silent when the resources are allocated right away, hence the batch shell reports its own start
+    started_pattern = re.compile(r"CLUSTY_STARTED (?P<job>[0-9]+) (?P<node>[-\w.]+)")
+    started_command = """bash -c 'printf "%s_%s %s %s\\n" CLUSTY STARTED "$SLURM_JOB_ID" "$(hostname)"; exec bash'"""
+    failed_pattern = re.compile(r"srun: error: |srun: Job allocation [0-9]+ has been revoked|srun: Force Terminated")
+    job_id_variable = "$SLURM_JOB_ID"
+    job_index_variable = "$SLURM_ARRAY_TASK_ID"
+    job_submitted_pattern = re.compile(r"Submitted batch job (?P<job>[0-9]+)")
 
     def __init__(self, ssh_alias: str = "medinfmk"):
         super().__init__(cluster_id="leomed2",
@@ -52,11 +62,16 @@ class LeoMed2(Cluster):
 
         ssh_alias = "medinfmk" if ssh_alias is None else ssh_alias
 
+        # Reuse the connection of a previous login, if still alive
+        screen_name = self.login_through_master(ssh_alias=ssh_alias, binding=binding, name=name)
+        if screen_name is not None:
+            return screen_name
+
         # Create and attach to a screen
         screen_name = self._id if name is None else name
         screen_name = Screen.create(name=screen_name)
-        terminal = pexpect.spawn(f"screen -r {screen_name}")
-        cmd = f"ssh {ssh_alias}"
+        terminal = Terminal(f"screen -r {screen_name}")
+        cmd = f"ssh {control_options()} {ssh_alias}"
         if binding is not None:
             cmd += f" -L {binding}"
         terminal.sendline(cmd)
@@ -69,24 +84,26 @@ class LeoMed2(Cluster):
         connection_timeout = (response == 3)
 
         if not login_success and not connection_timeout:
-            print(f"Welcome to the {self._name} login:")
-            # Verification code
-            i = 0
-            while i < 3 and not verification_code_success:
-                verification_code = getpass.getpass('Verification code: ')
-                terminal.sendline(verification_code)
-                response = terminal.expect_exact(['password', 'Verification code', 'Permission denied'])
-                verification_code_success = (response == 0)
-                i += 1
-
-            # Password
-            i = 0
-            while i < 3 and not password_success and verification_code_success:
-                password = getpass.getpass('Your ETH Zurich password: ')
-                terminal.sendline(password)
-                response = terminal.expect_exact(['Welcome', 'password', 'Permission denied'])
-                password_success = (response == 0)
-                i += 1
+            # Credentials, asked for one login at a time
+            with self.prompt_lock:
+                print(f"Welcome to the {self._name} login:")
+                # Verification code
+                i = 0
+                while i < 3 and not verification_code_success:
+                    verification_code = getpass.getpass('Verification code: ')
+                    terminal.sendline(verification_code)
+                    response = terminal.expect_exact(['password', 'Verification code', 'Permission denied'])
+                    verification_code_success = (response == 0)
+                    i += 1
+
+                # Password
+                i = 0
+                while i < 3 and not password_success and verification_code_success:
+                    password = getpass.getpass('Your ETH Zurich password: ')
+                    terminal.sendline(password)
+                    response = terminal.expect_exact(['Welcome', 'password', 'Permission denied'])
+                    password_success = (response == 0)
+                    i += 1
 
         # Detach from screen and close the terminal
         Screen.detach(terminal)
@@ -109,48 +126,46 @@ class LeoMed2(Cluster):
 
         return screen_name
 
-    def batch(self, screens: List[str], duration: int = 24, cpu: int = 10, memory: int = 10, gpu: int = 0,
-              gpu_model: str = 'GeForceGTX1080Ti') -> str:
-        """
-        Launch a batch job on LeoMed, with certain specifics
-        Requires a screen name, for a screen that is already logged in to LeoMed
-        """
+    def batch_command(self, duration: int, cpu: int, memory: int, gpu: int, gpu_model: str) -> str:
+        """Slurm command starting an interactive batch job on LeoMed 2.0"""
 
         # TODO: Check how to use the GPU model
-
         if gpu == 0:
-            cmd = f"srun --time {duration}:00:00 --cpus-per-task {cpu} --mem-per-cpu {memory} --pty bash"
+            cmd = f"srun --time {duration}:00:00 --cpus-per-task {cpu} --mem-per-cpu {memory} " \
+                  f"--pty {LeoMed2.started_command}"
         else:
             cmd = f"srun --time {duration}:00:00 --cpus-per-task {cpu} --mem-per-cpu {memory} --partition gpu " \
-                  f"--gres gpu:{gpu} --pty bash"
+                  f"--gres gpu:{gpu} --pty {LeoMed2.started_command}"
 
-        # Attach to the LeoMed screen and create a screen where to launch the batch process
-        terminal = Screen.attach_nested(screens=screens[:-1])
-        batch_screen = Screen.create(name=screens[-1], terminal=terminal)
-        terminal.sendline(f"screen -r {batch_screen}")
-        terminal.expect_list([pexpect.EOF, pexpect.TIMEOUT], timeout=LeoMed2.wait_period)
+        return cmd
 
-        # Launch the batch process
-        print(f"Launching batch job on {self._name} in screen '{batch_screen}'...")
-        terminal.sendline(cmd)
-        terminal.expect_list([pexpect.EOF, pexpect.TIMEOUT], timeout=30)
-        batch_output = terminal.before.decode()
-
-        job_pattern = re.compile(r"Job <([0-9]{3,5})> is submitted to queue", re.MULTILINE)
-        machine_pattern = re.compile(r"<<Starting on ([-\w]+)>>", re.MULTILINE)
-        job = job_pattern.findall(batch_output)
-        machine = machine_pattern.findall(batch_output)
-
-        # Detach from the batch screen
-        Screen.detach(terminal, level=2)
-        if len(job) == 1:
-            print(f"... batch job nr. '{job[0]}' launched on machine '{machine[0]}'")
+    def status_command(self, job_ids: List[str]) -> str:
+        """Slurm command printing the state of the given batch jobs"""
+
+        return f"squeue --noheader --jobs {','.join(job_ids)} --format '%i|%T|%L|%N|%C|%m'"
+
+    def job_directives(self, name: str, duration: int, cpu: int, memory: int, gpu: int, gpu_model: str,
+                       array: int = None) -> List[str]:
+        """Slurm directives of a job script on LeoMed 2.0"""
+
+        if array is None:
+            directives = [f"#SBATCH --job-name={name}", f"#SBATCH --output={name}.%j.out"]
         else:
-            print(f"... could not start the batch job on {self._name}")
-            Screen.quit(batch_screen, terminal)
+            directives = [f"#SBATCH --job-name={name}", f"#SBATCH --array=1-{array}",
+                          f"#SBATCH --output={name}.%A.%a.out"]
+        directives += [f"#SBATCH --time={duration}:00:00", f"#SBATCH --cpus-per-task={cpu}",
+                       f"#SBATCH --mem-per-cpu={memory}"]
+        if gpu != 0:
+            directives += ["#SBATCH --partition=gpu", f"#SBATCH --gres=gpu:{gpu}"]
 
-        # Detach from the Leomed screen
-        Screen.detach(terminal)
-        terminal.close()
+        return directives
+
+    def submit_command(self, script: str) -> str:
+        """Slurm command submitting a job script"""
+
+        return f"sbatch {script}"
+
+    def cancel_command(self, job_ids: List[str]) -> str:
+        """Slurm command cancelling the given batch jobs"""
 
-        return batch_screen
+        return f"scancel {' '.join(job_ids)}"
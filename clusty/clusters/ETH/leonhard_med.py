@@ -3,13 +3,13 @@ Author: @matteobe
 """
 
 from __future__ import annotations
-import re
 import getpass
 import pexpect
 from typing import List
 
 from clusty.terminal.screen import Screen
-from clusty.terminal.ssh import config_host
+from clusty.terminal.shell import Terminal
+from clusty.terminal.ssh import config_host, control_options
 from clusty.clusters.cluster import Cluster
 
 
@@ -24,6 +24,7 @@ class LeonhardMed(Cluster):
     name = "LeonhardMed"
 
     wait_period = 0.1
+    status_job_index = True
 
     # TODO: Add tenant parameter
     def __init__(self, ssh_alias: str = None):
@@ -64,11 +65,16 @@ class LeonhardMed(Cluster):
 
         ssh_alias = LeonhardMed.ssh_alias if ssh_alias is None else ssh_alias
 
+        # Reuse the connection of a previous login, if still alive
+        screen_name = self.login_through_master(ssh_alias=ssh_alias, binding=binding, name=name)
+        if screen_name is not None:
+            return screen_name
+
         # Create and attach to a screen
         screen_name = self._id if name is None else name
         screen_name = Screen.create(name=screen_name)
-        terminal = pexpect.spawn(f"screen -r {screen_name}")
-        cmd = f"ssh {ssh_alias}"
+        terminal = Terminal(f"screen -r {screen_name}")
+        cmd = f"ssh {control_options()} {ssh_alias}"
         if binding is not None:
             cmd += f" -L {binding}"
         terminal.sendline(cmd)
@@ -81,24 +87,26 @@ class LeonhardMed(Cluster):
         connection_timeout = (response == 3)
 
         if not login_success and not connection_timeout:
-            print(f"Welcome to the {self._name} login:")
-            # Verification code
-            i = 0
-            while i < 3 and not verification_code_success:
-                verification_code = getpass.getpass('Verification code: ')
-                terminal.sendline(verification_code)
-                response = terminal.expect_exact(['password', 'Verification code', 'Permission denied'])
-                verification_code_success = (response == 0)
-                i += 1
-
-            # Password
-            i = 0
-            while i < 3 and not password_success and verification_code_success:
-                password = getpass.getpass('ETHZ password: ')
-                terminal.sendline(password)
-                response = terminal.expect_exact(['Welcome', 'password', 'Permission denied'])
-                password_success = (response == 0)
-                i += 1
+            # Credentials, asked for one login at a time
+            with self.prompt_lock:
+                print(f"Welcome to the {self._name} login:")
+                # Verification code
+                i = 0
+                while i < 3 and not verification_code_success:
+                    verification_code = getpass.getpass('Verification code: ')
+                    terminal.sendline(verification_code)
+                    response = terminal.expect_exact(['password', 'Verification code', 'Permission denied'])
+                    verification_code_success = (response == 0)
+                    i += 1
+
+                # Password
+                i = 0
+                while i < 3 and not password_success and verification_code_success:
+                    password = getpass.getpass('ETHZ password: ')
+                    terminal.sendline(password)
+                    response = terminal.expect_exact(['Welcome', 'password', 'Permission denied'])
+                    password_success = (response == 0)
+                    i += 1
 
         # Detach from screen and close the terminal
         Screen.detach(terminal)
@@ -121,12 +129,8 @@ class LeonhardMed(Cluster):
 
         return screen_name
 
-    def batch(self, screens: List[str], duration: int = 24, cpu: int = 10, memory: int = 10000, gpu: int = 0,
-              gpu_model: str = 'GeForceGTX1080Ti') -> str:
-        """
-        Launch a batch job on LeoMed, with certain specifics
-        Requires a screen name, for a screen that is already logged in to LeoMed
-        """
+    def batch_command(self, duration: int, cpu: int, memory: int, gpu: int, gpu_model: str) -> str:
+        """LSF command starting an interactive batch job on LeoMed"""
 
         if gpu == 0:
             cmd = f'bsub -Is -W {duration}:00 -n {cpu} -R "rusage[mem={memory}]" bash'
@@ -134,33 +138,37 @@ class LeonhardMed(Cluster):
             cmd = f'bsub -Is -W {duration}:00 -n {cpu} -R "rusage[mem={memory},ngpus_excl_p=1]" '\
                   f'-R "select[gpu_model0=={gpu_model}]" bash'
 
-        # Attach to the LeoMed screen and create a screen where to launch the batch process
-        terminal = Screen.attach_nested(screens=screens[:-1])
-        batch_screen = Screen.create(name=screens[-1], terminal=terminal)
-        terminal.sendline(f"screen -r {batch_screen}")
-        terminal.expect_list([pexpect.EOF, pexpect.TIMEOUT], timeout=LeonhardMed.wait_period)
+        return cmd
 
-        # Launch the batch process
-        print(f"Launching batch job on {self._name} in screen '{batch_screen}'...")
-        terminal.sendline(cmd)
-        terminal.expect_list([pexpect.EOF, pexpect.TIMEOUT], timeout=30)
-        batch_output = terminal.before.decode()
-
-        job_pattern = re.compile(r"Job <([0-9]{3,5})> is submitted to queue", re.MULTILINE)
-        machine_pattern = re.compile(r"<<Starting on ([-\w]+)>>", re.MULTILINE)
-        job = job_pattern.findall(batch_output)
-        machine = machine_pattern.findall(batch_output)
-
-        # Detach from the batch screen
-        Screen.detach(terminal, level=2)
-        if len(job) == 1:
-            print(f"... batch job nr. '{job[0]}' launched on machine '{machine[0]}'")
+    def status_command(self, job_ids: List[str]) -> str:
+        """LSF command printing the state of the given batch jobs"""
+
+        return f"bjobs -noheader -o \"jobid jobindex stat time_left exec_host slots memory delimiter='|'\" " \
+               f"{' '.join(job_ids)}"
+
+    def job_directives(self, name: str, duration: int, cpu: int, memory: int, gpu: int, gpu_model: str,
+                       array: int = None) -> List[str]:
+        """LSF directives of a job script on LeonhardMed"""
+
+        if array is None:
+            directives = [f"#BSUB -J {name}", f"#BSUB -o {name}.%J.out"]
+        else:
+            directives = [f'#BSUB -J "{name}[1-{array}]"', f"#BSUB -o {name}.%J.%I.out"]
+        directives += [f"#BSUB -W {duration}:00", f"#BSUB -n {cpu}"]
+        if gpu == 0:
+            directives.append(f'#BSUB -R "rusage[mem={memory}]"')
         else:
-            print(f"... could not start the batch job on {self._name}")
-            Screen.kill(batch_screen, terminal)
+            directives += [f'#BSUB -R "rusage[mem={memory},ngpus_excl_p=1]"',
+                           f'#BSUB -R "select[gpu_model0=={gpu_model}]"']
 
-        # Detach from the Leomed screen
-        Screen.detach(terminal)
-        terminal.close()
+        return directives
+
+    def submit_command(self, script: str) -> str:
+        """LSF command submitting a job script"""
+
+        return f"bsub < {script}"
+
+    def cancel_command(self, job_ids: List[str]) -> str:
+        """LSF command cancelling the given batch jobs"""
 
-        return batch_screen
+        return f"bkill {' '.join(job_ids)}"
@@ -1,2 +1,12 @@
-from clusty.clusters.ETH.leomed1 import LeoMed1
-from clusty.clusters.ETH.leomed2 import LeoMed2
+import importlib
+
+from clusty.clusters.registry import builtin_clusters
+
+# The cluster classes are imported when first accessed, e.g. from clusty.clusters import LeoMed2
+_builtin_classes = {reference.split(':')[1]: reference.split(':')[0] for reference in builtin_clusters.values()}
+
+
+def __getattr__(name: str):
+    if name in _builtin_classes:
+        return getattr(importlib.import_module(_builtin_classes[name]), name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -3,14 +3,28 @@
 """
 
 import time
-from typing import Dict
-import importlib
+import shutil
+import threading
+from collections import Counter, deque
+from contextlib import nullcontext
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional, Tuple, Union
+from urllib.parse import urlsplit
 
 import pexpect
 
+from clusty.clusters.cluster import Allocation, Cluster, JobStatus
+from clusty.clusters.registry import cluster_class
 from clusty.configs.parser import ConfigsParser
-from clusty.terminal.screen import Screen
-from clusty.utils.string import replace_by_dict
+from clusty.configs.state import SessionState
+from clusty.terminal.command import run_command
+from clusty.terminal.log import LogTail
+from clusty.terminal.screen import Screen, ScreenSession
+from clusty.terminal.ssh import control_command
+from clusty.utils.network import connect_latency, free_local_port, http_latency, local_port, port_open
+from clusty.utils.output import output_prefix, prefixed_stdout
+from clusty.utils.string import format_table, replace_by_dict
+from clusty.utils.timing import percentile, span
 
 
 class ClusterClient:
@@ -19,115 +33,955 @@ class ClusterClient:
     file.
     """
 
-    clusters = {
-        'leomed1': 'LeoMed1',
-        'leomed2': 'LeoMed2'
-    }
+    # Warm pool: seconds between the checks of the pool allocations
+    pool_poll_period = 30
 
-    def __init__(self, configs: Dict):
-        self._configs = ConfigsParser(configs=configs)
+    # Tunnels monitor: seconds between the probes of the tunnels, and number of latencies kept per tunnel
+    tunnels_probe_period = 10
+    tunnels_latencies_kept = 1000
+
+    # Local ports chosen for the jupyter servers configured as 'auto', reserved until their tunnels are forwarded, such
+    # that clusters started concurrently do not pick the same one
+    _reserved_ports = set()
+    _reserved_ports_lock = threading.Lock()
+
+    def __init__(self, configs: Union[Dict, ConfigsParser], state: SessionState = None, prefix: str = ''):
+        self._configs = configs if isinstance(configs, ConfigsParser) else ConfigsParser(configs=configs)
+        self._state = SessionState.for_config(".clusty.yaml") if state is None else state
         self._cluster = None
+        # The cluster screen hosts a single SSH session, which only one terminal at a time can operate
+        self._lock = threading.RLock()
+        # Prefix of the lines printed for the cluster, identifying it among the clusters launched concurrently
+        self._prefix = prefix
+        # Screens of batch jobs held attached for running commands, by batch job
+        self._sessions = dict()
+        # Local and remote ports chosen for the jupyter servers configured as 'auto', by batch job, and the local ports
+        # reserved by the client
+        self._ports: Dict[str, Tuple[int, int]] = dict()
+        self._local_ports = set()
+
+        # Multi-cluster configuration files are handled by a client per cluster, each with its own state
+        self._clients = [ClusterClient(configs=cluster_configs,
+                                       state=self._state.for_cluster(cluster_configs.get_cluster_config()[0]),
+                                       prefix=f"[{cluster_configs.get_cluster_config()[0]}] ")
+                         for cluster_configs in self._configs.get_clusters_configs()]
 
     def set_cluster(self, cluster: str) -> None:
         """
         Define the cluster object to be used for executing the commands
         """
-        if cluster not in ClusterClient.clusters.keys():
-            raise ValueError(f"Invalid cluster name passed in.\n"
-                             f"Valid cluster names: {','.join(list(ClusterClient.clusters.keys()))}")
+        self._cluster = cluster_class(cluster)()
 
-        self._cluster = getattr(importlib.import_module(f"clusty.clusters"), ClusterClient.clusters[cluster])()
-
-    def start(self):
+    def start(self, restart: bool = False):
         """
-        Start all the steps as defined in the configuration file
+        Start all the steps as defined in the configuration file. When reusing the connection of a previous start
+        whose batch jobs or tunnels are still recorded, these are stopped first if restarting, otherwise the start is
+        refused.
         """
 
+        if self._clients:
+            self._run_clients(lambda client: client.start(restart=restart))
+            return
+
         # Links to open
         links = list()
 
         # Setup the cluster and the screens
         name, alias, batch_jobs, tunnels, setup = self._configs.get_cluster_config()
         self.set_cluster(cluster=name)
+        alias = self._cluster.alias if alias is None else alias
+        with span("client.start", cluster=name):
+            if setup:
+                self._cluster.setup()
+            with span("client.login"):
+                cluster_screen = self._recorded_login(cluster_id=name, ssh_alias=alias, restart=restart)
+                if cluster_screen is None:
+                    cluster_screen = self._cluster.login(ssh_alias=alias)
+                    self._state.set_cluster(cluster_id=name, screen=cluster_screen,
+                                            pid=self._screen_pid(cluster_screen), ssh_alias=alias)
+
+            # Execute the batch jobs, launching up to the configured number of them concurrently
+            tunnels_ips = dict()
+            self._ports = dict()
+            with span("client.batch_jobs"), prefixed_stdout(), \
+                    ThreadPoolExecutor(max_workers=self._configs.get_cluster_concurrency()) as executor:
+                futures = [(batch_job, executor.submit(self._start_batch_job, cluster_screen, batch_job))
+                           for batch_job in batch_jobs]
+                for batch_job, future in futures:
+                    try:
+                        ip_address, batch_job_links = future.result()
+                        links.extend(batch_job_links)
+                        if ip_address is not None:
+                            tunnels_ips[batch_job] = ip_address
+                    except Exception as e:
+                        print(f"Batch job '{batch_job}' failed: {e}")
+
+            # Create the tunnels, once all the batch jobs have their IP address. Tunnels are forwarded through the
+            # control master connection opened at login, falling back to a login screen per tunnel. Batch jobs without
+            # IP address (failed batch jobs and job arrays) get no tunnel. Ports 'auto' are replaced by the ports
+            # chosen for the jupyter server of the batch job, before the batch job is replaced by its IP address
+            unreachable_batch_jobs = [batch_job for batch_job in batch_jobs if batch_job not in tunnels_ips]
+            tunnels = [tunnel for tunnel in tunnels if tunnel.split(':')[-2] not in unreachable_batch_jobs]
+            tunnels_ports = dict()
+            for batch_job, (local, remote) in self._ports.items():
+                tunnels_ports[f"auto:{batch_job}:"] = f"{local}:{batch_job}:"
+                tunnels_ports[f":{batch_job}:auto"] = f":{batch_job}:{remote}"
+            tunnels = replace_by_dict(values=tunnels, replace=tunnels_ports)
+            tunnels = replace_by_dict(values=tunnels, replace=tunnels_ips)
+            try:
+                with span("client.tunnels"):
+                    for idx, tunnel in enumerate(tunnels):
+                        if self._cluster.forward(binding=tunnel, ssh_alias=alias):
+                            print(f"Forwarded '{tunnel}' through the connection to {alias}")
+                            self._state.add_tunnel(binding=tunnel)
+                        else:
+                            name = "tunnel" if idx == 0 else f"tunnel{idx}"
+                            tunnel_screen = self._cluster.login(ssh_alias=alias, binding=tunnel, name=name)
+                            self._state.add_tunnel(binding=tunnel, screen=tunnel_screen,
+                                                   pid=self._screen_pid(tunnel_screen))
+            finally:
+                # The local ports are bound by the tunnels from now on
+                with ClusterClient._reserved_ports_lock:
+                    ClusterClient._reserved_ports.difference_update(self._local_ports)
+                    self._local_ports.clear()
+
+            # Open links in the default browser
+            # TODO: Optimize link opening
+            with span("client.open_links"):
+                for link in links:
+                    terminal = pexpect.spawn(f"open {link}")
+                    time.sleep(0.2)
+                    terminal.close(force=True)
+
+    def _start_batch_job(self, cluster_screen: str, batch_job: str) -> Tuple[str, List[str]]:
+        """
+        Launch a batch job and execute its commands once the batch job is allocated. Returns the IP address of the
+        batch job and the links to open locally.
+        """
+
+        if self._configs.get_batch_job_backend(batch_job) == 'script':
+            return self._submit_batch_job(batch_job)
+
+        links = list()
+        with output_prefix(f"{self._prefix}[{batch_job}] "), \
+                span("client.batch_job", cluster=self._cluster.id, batch_job=batch_job):
+            # Claim a started allocation of the warm pool, or launch the batch job and wait for its allocation
+            allocation = self._claim_pool_allocation(batch_job)
+            if allocation is None:
+                with self._lock:
+                    allocation = self._cluster.batch(screens=[cluster_screen,
+                                                              self._configs.get_batch_job_screen_name(batch_job)],
+                                                     wait=False, **self._configs.get_batch_job_specs(batch_job))
+                self._state.update_batch_job(batch_job, screen=allocation.screen)
+                with span("client.wait_allocation"):
+                    allocation = self._wait_allocation(screens=[cluster_screen, allocation.screen],
+                                                       allocation=allocation,
+                                                       max_wait=self._configs.get_batch_job_max_wait(batch_job))
+            screens = [cluster_screen, allocation.screen]
+            self._state.update_batch_job(batch_job, screen=allocation.screen, job_id=allocation.job_id,
+                                         node=allocation.node)
+
+            # Provision the batch job, staying attached to its screens for the whole sequence. The batch screen is
+            # attached in a terminal of its own through the control master connection, such that batch jobs are
+            # provisioned concurrently, or else through the cluster screen, one batch job at a time
+            ssh_alias = self._state.cluster['ssh_alias']
+            if control_command(ssh_alias, "check"):
+                lock, session = nullcontext(), ScreenSession(screens=[allocation.screen], ssh_alias=ssh_alias)
+            else:
+                lock, session = self._lock, ScreenSession(screens=screens)
+            with lock, span("client.provision"), session:
+                # Read the IP address
+                batch_job_ip_address = self._cluster.ip_address(screens=session)
+                self._state.update_batch_job(batch_job, ip_address=batch_job_ip_address)
+
+                # Load the environment variables and run the commands list. Consecutive environment declarations
+                # and plain commands are grouped in a single script, up to the next singularity or jupyter launch
+                script_mode = self._configs.get_batch_job_provisioning(batch_job) == 'script'
+                pending = list(self._configs.get_batch_job_env(batch_job))
+                for cmd in self._configs.get_batch_job_commands(batch_job) + [None]:
+                    if cmd in ['SINGULARITY', 'JUPYTER', None] and pending:
+                        if script_mode:
+                            self._cluster.run_script(screens=session, commands=pending)
+                        else:
+                            self._cluster.run(screens=session, commands=pending)
+                        pending = list()
+
+                    if cmd == 'SINGULARITY':
+                        self._cluster.launch_singularity(screens=session,
+                                                         **self._configs.get_singularity_configs(batch_job))
+                    elif cmd == 'JUPYTER':
+                        jupyter = self._configs.get_jupyter_configs(batch_job)
+                        if jupyter['port'] == 'auto':
+                            jupyter['port'] = self._cluster.free_port(screens=session)
+                            jupyter['local_port'] = self._reserve_local_port()
+                            self._record_ports(batch_job, local=jupyter['local_port'], remote=jupyter['port'])
+                        url_local = self._cluster.launch_jupyter(screens=session, **jupyter)
+                        links.append(url_local)
+                        self._state.update_batch_job(batch_job, urls=links)
+                    elif cmd is not None:
+                        pending.append(cmd)
+
+        return batch_job_ip_address, links
+
+    def _submit_batch_job(self, batch_job: str) -> Tuple[str, List[str]]:
+        """
+        Submit a batch job as a job script with a single SSH exec, and follow its output file until the batch job
+        starts and its jupyter server reports its URL. No terminal is held, hence the cluster screen is not locked.
+        Returns the IP address of the batch job and the links to open locally. Sweeps are submitted as job arrays,
+        without IP address.
+        """
+
+        ssh_alias = self._state.cluster['ssh_alias']
+        name = self._configs.get_batch_job_screen_name(batch_job)
+        commands = self._configs.get_batch_job_commands(batch_job)
+        singularity = self._configs.get_singularity_configs(batch_job) if 'SINGULARITY' in commands else None
+        jupyter = self._configs.get_jupyter_configs(batch_job) if 'JUPYTER' in commands else None
+        sweep = self._configs.get_batch_job_sweep(batch_job)
+
+        with output_prefix(f"{self._prefix}[{batch_job}] "), \
+                span("client.batch_job", cluster=self._cluster.id, batch_job=batch_job):
+            script = self._cluster.job_script(name=name, commands=commands,
+                                              env=self._configs.get_batch_job_env(batch_job),
+                                              singularity=singularity, jupyter=jupyter, sweep=sweep,
+                                              **self._configs.get_batch_job_specs(batch_job))
+            allocation = self._cluster.submit(ssh_alias=ssh_alias, name=name, script=script)
+
+            # Job arrays are not waited for, since their tasks start as the scheduler allocates them
+            if sweep:
+                self._state.update_batch_job(batch_job, screen=None, job_id=allocation.job_id, sweep=sweep,
+                                             output_file=self._cluster.job_output_file(name, allocation.job_id, '*'),
+                                             output_files=[self._cluster.job_output_file(name, allocation.job_id, index)
+                                                           for index in range(1, len(sweep) + 1)])
+                print(f"... job array of {len(sweep)} parameter sets submitted")
+                return None, list()
+
+            self._state.update_batch_job(batch_job, screen=None, job_id=allocation.job_id,
+                                         output_file=self._cluster.job_output_file(name, allocation.job_id))
+
+            # The job script picks the port of a jupyter server configured as 'auto' on the node
+            local_port = None
+            if jupyter is not None and jupyter['port'] == 'auto':
+                local_port = self._reserve_local_port()
+
+            try:
+                allocation, ip_address, links, port = self._cluster.wait_job(
+                    ssh_alias=ssh_alias, name=name, allocation=allocation,
+                    max_wait=self._configs.get_batch_job_max_wait(batch_job),
+                    jupyter_timeout=None if jupyter is None else jupyter['timeout'], local_port=local_port)
+            except (RuntimeError, TimeoutError):
+                self._cluster.cancel(ssh_alias=ssh_alias, job_ids=[allocation.job_id])
+                raise
+            if local_port is not None:
+                self._record_ports(batch_job, local=local_port, remote=port)
+            self._state.update_batch_job(batch_job, node=allocation.node, ip_address=ip_address, urls=links)
+
+        return ip_address, links
+
+    def _reserve_local_port(self) -> int:
+        """Reserve a free local port for a jupyter server configured as 'auto', until the tunnels are forwarded"""
+
+        with ClusterClient._reserved_ports_lock:
+            port = free_local_port(Cluster.auto_ports, exclude=ClusterClient._reserved_ports)
+            ClusterClient._reserved_ports.add(port)
+            self._local_ports.add(port)
+
+        return port
+
+    def _record_ports(self, batch_job: str, local: int, remote: int) -> None:
+        """Record the ports chosen for the jupyter server of a batch job, for its tunnels"""
+
+        self._ports[batch_job] = (local, remote)
+        self._state.update_batch_job(batch_job, port=remote, local_port=local)
+
+    def _wait_allocation(self, screens: List[str], allocation: Allocation, max_wait: float) -> Allocation:
+        """
+        Wait for the batch job in the nested screens to start, releasing the cluster screen in between the checks so
+        that other batch jobs can be launched in the meantime
+        """
+
+        start = time.monotonic()
+        last_progress = start
+        while True:
+            with self._lock:
+                allocation = self._cluster.allocation(screens=screens, allocation=allocation)
+            if allocation.started:
+                print(f"... batch job nr. '{allocation.job_id}' started on node '{allocation.node}'")
+                return allocation
+
+            if allocation.failed or time.monotonic() - start > max_wait:
+                with self._lock:
+                    terminal = Screen.attach(screen=screens[0])
+                    Screen.kill(name=screens[-1], terminal=terminal)
+                    Screen.detach(terminal)
+                    terminal.close()
+                if allocation.failed:
+                    raise RuntimeError(f"Batch job nr. '{allocation.job_id}' failed to start.")
+                raise TimeoutError(f"Batch job nr. '{allocation.job_id}' did not start within {max_wait} seconds "
+                                   f"({allocation.state}).")
+
+            if time.monotonic() - last_progress >= self._cluster.batch_progress_period:
+                last_progress = time.monotonic()
+                print(f"... batch job nr. '{allocation.job_id}' {allocation.state} for {last_progress - start:.0f} s")
+            time.sleep(self._cluster.batch_poll_period)
+
+    def _claim_pool_allocation(self, batch_job: str) -> Optional[Allocation]:
+        """
+        Take a started allocation matching the resources of a batch job out of the warm pool of the cluster, if a pool
+        runs on the same connection. The allocation with the most walltime left is claimed.
+        """
+
+        pool_state = self._state.for_pool()
+        specs = self._configs.get_batch_job_specs(batch_job)
+        with pool_state.file_lock():
+            if not pool_state.load() or pool_state.cluster['id'] != self._cluster.id \
+                    or pool_state.cluster['ssh_alias'] != self._state.cluster['ssh_alias']:
+                return None
+
+            now = time.time()
+            candidates = [(entry['end'], name) for name, entry in pool_state.batch_jobs.items()
+                          if entry['state'] == 'started' and entry['specs'] == specs and entry['end'] > now]
+            if not candidates:
+                return None
+
+            end, name = max(candidates)
+            entry = pool_state.batch_jobs[name]
+            pool_state.remove_batch_job(name)
+
+        print(f"... claimed warm batch job nr. '{entry['job_id']}' on node '{entry['node']}' "
+              f"({(end - now) / 3600:.1f} h of walltime left)")
+        return Allocation(screen=entry['screen'], job_id=entry['job_id'], state='started', node=entry['node'])
+
+    def pool(self) -> None:
+        """
+        Keep allocations matching the resources of the batch jobs listed in the pool configuration idle in screens on
+        the cluster, such that starting these batch jobs claims a started allocation instead of waiting in the queue.
+        Allocations are replaced before their walltime expires. The pool is released once no allocation was claimed
+        for the idle time, or when interrupted.
+        """
+
+        if self._clients:
+            self._run_clients(ClusterClient.pool)
+            return
+
+        name, alias, _, _, setup = self._configs.get_cluster_config()
+        counts, idle_time, refresh_margin = self._configs.get_cluster_pool()
+        if not counts:
+            raise ValueError(f"No pool configured for cluster '{name}'.")
+
+        self.set_cluster(cluster=name)
+        alias = self._cluster.alias if alias is None else alias
         if setup:
             self._cluster.setup()
-        cluster_screen = self._cluster.login(ssh_alias=alias)
-
-        # Execute the batch jobs
-        tunnels_ips = dict()
-        for batch_job in batch_jobs:
-            batch_screen = self._cluster.batch(screens=[cluster_screen,
-                                                        self._configs.get_batch_job_screen_name(batch_job)],
-                                               **self._configs.get_batch_job_specs(batch_job))
-            screens = [cluster_screen, batch_screen]
-
-            # Read the IP address
-            batch_job_ip_address = self._cluster.ip_address(screens=screens)
-            tunnels_ips[batch_job] = batch_job_ip_address
-
-            # Load environment variables
-            env_vars = self._configs.get_batch_job_env(batch_job)
-            if env_vars is not None:
-                self._cluster.run(screens=screens, commands=env_vars)
-
-            # Run commands list
-            for cmd in self._configs.get_batch_job_commands(batch_job):
-                if cmd == 'SINGULARITY':
-                    self._cluster.launch_singularity(screens=screens,
-                                                     **self._configs.get_singularity_configs(batch_job))
-                elif cmd == 'JUPYTER':
-                    url_local = self._cluster.launch_jupyter(screens=screens,
-                                                             **self._configs.get_jupyter_configs(batch_job))
-                    links.append(url_local)
-                else:
-                    self._cluster.run(screens=screens, commands=cmd)
-
-        # Create the tunnels
-        tunnels = replace_by_dict(values=tunnels, replace=tunnels_ips)
-        for idx, tunnel in enumerate(tunnels):
-            name = "tunnel" if idx == 0 else f"tunnel{idx}"
-            self._cluster.login(ssh_alias=alias, binding=tunnel, name=name)
-
-        # Open links in the default browser
-        # TODO: Optimize link opening
-        for link in links:
-            terminal = pexpect.spawn(f"open {link}")
-            time.sleep(0.2)
-            terminal.close(force=True)
 
-    # TODO: Test feature to make sure it behaves correctly
-    # TODO: Problem, because screen name is not same as cluster name
+        pool_state = self._state.for_pool()
+        if pool_state.load() and Screen.list(name=self._recorded_cluster_screen(pool_state), exact_name_match=True):
+            raise RuntimeError(f"A pool already runs for cluster '{name}', recorded in {pool_state.path}.")
+
+        cluster_screen = self._cluster.login(ssh_alias=alias, name=f"{name}_pool")
+        with pool_state.file_lock():
+            # Release the allocations left over by a pool that did not terminate
+            if pool_state.load():
+                self._release_pool(cluster_screen, pool_state, list(pool_state.batch_jobs.keys()))
+            pool_state.set_cluster(cluster_id=name, screen=cluster_screen, pid=self._screen_pid(cluster_screen),
+                                   ssh_alias=alias)
+
+        print(f"Keeping a pool of {', '.join([f'{count} {batch_job}' for batch_job, count in counts.items()])} "
+              f"batch jobs on {alias}, released after {idle_time} s without claims.")
+        pooled = set()
+        last_claim = time.monotonic()
+        try:
+            while time.monotonic() - last_claim < idle_time:
+                with pool_state.file_lock():
+                    pool_state.load()
+                    # Allocations are only removed by the pool while it holds the lock, or claimed by a start
+                    if pooled - set(pool_state.batch_jobs.keys()):
+                        last_claim = time.monotonic()
+                    self._refresh_pool(cluster_screen, pool_state, counts, refresh_margin)
+                    pooled = set(pool_state.batch_jobs.keys())
+                time.sleep(self.pool_poll_period)
+            print(f"No allocation claimed for {idle_time} s, releasing the pool.")
+        except KeyboardInterrupt:
+            print("Releasing the pool.")
+        finally:
+            with pool_state.file_lock():
+                pool_state.load()
+                self._release_pool(cluster_screen, pool_state, list(pool_state.batch_jobs.keys()))
+                pool_state.clear()
+            Screen.kill(cluster_screen)
+
+    def _refresh_pool(self, cluster_screen: str, pool_state: SessionState, counts: Dict[str, int],
+                      refresh_margin: int) -> None:
+        """
+        Drop the pool allocations whose batch job ended, follow the queued ones, and launch replacements for the ones
+        whose walltime expires within the refresh margin. Expiring allocations are released once their replacements
+        started, or at the latest when their walltime ends.
+        """
+
+        entries = pool_state.batch_jobs
+        job_ids = [entry['job_id'] for entry in entries.values() if entry['state'] == 'started']
+        if job_ids:
+            statuses = self._cluster.job_status(screens=[cluster_screen], job_ids=job_ids)
+            ended = [name for name, entry in entries.items()
+                     if entry['state'] == 'started' and entry['job_id'] not in statuses]
+            self._release_pool(cluster_screen, pool_state, ended)
+
+        for name, entry in list(entries.items()):
+            if entry['state'] == 'started':
+                continue
+            allocation = self._cluster.allocation(screens=[cluster_screen, entry['screen']],
+                                                  allocation=Allocation(screen=entry['screen'], job_id=entry['job_id'],
+                                                                        state=entry['state'], node=entry['node']))
+            end = time.time() + entry['specs']['duration'] * 3600 if allocation.started else None
+            pool_state.update_batch_job(name, job_id=allocation.job_id, state=allocation.state, node=allocation.node,
+                                        end=end)
+            if allocation.failed:
+                self._release_pool(cluster_screen, pool_state, [name])
+
+        now = time.time()
+        for batch_job, count in counts.items():
+            pool = {name: entry for name, entry in entries.items() if entry['batch_job'] == batch_job}
+            fresh = [entry for entry in pool.values() if entry['end'] is None or entry['end'] - now > refresh_margin]
+            for _ in range(count - len(fresh)):
+                specs = self._configs.get_batch_job_specs(batch_job)
+                screen_name = f"pool_{self._configs.get_batch_job_screen_name(batch_job)}"
+                allocation = self._cluster.batch(screens=[cluster_screen, screen_name], wait=False, **specs)
+                pool_state.update_batch_job(allocation.screen, batch_job=batch_job, specs=specs,
+                                            screen=allocation.screen, job_id=allocation.job_id,
+                                            state=allocation.state, node=None, end=None)
+
+            replaced = len([entry for entry in fresh if entry['state'] == 'started']) >= count
+            expiring = [name for name, entry in pool.items() if entry['end'] is not None]
+            expiring = [name for name in expiring if pool[name]['end'] - now <= refresh_margin]
+            expiring = [name for name in expiring if replaced or pool[name]['end'] <= now]
+            self._release_pool(cluster_screen, pool_state, expiring)
+
+    @staticmethod
+    def _release_pool(cluster_screen: str, pool_state: SessionState, names: List[str]) -> None:
+        """Kill the screens of pool allocations, which ends their batch jobs, and forget them"""
+
+        if not names:
+            return
+
+        terminal = Screen.attach(screen=cluster_screen)
+        for name in names:
+            entry = pool_state.batch_jobs[name]
+            Screen.kill(name=entry['screen'], terminal=terminal)
+            print(f"Released warm batch job nr. '{entry['job_id']}' in screen '{entry['screen']}'.")
+            pool_state.remove_batch_job(name)
+        Screen.detach(terminal)
+        terminal.close()
+
+    def _run_clients(self, method: Callable[['ClusterClient'], None]) -> None:
+        """
+        Run a method of the client of each cluster concurrently, with the lines printed for each cluster prefixed by
+        its identifier. A failure of one cluster does not interrupt the others.
+        """
+
+        def run(client: 'ClusterClient') -> None:
+            with output_prefix(client._prefix):
+                method(client)
+
+        with prefixed_stdout(), ThreadPoolExecutor(max_workers=len(self._clients)) as executor:
+            futures = [(client, executor.submit(run, client)) for client in self._clients]
+            for client, future in futures:
+                try:
+                    future.result()
+                except Exception as e:
+                    print(f"Cluster '{client._configs.get_cluster_config()[0]}' failed: {e}")
+
+    @staticmethod
+    def _screen_pid(name: str) -> int:
+        """Retrieve the PID of a local screen"""
+
+        screens = Screen.list(name=name, exact_name_match=True)
+        return screens[0].pid if screens else None
+
+    def _recorded_cluster_screen(self, state: SessionState = None) -> str:
+        """Identifier of the cluster screen recorded in the state (by default, the state of the session)"""
+
+        cluster = (self._state if state is None else state).cluster
+        return cluster['screen'] if cluster['pid'] is None else f"{cluster['pid']}.{cluster['screen']}"
+
+    def _recorded_login(self, cluster_id: str, ssh_alias: str, restart: bool = False) -> Optional[str]:
+        """
+        Reuse the cluster screen recorded by a previous start, if it still exists and its connection to the cluster is
+        alive. The batch jobs and tunnels recorded by that start are stopped if restarting, otherwise the start is
+        refused while they are recorded. Returns the cluster screen identifier, or None if a new login is required.
+        """
+
+        if not self._state.load() or self._state.cluster['id'] != cluster_id \
+                or self._state.cluster['ssh_alias'] != ssh_alias:
+            return None
+
+        cluster_screen = self._recorded_cluster_screen()
+        if not Screen.list(name=cluster_screen, exact_name_match=True) or not control_command(ssh_alias, "check"):
+            return None
+
+        # The batch jobs and tunnels of the previous start are only replaced by the ones launched now on request
+        recorded = list()
+        if self._state.batch_jobs:
+            recorded.append("batch jobs " + ", ".join([
+                f"'{name}'" + (f" (nr. {batch_job['job_id']})" if batch_job.get('job_id') else "")
+                for name, batch_job in self._state.batch_jobs.items()]))
+        if self._state.tunnels:
+            recorded.append("tunnels " + ", ".join([f"'{tunnel['binding']}'" for tunnel in self._state.tunnels]))
+        if recorded and not restart:
+            raise RuntimeError(f"The {' and '.join(recorded)} of the previous start are still running. Stop them with "
+                               f"'clusty stop', or with 'clusty start --restart' to start again right away.")
+
+        print(f"Reusing the connection to {ssh_alias} on screen: '{self._state.cluster['screen']}'")
+        if recorded:
+            print(f"Stopping the {' and '.join(recorded)} of the previous start...")
+            self._stop_batch_jobs(cluster_screen)
+            self._state.clear_batch_jobs()
+
+        return cluster_screen
+
+    def attach(self, batch_job: str = None) -> None:
+        """
+        Attach the current terminal to the screen of a batch job, or to the cluster screen if no batch job is given,
+        as recorded when starting
+        """
+
+        if self._clients:
+            client, batch_job = self._target_client(target=batch_job)
+            client.attach(batch_job=batch_job)
+            return
+
+        # Screens held attached by this client (e.g. the agent) cannot be attached to another terminal
+        self.release()
+        screens = self._recorded_screens(batch_job)
+
+        columns, lines = shutil.get_terminal_size()
+        terminal = pexpect.spawn(f"screen -r {screens[0]}", dimensions=(lines, columns))
+        for screen in screens[1:]:
+            terminal.sendline(f"screen -r {screen}")
+        terminal.interact()
+
+    def logs(self, batch_job: str = None, follow: bool = False) -> None:
+        """
+        Print the log of the screen of a batch job recorded when starting (the output file of batch jobs submitted as
+        job scripts, or the output files of the tasks of a job array), or of the cluster screen if no batch job is
+        given, without attaching to the screens. When following, the new output is printed until interrupted.
+        """
+
+        if self._clients:
+            client, batch_job = self._target_client(target=batch_job)
+            client.logs(batch_job=batch_job, follow=follow)
+            return
+
+        if not self._state.load():
+            raise RuntimeError(f"No session recorded in {self._state.path}, start one first.")
+
+        # The cluster screen runs locally, the screens of the batch jobs and the job scripts on the cluster
+        if batch_job is None:
+            log_tail = LogTail(Screen.log_file(self._state.cluster['screen']))
+        else:
+            batch_jobs = self._state.batch_jobs
+            if batch_job not in batch_jobs:
+                raise ValueError(f"Batch job '{batch_job}' not recorded.\n"
+                                 f"Recorded batch jobs: {', '.join(batch_jobs.keys())}")
+            if batch_jobs[batch_job].get('output_files'):
+                self._array_logs(batch_jobs[batch_job]['output_files'], follow=follow)
+                return
+            log_file = batch_jobs[batch_job]['output_file'] if batch_jobs[batch_job].get('screen') is None else \
+                Screen.log_file(batch_jobs[batch_job]['screen'])
+            log_tail = LogTail(log_file, ssh_alias=self._state.cluster['ssh_alias'])
+
+        print(log_tail.read(), end='', flush=True)
+        if follow:
+            log_tail.follow()
+
+    def _array_logs(self, output_files: List[str], follow: bool = False) -> None:
+        """
+        Print the output files of the tasks of a job array, each line prefixed by the index of its task. Each file is
+        read from its own offset, and followed along with the other ones until interrupted.
+        """
+
+        log_tails = [(f"[{index}] ", LogTail(output_file, ssh_alias=self._state.cluster['ssh_alias']))
+                     for index, output_file in enumerate(output_files, start=1)]
+        try:
+            while True:
+                for prefix, log_tail in log_tails:
+                    for line in log_tail.lines():
+                        print(f"{prefix}{line}", flush=True)
+                if not follow:
+                    return
+                time.sleep(LogTail.follow_period)
+        except KeyboardInterrupt:
+            pass
+
+    def _target_client(self, target: Optional[str]) -> Tuple['ClusterClient', Optional[str]]:
+        """
+        Client of the cluster of a multi-cluster configuration targeted by the cluster identifier, or by the name of a
+        batch job, prefixed with the cluster identifier and a colon if several clusters launch it (e.g.
+        leomed2:jupyter). Returns the client and the batch job, None when targeting the cluster itself.
+        """
+
+        clients = {client._configs.get_cluster_config()[0]: client for client in self._clients}
+        if target is None:
+            raise ValueError(f"Several clusters configured, give one of them: {', '.join(clients.keys())}")
+
+        if target in clients:
+            return clients[target], None
+
+        if ':' in target:
+            cluster_id, batch_job = target.split(':', 1)
+            if cluster_id not in clients:
+                raise ValueError(f"Cluster '{cluster_id}' not configured.\n"
+                                 f"Configured clusters: {', '.join(clients.keys())}")
+            return clients[cluster_id], batch_job
+
+        cluster_ids = [cluster_id for cluster_id, client in clients.items()
+                       if target in client._configs.get_cluster_config()[2]]
+        if not cluster_ids:
+            raise ValueError(f"Batch job '{target}' not launched by any of the clusters: {', '.join(clients.keys())}")
+        if len(cluster_ids) > 1:
+            raise ValueError(f"Batch job '{target}' launched by several clusters, give one of: "
+                             f"{', '.join([f'{cluster_id}:{target}' for cluster_id in cluster_ids])}")
+        return clients[cluster_ids[0]], target
+
+    def _recorded_screens(self, batch_job: str = None) -> List[str]:
+        """Nested screens of a batch job recorded when starting, or the cluster screen alone if no batch job is given"""
+
+        if not self._state.load():
+            raise RuntimeError(f"No session recorded in {self._state.path}, start one first.")
+
+        screens = [self._recorded_cluster_screen()]
+        if batch_job is not None:
+            batch_jobs = self._state.batch_jobs
+            if batch_job not in batch_jobs:
+                raise ValueError(f"Batch job '{batch_job}' not recorded.\n"
+                                 f"Recorded batch jobs: {', '.join(batch_jobs.keys())}")
+            if batch_jobs[batch_job].get('screen') is None:
+                raise ValueError(f"Batch job '{batch_job}' runs as a job script without screen, its output is written "
+                                 f"to {batch_jobs[batch_job].get('output_file')} on the cluster.")
+            screens.append(batch_jobs[batch_job]['screen'])
+
+        return screens
+
+    def run(self, batch_job: str, command: str) -> None:
+        """
+        Run a shell command in the screen of a batch job recorded when starting, printing its output. The screens stay
+        attached for the following commands until released, such that the commands of a long-lived client (the agent)
+        are sent right away.
+        """
+
+        if self._clients:
+            client, batch_job = self._target_client(target=batch_job)
+            if batch_job is None:
+                raise ValueError("Commands run in a batch job, give it as <cluster>:<batch_job>.")
+            client.run(batch_job=batch_job, command=command)
+            return
+
+        if batch_job is None:
+            raise ValueError("Commands run in a batch job, give its name.")
+        screens = self._recorded_screens(batch_job)
+
+        with self._lock:
+            session = self._sessions.get(batch_job)
+            if session is not None and session.screens != screens:
+                self.release()
+                session = None
+            if session is None:
+                session = ScreenSession(screens=screens)
+                session.attach()
+                self._sessions[batch_job] = session
+
+            try:
+                result = run_command(session.terminal, command, timeout=Cluster.command_timeout)
+            except Exception:
+                self.release()
+                raise
+
+        if result.output:
+            print(result.output)
+        if not result.success:
+            print(f"... '{command}' failed with exit status {result.exit_code}")
+
+    def release(self) -> None:
+        """Detach from the screens held attached for running commands"""
+
+        for client in self._clients:
+            client.release()
+
+        with self._lock:
+            for session in self._sessions.values():
+                try:
+                    session.detach()
+                except (pexpect.ExceptionPexpect, OSError):
+                    session.terminal.close(force=True)
+                    session.terminal = None
+            self._sessions = dict()
+
+    def status(self) -> None:
+        """
+        Print the state of the batch jobs and tunnels recorded when starting. The state of all the batch jobs is
+        queried with a single scheduler command, run in the cluster screen.
+        """
+
+        if self._clients:
+            for idx, client in enumerate(self._clients):
+                if idx > 0:
+                    print()
+                print(f"Cluster '{client._configs.get_cluster_config()[0]}':")
+                client.status()
+            return
+
+        if not self._state.load():
+            print(f"No session recorded in {self._state.path}.")
+            return
+
+        self.set_cluster(cluster=self._state.cluster['id'])
+        batch_jobs = self._state.batch_jobs
+        job_ids = [batch_job['job_id'] for batch_job in batch_jobs.values() if batch_job.get('job_id')]
+
+        cluster_screen = self._recorded_cluster_screen()
+        cluster_connected = len(Screen.list(name=cluster_screen, exact_name_match=True)) > 0
+        statuses = dict()
+        if cluster_connected and job_ids:
+            statuses = self._cluster.job_status(screens=[cluster_screen], job_ids=job_ids)
+
+        rows = list()
+        for name, batch_job in batch_jobs.items():
+            job_id = batch_job.get('job_id')
+            if not cluster_connected:
+                job_status = JobStatus(job_id=job_id, state='DISCONNECTED')
+            elif batch_job.get('sweep'):
+                tasks = Counter([status.state for task_id, status in statuses.items()
+                                 if Cluster.array_job_id(task_id) == job_id])
+                state = ", ".join([f"{count} {state}" for state, count in tasks.items()]) if tasks else 'NOT FOUND'
+                job_status = JobStatus(job_id=job_id, state=f"{state} (of {len(batch_job['sweep'])})")
+            else:
+                job_status = statuses.get(job_id, JobStatus(job_id=job_id, state='NOT FOUND'))
+            rows.append([name, job_id, job_status.state, job_status.time_left,
+                         job_status.node or batch_job.get('node'), job_status.cpus, job_status.memory,
+                         batch_job.get('ip_address')])
+        print(format_table(['Batch job', 'Job ID', 'State', 'Time left', 'Node', 'CPUs', 'Memory', 'IP address'],
+                           rows))
+
+        if self._state.tunnels:
+            rows = [[tunnel['screen'] or "control master", tunnel['binding'],
+                     "open" if port_open(local_port(tunnel['binding'])) else "closed"]
+                    for tunnel in self._state.tunnels]
+            print()
+            print(format_table(['Tunnel', 'Binding', 'Local port'], rows))
+
+        pool_state = self._state.for_pool()
+        if pool_state.load() and pool_state.batch_jobs:
+            now = time.time()
+            rows = [[entry['batch_job'], entry['job_id'], entry['state'], entry['node'],
+                     None if entry['end'] is None else f"{max(entry['end'] - now, 0) / 3600:.1f} h"]
+                    for entry in pool_state.batch_jobs.values()]
+            print()
+            print(format_table(['Pool', 'Job ID', 'State', 'Node', 'Time left'], rows))
+
+        urls = [url for batch_job in batch_jobs.values() for url in batch_job.get('urls', list())]
+        if urls:
+            print()
+            print("\n".join(urls))
+
+    def tunnels(self, watch: bool = False) -> None:
+        """
+        Probe the local ports of the tunnels recorded when starting, with a TCP connection and, for tunnels to a jupyter
+        server, a request to its API. When watching, probe them until interrupted, forwarding the dead tunnels again
+        without touching the batch jobs, then report the latency percentiles and the reconnections of each tunnel.
+        """
+
+        clients = [client for client in (self._clients or [self]) if client._state.load() and client._state.tunnels]
+        if not clients:
+            print(f"No tunnel recorded in {self._state.path}.")
+            return
+
+        health = {client: dict() for client in clients}
+        try:
+            with prefixed_stdout():
+                while True:
+                    for client in clients:
+                        with output_prefix(client._prefix):
+                            client._probe_tunnels(health=health[client], reconnect=watch)
+                    if not watch:
+                        break
+                    time.sleep(self.tunnels_probe_period)
+        except KeyboardInterrupt:
+            pass
+
+        for client in clients:
+            print()
+            if self._clients:
+                print(f"Cluster '{client._state.cluster['id']}':")
+            rows = list()
+            for binding, stats in health[client].items():
+                latencies = [latency * 1000 for latency in stats['latencies']]
+                percentiles = [f"{percentile(latencies, q):.1f}" if latencies else None for q in [50, 95, 99]]
+                rows.append([binding, "up" if stats['up'] else "down", stats['probes'], stats['failures'],
+                             stats['reconnects'], *percentiles])
+            print(format_table(['Tunnel', 'State', 'Probes', 'Failures', 'Reconnects', 'p50 (ms)', 'p95 (ms)',
+                                'p99 (ms)'], rows))
+
+    def _probe_tunnels(self, health: Dict[str, Dict], reconnect: bool) -> None:
+        """
+        Probe each tunnel once, recording its state and latency in its health statistics, by binding. The latency is
+        the one of the jupyter API request for tunnels to a jupyter server, which goes through the whole tunnel, while
+        the TCP connection only reaches its local end.
+        """
+
+        self.set_cluster(cluster=self._state.cluster['id'])
+        jupyter_apis = dict()
+        for batch_job in self._state.batch_jobs.values():
+            for url in batch_job.get('urls', list()):
+                url = urlsplit(url)
+                jupyter_apis[url.port] = f"{url.scheme}://127.0.0.1:{url.port}/api"
+
+        for idx, tunnel in enumerate(list(self._state.tunnels)):
+            binding = tunnel['binding']
+            stats = health.setdefault(binding, {'up': False, 'probes': 0, 'failures': 0, 'reconnects': 0,
+                                                'latencies': deque(maxlen=self.tunnels_latencies_kept)})
+            port = local_port(binding)
+            latency = connect_latency(port)
+            if latency is not None and port in jupyter_apis:
+                latency = http_latency(jupyter_apis[port])
+
+            stats['probes'] += 1
+            if latency is not None:
+                stats['up'] = True
+                stats['latencies'].append(latency)
+                continue
+
+            if stats['up'] or stats['failures'] == 0:
+                print(f"Tunnel '{binding}' is down.")
+            stats['up'] = False
+            stats['failures'] += 1
+            if reconnect and self._reconnect_tunnel(tunnel=tunnel, idx=idx):
+                stats['reconnects'] += 1
+
+    def _reconnect_tunnel(self, tunnel: Dict, idx: int) -> bool:
+        """
+        Forward a tunnel again, through the control master connection if it is alive, or through a login screen of its
+        own otherwise, as when starting. Returns whether the tunnel is forwarded again.
+        """
+
+        binding = tunnel['binding']
+        ssh_alias = self._state.cluster['ssh_alias']
+        if tunnel['screen'] is None:
+            self._cluster.cancel_forward(binding=binding, ssh_alias=ssh_alias)
+            if self._cluster.forward(binding=binding, ssh_alias=ssh_alias):
+                print(f"... forwarded '{binding}' again through the connection to {ssh_alias}")
+                return True
+        else:
+            Screen.kill(tunnel['screen'] if tunnel['pid'] is None else f"{tunnel['pid']}.{tunnel['screen']}")
+
+        try:
+            name = tunnel['screen'] or ("tunnel" if idx == 0 else f"tunnel{idx}")
+            tunnel_screen = self._cluster.login(ssh_alias=ssh_alias, binding=binding, name=name)
+        except Exception as e:
+            print(f"... could not forward '{binding}' again: {e}")
+            return False
+
+        self._state.update_tunnel(binding=binding, screen=tunnel_screen, pid=self._screen_pid(tunnel_screen))
+        print(f"... forwarded '{binding}' again in screen '{tunnel_screen}'")
+        return True
+
     def stop(self):
         """
         Close all the screens defined in the configuration file, and as a consequence stop all the processes launched
-        inside those screens.
+        inside those screens. The clusters of a multi-cluster configuration are stopped concurrently.
         """
 
+        self.release()
+        if self._clients:
+            self._run_clients(ClusterClient.stop)
+            return
+
+        with span("client.stop", cluster=self._configs.get_cluster_config()[0]):
+            if self._state.load():
+                self._stop_recorded()
+            else:
+                self._stop_discovered()
+
+    def _stop_recorded(self) -> None:
+        """Close the screens recorded in the state when starting, without discovering them"""
+
+        self.set_cluster(cluster=self._state.cluster['id'])
+        ssh_alias = self._state.cluster['ssh_alias']
+        cluster_screen = self._recorded_cluster_screen()
+        self._stop_batch_jobs(cluster_screen)
+        if Screen.list(name=cluster_screen, exact_name_match=True):
+            Screen.kill(cluster_screen)
+            print(f"Quit screen '{self._state.cluster['screen']}'.")
+
+        if self._state.for_pool().load():
+            print(f"Keeping the connection to {ssh_alias} open for the pool.")
+        elif self._cluster.logout(ssh_alias=ssh_alias):
+            print(f"Closed the connection to {ssh_alias}.")
+
+        self._state.clear()
+        print("Completed closing of all screens.")
+
+    def _stop_batch_jobs(self, cluster_screen: str) -> None:
+        """
+        Quit the batch job screens inside the cluster screen, cancel the submitted job scripts and close the tunnels
+        recorded in the state
+        """
+
+        batch_screens = [batch_job['screen'] for batch_job in self._state.batch_jobs.values()
+                         if batch_job.get('screen') is not None]
+        if batch_screens and Screen.list(name=cluster_screen, exact_name_match=True):
+            terminal = Screen.attach(screen=cluster_screen)
+            for batch_screen in batch_screens:
+                Screen.kill(name=batch_screen, terminal=terminal)
+                print(f"Quit screen '{batch_screen}' inside screen '{self._state.cluster['screen']}'.")
+            Screen.detach(terminal)
+            terminal.close()
+
+        ssh_alias = self._state.cluster['ssh_alias']
+        job_ids = [batch_job['job_id'] for batch_job in self._state.batch_jobs.values()
+                   if batch_job.get('screen') is None and batch_job.get('job_id')]
+        if job_ids:
+            if self._cluster.cancel(ssh_alias=ssh_alias, job_ids=job_ids):
+                print(f"Cancelled batch jobs nr. {', '.join(job_ids)}.")
+            else:
+                print(f"... could not cancel batch jobs nr. {', '.join(job_ids)}, the connection to {ssh_alias} "
+                      f"is closed.")
+
+        for tunnel in self._state.tunnels:
+            if tunnel['screen'] is None:
+                self._cluster.cancel_forward(binding=tunnel['binding'], ssh_alias=ssh_alias)
+                print(f"Cancelled forwarding '{tunnel['binding']}'.")
+            else:
+                Screen.kill(tunnel['screen'] if tunnel['pid'] is None else f"{tunnel['pid']}.{tunnel['screen']}")
+                print(f"Quit screen '{tunnel['screen']}'.")
+
+    # TODO: Test feature to make sure it behaves correctly
+    # TODO: Problem, because screen name is not same as cluster name
+    def _stop_discovered(self) -> None:
+        """Close the screens found by their names, for sessions started without a recorded state"""
+
         cluster_screen_name, _, batch_jobs, _, _ = self._configs.get_cluster_config()
         cluster_screens = Screen.list(name=cluster_screen_name)
 
         if cluster_screens:
-            cluster_screen_id, cluster_screen, _ = cluster_screens[0]
-            terminal = Screen.attach(screen=cluster_screen_id)
+            cluster_screen = cluster_screens[0]
+            terminal = Screen.attach(screen=cluster_screen.id)
 
             for batch_job in batch_jobs:
                 batch_screen_name = self._configs.get_batch_job_screen_name(batch_job)
                 batch_screens = Screen.list(name=batch_screen_name, terminal=terminal)
 
-                for _, batch_screen, _ in batch_screens:
-                    Screen.kill(name=batch_screen, terminal=terminal)
-                    print(f"Quit screen '{batch_screen}' inside screen '{cluster_screen}'.")
+                for batch_screen in batch_screens:
+                    Screen.kill(name=batch_screen.id, terminal=terminal)
+                    print(f"Quit screen '{batch_screen.name}' inside screen '{cluster_screen.name}'.")
 
             Screen.detach(terminal)
 
-        for cluster_screen_id, cluster_screen, _ in cluster_screens:
-            Screen.kill(cluster_screen_id)
-            print(f"Quit screen '{cluster_screen}'.")
+        for cluster_screen in cluster_screens:
+            Screen.kill(cluster_screen.id)
+            print(f"Quit screen '{cluster_screen.name}'.")
 
         tunnels = Screen.list(name="tunnel")
-        for _, screen_name, _ in tunnels:
-            Screen.kill(screen_name)
-            print(f"Quit screen '{screen_name}'.")
+        for tunnel in tunnels:
+            Screen.kill(tunnel.id)
+            print(f"Quit screen '{tunnel.name}'.")
 
         if cluster_screens:
             print(f"Completed closing of all screens.")
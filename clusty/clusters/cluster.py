@@ -3,16 +3,51 @@ Author: @matteobe
 """
 
 import re
+import shlex
+import threading
 from abc import ABC, abstractmethod
-from typing import Union, List
+from typing import Dict, Union, List, NamedTuple, Optional, Set, Tuple
 import time
 
 import pexpect
 
-from clusty.terminal.screen import Screen
+from clusty.terminal.command import CommandResult, ScriptResult, run_command, run_script
+from clusty.terminal.log import LogTail
+from clusty.terminal.screen import Screen, ScreenSession
+from clusty.terminal.shell import Terminal
+from clusty.terminal.ssh import control_command, control_options, remote_command
+from clusty.utils.timing import traced
 from clusty.utils.validation import format_input_to_list
 
 
+class Allocation(NamedTuple):
+    """State of a batch job allocation, as reported by the scheduler (screen is None for submitted job scripts)"""
+
+    screen: Optional[str]
+    job_id: Optional[str] = None
+    state: str = 'submitting'
+    node: Optional[str] = None
+
+    @property
+    def started(self) -> bool:
+        return self.state == 'started'
+
+    @property
+    def failed(self) -> bool:
+        return self.state == 'failed'
+
+
+class JobStatus(NamedTuple):
+    """State and resources of a batch job, as reported by the scheduler"""
+
+    job_id: str
+    state: str
+    time_left: Optional[str] = None
+    node: Optional[str] = None
+    cpus: Optional[str] = None
+    memory: Optional[str] = None
+
+
 class Cluster(ABC):
     """
     Interface definition for a computing cluster, which includes the definition of the cluster identifier,
@@ -20,6 +55,57 @@ class Cluster(ABC):
     """
 
     wait_period = 0.1
+    command_timeout = 600
+    login_timeout = 10
+
+    # Logins to several clusters run concurrently, while their credentials prompts are asked one at a time
+    prompt_lock = threading.Lock()
+
+    # Singularity containers: seconds for the container shell to start
+    singularity_timeout = 60
+
+    # Jupyter servers: command by flavor, access URL (classic notebook, Jupyter Server and JupyterLab) and failures
+    jupyter_timeout = 60
+    jupyter_commands = {
+        'notebook': 'notebook',
+        'lab': 'lab',
+        'R': 'notebook',
+    }
+    jupyter_url_pattern = re.compile(r"(https?)://([-\w.]+):([0-9]{2,5})(/[-\w/.]*)\?token=(\w{16,64})")
+    jupyter_failure_pattern = re.compile(r": (?:command )?not found|Jupyter command `[^`]+` not found|"
+                                         r"Traceback \(most recent call last\)|^\[C ", re.MULTILINE)
+
+    # Ports of jupyter servers configured as 'auto': candidates, and the command listing the ports listened on by the
+    # node (decoded from the kernel socket tables, available inside containers too), in a single round trip
+    auto_ports = range(8100, 8300)
+    listening_ports_command = ("for port in $(awk '$4 == \"0A\" {split($2, address, \":\"); print address[2]}' "
+                               "/proc/net/tcp /proc/net/tcp6 2>/dev/null); do echo $((0x$port)); done")
+
+    # Batch jobs allocation: scheduler output patterns by allocation state, with the optional job and node groups
+    batch_wait = 600
+    batch_poll_period = 1
+    batch_progress_period = 30
+    submitted_pattern = re.compile(r"Job <(?P<job>[0-9]+)> is submitted to queue")
+    pending_pattern = re.compile(r"<<Waiting for dispatch")
+    started_pattern = re.compile(r"<<Starting on (?P<node>[-\w.]+)>>")
+    failed_pattern = re.compile(r"Request aborted by esub|Job not submitted|<<Job [0-9]+ is being terminated|"
+                                r"bsub: .*error")
+
+    # Batch jobs submitted as job scripts: folder of the scripts and of their output files on the cluster, scheduler
+    # variables holding the job id and the job array index, submission output and markers printed by the job script
+    # (the jupyter marker precedes the jupyter server, whose output only is checked for the URL and failures)
+    job_folder = "~/.clusty/jobs"
+    job_poll_period = 5
+    job_id_variable = "$LSB_JOBID"
+    job_index_variable = "$LSB_JOBINDEX"
+    job_submitted_pattern = re.compile(r"Job <(?P<job>[0-9]+)> is submitted to queue")
+    job_started_pattern = re.compile(r"CLUSTY_STARTED (?P<job>[0-9]+) (?P<node>[-\w.]+) "
+                                     r"(?P<ip>(?:[0-9]{1,3}\.){3}[0-9]{1,3})")
+    job_exited_pattern = re.compile(r"CLUSTY_EXITED (?P<code>[0-9]+)")
+
+    # Whether the status command prints the array index of the tasks after the job identifier (0 for other jobs)
+    status_job_index = False
+    job_jupyter_pattern = re.compile(r"CLUSTY_JUPYTER")
 
     def __init__(self, cluster_id: str, name: str, host_address: str, ssh_alias: str = None):
         self._id = cluster_id
@@ -32,50 +118,305 @@ class Cluster(ABC):
         """Setup SSH connection to cluster using specified port"""
         pass
 
+    @property
+    def id(self) -> str:
+        """Identifier of the cluster in the configuration file"""
+        return self._id
+
+    @property
+    def alias(self) -> str:
+        """SSH alias used to access the cluster"""
+        return self._ssh_alias
+
     @abstractmethod
     def login(self, ssh_alias: str = None, binding: str = None) -> str:
         """Login to the cluster"""
         pass
 
+    @traced("cluster.login_through_master")
+    def login_through_master(self, ssh_alias: str, binding: str = None, name: str = None) -> Optional[str]:
+        """
+        Login to the cluster through the control master connection of a previous login, if it is still alive, which
+        requires no credentials. Returns the name of the login screen, or None if no connection can be reused.
+        """
+
+        if not control_command(ssh_alias, "check"):
+            return None
+
+        screen_name = Screen.create(name=self._id if name is None else name)
+        terminal = Terminal(f"screen -r {screen_name}")
+        cmd = f"ssh {control_options()} {ssh_alias}"
+        if binding is not None:
+            cmd += f" -L {binding}"
+        terminal.sendline(cmd)
+
+        # The command markers are only printed once the remote shell is running
+        try:
+            run_command(terminal, "true", timeout=self.login_timeout)
+            connected = True
+        except (TimeoutError, ConnectionError):
+            connected = False
+        Screen.detach(terminal)
+        terminal.close()
+
+        if not connected:
+            Screen.kill(screen_name)
+            return None
+
+        print(f"Connected to {self._name} through the existing connection on screen: '{screen_name}'")
+        return screen_name
+
+    @traced("cluster.forward")
+    def forward(self, binding: str, ssh_alias: str = None) -> bool:
+        """
+        Add a port forwarding to the control master connection to the cluster, opened at login. Returns False if no
+        control master connection is available.
+        """
+
+        ssh_alias = self._ssh_alias if ssh_alias is None else ssh_alias
+        return control_command(ssh_alias, "check") and control_command(ssh_alias, "forward", binding=binding)
+
+    @traced("cluster.cancel_forward")
+    def cancel_forward(self, binding: str, ssh_alias: str = None) -> bool:
+        """Remove a port forwarding from the control master connection to the cluster"""
+
+        ssh_alias = self._ssh_alias if ssh_alias is None else ssh_alias
+        return control_command(ssh_alias, "cancel", binding=binding)
+
+    @traced("cluster.logout")
+    def logout(self, ssh_alias: str = None) -> bool:
+        """Close the control master connection to the cluster, which persists after the login screen is closed"""
+
+        ssh_alias = self._ssh_alias if ssh_alias is None else ssh_alias
+        return control_command(ssh_alias, "exit")
+
     @staticmethod
-    def ip_address(screens: List[str]) -> str:
+    def session(screens: Union[List[str], ScreenSession]) -> ScreenSession:
+        """Session attaching to nested screens, or the passed-in session so that it stays attached after use"""
+
+        return screens if isinstance(screens, ScreenSession) else ScreenSession(screens=screens)
+
+    @staticmethod
+    @traced("cluster.ip_address")
+    def ip_address(screens: Union[List[str], ScreenSession]) -> str:
         """Retrieve the IP address of a nested screen"""
 
-        terminal = Screen.attach_nested(screens=screens)
-        terminal.sendline("hostname -i")
-        terminal.expect_list([pexpect.EOF, pexpect.TIMEOUT], timeout=1)
-        output = terminal.before.decode()
-        Screen.detach_nested(terminal=terminal, depth=len(screens), terminate=True)
+        with Cluster.session(screens) as session:
+            result = run_command(session.terminal, "hostname -i", timeout=Cluster.command_timeout)
 
         # Retrieve the IP address for port forwarding
         regex_ip_address = re.compile(r"(?:[0-9]{1,3}\.){3}[0-9]{1,3}", re.MULTILINE)
-        ip_address = regex_ip_address.findall(output)[0]
+        ip_address = regex_ip_address.findall(result.output)[0]
 
         return ip_address
 
+    @staticmethod
+    @traced("cluster.free_port")
+    def free_port(screens: Union[List[str], ScreenSession], exclude: Set[int] = frozenset()) -> int:
+        """
+        First port of the candidates that no server listens on in a nested screen, listing the ports listened on with
+        a single command
+        """
+
+        with Cluster.session(screens) as session:
+            result = run_command(session.terminal, Cluster.listening_ports_command, timeout=Cluster.command_timeout)
+
+        listening = {int(port) for port in re.findall(r"^\s*([0-9]{1,5})\s*$", result.output, re.MULTILINE)}
+        for port in Cluster.auto_ports:
+            if port not in listening and port not in exclude:
+                return port
+
+        raise RuntimeError(f"No free port between {Cluster.auto_ports.start} and {Cluster.auto_ports.stop - 1}.")
+
     @abstractmethod
-    def batch(self, *args, **kwargs):
-        """Start a batch job on the cluster"""
+    def batch_command(self, duration: int, cpu: int, memory: int, gpu: int, gpu_model: str) -> str:
+        """Scheduler command starting an interactive batch job with the requested resources"""
         pass
 
+    @traced("cluster.batch")
+    def batch(self, screens: List[str], duration: int = 24, cpu: int = 10, memory: int = 10000, gpu: int = 0,
+              gpu_model: str = 'GeForceGTX1080Ti', wait: bool = True, max_wait: float = None) -> Allocation:
+        """
+        Launch a batch job on the cluster, with certain specifics.
+        Requires a list of screens, of which all but the last one are already logged in to the cluster. The last
+        screen is created to host the batch job. If wait is True, follow the scheduler output until the batch job
+        starts or max_wait seconds expire, otherwise return right after the submission and leave it to the caller to
+        follow the allocation with the allocation method.
+        """
+
+        cmd = self.batch_command(duration=duration, cpu=cpu, memory=memory, gpu=gpu, gpu_model=gpu_model)
+
+        # Attach to the cluster screen and create a screen where to launch the batch process
+        terminal = Screen.attach_nested(screens=screens[:-1])
+        batch_screen = Screen.create(name=screens[-1], terminal=terminal)
+        terminal.sendline(f"screen -r {batch_screen}")
+        terminal.expect_list([pexpect.EOF, pexpect.TIMEOUT], timeout=self.wait_period)
+
+        # Launch the batch process
+        print(f"Launching batch job on {self._name} in screen '{batch_screen}'...")
+        terminal.sendline(cmd)
+        allocation = Allocation(screen=batch_screen)
+        if wait:
+            allocation = self.wait_allocation(terminal, allocation=allocation,
+                                              timeout=self.batch_wait if max_wait is None else max_wait)
+
+        # Detach from the batch screen
+        Screen.detach(terminal, level=2)
+        if wait and not allocation.started:
+            print(f"... could not start the batch job on {self._name} ({allocation.state})")
+            Screen.kill(batch_screen, terminal)
+
+        # Detach from the cluster screen
+        Screen.detach(terminal)
+        terminal.close()
+
+        return allocation
+
+    @traced("cluster.allocation")
+    def allocation(self, screens: List[str], allocation: Allocation = None) -> Allocation:
+        """
+        Check the allocation of the batch job running in the innermost of the nested screens. The screen content,
+        redrawn when attaching, is followed for at most the poll period.
+        """
+
+        allocation = Allocation(screen=screens[-1]) if allocation is None else allocation
+        with ScreenSession(screens=screens) as session:
+            allocation = self.wait_allocation(session.terminal, allocation=allocation, timeout=self.batch_poll_period)
+
+        return allocation
+
+    def wait_allocation(self, terminal: pexpect.spawn, allocation: Allocation, timeout: float) -> Allocation:
+        """
+        Follow the scheduler output of a batch job until the batch job starts, fails, or the timeout expires, printing
+        the changes of state and the pending progress
+        """
+
+        states = ['started', 'failed', 'submitted', 'pending']
+        patterns = [(state, getattr(self, f"{state}_pattern")) for state in states]
+        patterns = [(state, re.compile(pattern.pattern.encode())) for state, pattern in patterns if pattern is not None]
+
+        start = time.monotonic()
+        while not allocation.started and not allocation.failed:
+            remaining = timeout - (time.monotonic() - start)
+            if remaining <= 0:
+                break
+
+            response = terminal.expect_list([pattern for _, pattern in patterns] + [pexpect.EOF, pexpect.TIMEOUT],
+                                            timeout=min(remaining, self.batch_progress_period))
+            if response < len(patterns):
+                groups = {key: value.decode() for key, value in terminal.match.groupdict().items() if value}
+                state = patterns[response][0]
+                if state != allocation.state:
+                    allocation = allocation._replace(state=state, job_id=groups.get('job', allocation.job_id),
+                                                     node=groups.get('node', allocation.node))
+                    print(f"... batch job nr. '{allocation.job_id}' {state}")
+            elif response == len(patterns):
+                allocation = allocation._replace(state='failed')
+            elif remaining > self.batch_progress_period:
+                print(f"... batch job nr. '{allocation.job_id}' {allocation.state} for "
+                      f"{time.monotonic() - start:.0f} s")
+
+        # Retrieve the node from the batch job itself, if the scheduler did not report it
+        if allocation.started and allocation.node is None:
+            output = run_command(terminal, "hostname", timeout=self.command_timeout).output
+            nodes = re.findall(r"^[-\w.]+$", output, re.MULTILINE)
+            allocation = allocation._replace(node=nodes[0] if nodes else None)
+
+        return allocation
+
+    @abstractmethod
+    def status_command(self, job_ids: List[str]) -> str:
+        """
+        Scheduler command printing the state of the given batch jobs, one line per batch job with the JobStatus
+        fields separated by '|'
+        """
+        pass
+
+    @traced("cluster.job_status")
+    def job_status(self, screens: Union[List[str], ScreenSession], job_ids: List[str]) -> Dict[str, JobStatus]:
+        """
+        Query the state of several batch jobs with a single scheduler command, run inside a screen. The tasks of job
+        arrays are listed by their own identifier.
+        """
+
+        with Cluster.session(screens) as session:
+            result = run_command(session.terminal, self.status_command(job_ids), timeout=self.command_timeout)
+
+        return self.parse_status(result.output, job_ids)
+
+    def parse_status(self, output: str, job_ids: List[str]) -> Dict[str, JobStatus]:
+        """
+        Parse the output of the status command, by job identifier. The tasks of LSF job arrays, whose array index is
+        printed after the job identifier, are identified as jobid[index].
+        """
+
+        statuses = dict()
+        for line in output.splitlines():
+            fields = [field.strip() for field in line.split('|')]
+            if self.status_job_index and len(fields) == len(JobStatus._fields) + 1:
+                job_id, index, *fields = fields
+                fields = [job_id if index in ['', '0'] else f"{job_id}[{index}]"] + fields
+            if len(fields) == len(JobStatus._fields) and Cluster.array_job_id(fields[0]) in job_ids:
+                statuses[fields[0]] = JobStatus(*[field if field else None for field in fields])
+
+        return statuses
+
+    @staticmethod
+    def array_job_id(job_id: str) -> str:
+        """Identifier of the job array of a task (e.g. 123_4 or 123[4]), or the identifier itself for other jobs"""
+
+        return re.split(r"[_\[]", job_id)[0]
+
     @staticmethod
-    def run(screens: List[str], commands: Union[str, List[str]]) -> None:
-        """Run a list of commands inside nested screens (listed from outward to inward)"""
+    @traced("cluster.run")
+    def run(screens: Union[List[str], ScreenSession], commands: Union[str, List[str]], timeout: float = None) \
+            -> List[CommandResult]:
+        """
+        Run a list of commands inside nested screens (listed from outward to inward).
+        Each command is sent only once the previous one has completed, and its exit status and duration are reported.
+        """
 
         commands = format_input_to_list(commands)
+        timeout = Cluster.command_timeout if timeout is None else timeout
 
-        terminal = Screen.attach_nested(screens=screens)
-        for cmd in commands:
-            terminal.sendline(cmd)
-            terminal.expect_list([pexpect.EOF, pexpect.TIMEOUT], timeout=1)
-        Screen.detach_nested(terminal=terminal, depth=len(screens), terminate=True)
+        results = list()
+        with Cluster.session(screens) as session:
+            for cmd in commands:
+                result = run_command(session.terminal, cmd, timeout=timeout)
+                results.append(result)
+                status = "completed" if result.success else f"failed with exit status {result.exit_code}"
+                print(f"... '{cmd}' {status} in screen '{session.name}' ({result.duration:.2f} s)")
 
-    def launch_singularity(self, screens: List[str], image: str, home_dir: str = None,
-                           bindings: Union[str, List[str]] = None, gpu: bool = False) -> None:
-        """Launch a singularity image inside a screen"""
+        return results
+
+    @staticmethod
+    @traced("cluster.run_script")
+    def run_script(screens: Union[List[str], ScreenSession], commands: Union[str, List[str]], timeout: float = None) \
+            -> ScriptResult:
+        """
+        Run a list of commands inside nested screens (listed from outward to inward) as a single script, sent in one
+        write and checked for completion once. The exit status of each command is reported.
+        """
+
+        commands = format_input_to_list(commands)
+        timeout = Cluster.command_timeout if timeout is None else timeout
+
+        with Cluster.session(screens) as session:
+            result = run_script(session.terminal, commands, timeout=timeout)
+            for cmd, exit_code in zip(result.commands, result.exit_codes):
+                status = "completed" if exit_code == 0 else f"failed with exit status {exit_code}"
+                print(f"... '{cmd}' {status} in screen '{session.name}'")
+            print(f"... {len(commands)} commands run as a single script in screen '{session.name}' "
+                  f"({result.duration:.2f} s)")
 
-        terminal = Screen.attach_nested(screens=screens)
-        cmd = f"singularity shell"
+        return result
+
+    @staticmethod
+    def singularity_command(image: str, home_dir: str = None, bindings: Union[str, List[str]] = None,
+                            gpu: bool = False, action: str = 'shell') -> str:
+        """Singularity command opening a shell in an image (action shell), or running a command in it (action exec)"""
+
+        cmd = f"singularity {action}"
         if gpu is not False:
             cmd += " --nv"
         if home_dir is not None:
@@ -85,32 +426,228 @@ class Cluster(ABC):
             cmd += f" -B {','.join(bindings)}"
         cmd += f" {image}"
 
-        terminal.sendline(cmd)
-        terminal.expect_list([pexpect.EOF, pexpect.TIMEOUT], timeout=10)
-        print(f"Launched singularity image on {self._name} in screen '{screens[-1]}'")
+        return cmd
 
-        Screen.detach_nested(terminal=terminal, depth=len(screens), terminate=True)
+    @traced("cluster.launch_singularity")
+    def launch_singularity(self, screens: Union[List[str], ScreenSession], image: str, home_dir: str = None,
+                           bindings: Union[str, List[str]] = None, gpu: bool = False) -> None:
+        """Launch a singularity image inside a screen, returning once the container shell runs"""
 
-    def launch_jupyter(self, screens: List[str], port: int) -> str:
-        """Launch a Jupyter notebook inside nested screens (listed from outward to inward)"""
+        cmd = Cluster.singularity_command(image=image, home_dir=home_dir, bindings=bindings, gpu=gpu)
 
-        terminal = Screen.attach_nested(screens=screens)
+        with Cluster.session(screens) as session:
+            # The command typed after the launch is read by the container shell once started, which singularity
+            # tells by setting SINGULARITY_CONTAINER, or by the shell of the screen if the launch failed
+            session.terminal.sendline(cmd)
+            result = run_command(session.terminal, 'test -n "$SINGULARITY_CONTAINER"',
+                                 timeout=Cluster.singularity_timeout)
+            if not result.success:
+                raise RuntimeError(f"Singularity image '{image}' failed to start in screen '{session.name}': "
+                                   f"{result.output}")
+            print(f"Launched singularity image on {self._name} in screen '{session.name}'")
 
-        # Launch the jupyter notebook
-        print(f"Launching jupyter notebook on {self._name} in screen '{screens[-1]}'...")
-        cmd = f"jupyter notebook --no-browser --ip=$(hostname -i) --port {port}"
-        terminal.sendline(cmd)
-        terminal.expect_list([pexpect.EOF, pexpect.TIMEOUT], timeout=15)
-        jupyter_output = terminal.before.decode()
-        Screen.detach_nested(terminal=terminal, depth=len(screens), terminate=True)
+    @staticmethod
+    def jupyter_command(port: int, flavor: str = 'notebook') -> str:
+        """Command starting a Jupyter server listening on the IP address of the node"""
 
-        # Retrieve the IP address and port for port forwarding
-        notebook_url = re.compile(r"(http?):\/\/([\w\.]+):([0-9]{2,5})\/\?token=(\w{16,64})", re.MULTILINE)
-        protocol, address, port, token = notebook_url.findall(jupyter_output)[0]
-        url_remote = f"{protocol}://{address}:{port}/?token={token}"
-        url_local = f"{protocol}://127.0.0.1:{port}/?token={token}"
+        return f"jupyter {Cluster.jupyter_commands[flavor]} --no-browser --ip=$(hostname -i) --port {port}"
 
-        print(f"Jupyter notebook launched at: {url_remote}")
+    @traced("cluster.launch_jupyter")
+    def launch_jupyter(self, screens: Union[List[str], ScreenSession], port: int, flavor: str = 'notebook',
+                       timeout: float = None, local_port: int = None) -> str:
+        """
+        Launch a Jupyter server inside nested screens (listed from outward to inward), returning the local URL as
+        soon as the server prints its access URL. The local URL uses the local port if it differs from the remote one.
+        """
+
+        timeout = Cluster.jupyter_timeout if timeout is None else timeout
+        url_pattern = re.compile(Cluster.jupyter_url_pattern.pattern.encode())
+        failure_pattern = re.compile(Cluster.jupyter_failure_pattern.pattern.encode(), re.MULTILINE)
+
+        with Cluster.session(screens) as session:
+            # Launch the jupyter server
+            print(f"Launching jupyter {flavor} on {self._name} in screen '{session.name}'...")
+            # Discard the output pending in the terminal, such that only the URL printed by this server is matched
+            session.terminal.expect_list([pexpect.EOF, pexpect.TIMEOUT], timeout=0)
+            session.terminal.sendline(Cluster.jupyter_command(port=port, flavor=flavor))
+            response = session.terminal.expect_list([url_pattern, failure_pattern, pexpect.EOF, pexpect.TIMEOUT],
+                                                    timeout=timeout)
+
+            if response == 1:
+                terminal = session.terminal
+                line = terminal.before.split(b'\n')[-1] + terminal.after + terminal.buffer.split(b'\n')[0]
+                raise RuntimeError(f"Jupyter {flavor} failed to start in screen '{session.name}': "
+                                   f"{line.decode(errors='replace').strip()}")
+            elif response == 2:
+                raise ConnectionError(f"Terminal closed while launching jupyter {flavor}.")
+            elif response == 3:
+                raise TimeoutError(f"Jupyter {flavor} did not report its URL within {timeout} seconds.")
+
+            protocol, address, port, path, token = [group.decode() for group in session.terminal.match.groups()]
+
+        # Build the URLs for port forwarding
+        url_remote = f"{protocol}://{address}:{port}{path}?token={token}"
+        url_local = f"{protocol}://127.0.0.1:{port if local_port is None else local_port}{path}?token={token}"
+
+        print(f"Jupyter {flavor} launched at: {url_remote}")
         print(f"... access it on your local machine at: {url_local}")
 
         return url_local
+
+    @abstractmethod
+    def job_directives(self, name: str, duration: int, cpu: int, memory: int, gpu: int, gpu_model: str,
+                       array: int = None) -> List[str]:
+        """
+        Scheduler directives of a job script requesting the given resources, writing the output of the job to a file
+        named after the job script, the job id and, for job arrays of the given number of tasks, the task index
+        """
+        pass
+
+    @abstractmethod
+    def submit_command(self, script: str) -> str:
+        """Scheduler command submitting a job script"""
+        pass
+
+    @abstractmethod
+    def cancel_command(self, job_ids: List[str]) -> str:
+        """Scheduler command cancelling the given batch jobs"""
+        pass
+
+    def job_script(self, name: str, commands: List[str], env: List[str] = None, singularity: Dict = None,
+                   jupyter: Dict = None, sweep: List[Dict[str, str]] = None, duration: int = 24, cpu: int = 10,
+                   memory: int = 10000, gpu: int = 0, gpu_model: str = 'GeForceGTX1080Ti') -> str:
+        """
+        Render a batch job into a job script. The commands following SINGULARITY run inside the container, and JUPYTER
+        runs the jupyter server in the foreground. The script reports its node and IP address when it starts, and its
+        exit status when it ends. With a sweep, the script is a job array whose tasks export one parameter set each.
+        A jupyter port 'auto' is chosen by the script among the candidates that no server listens on.
+        """
+
+        lines = ["#!/bin/bash"] + self.job_directives(name=name, duration=duration, cpu=cpu, memory=memory, gpu=gpu,
+                                                      gpu_model=gpu_model, array=len(sweep) if sweep else None)
+        lines.append(f'printf "%s_%s %s %s %s\\n" CLUSTY STARTED "{self.job_id_variable}" "$(hostname)" '
+                     f'"$(hostname -i)"')
+        if sweep:
+            lines.append(f'case "{self.job_index_variable}" in')
+            for index, parameter_set in enumerate(sweep, start=1):
+                exports = " ".join([f"{variable}={shlex.quote(value)}" for variable, value in parameter_set.items()])
+                lines.append(f"  {index}) export {exports};;")
+            lines.append("esac")
+        lines += [] if env is None else env
+
+        containers = list()
+        for cmd in commands:
+            if cmd == 'SINGULARITY':
+                delimiter = f"CLUSTY_CONTAINER{len(containers)}"
+                lines.append(f"{Cluster.singularity_command(action='exec', **singularity)} bash -s <<'{delimiter}'")
+                containers.append(delimiter)
+            elif cmd == 'JUPYTER' and jupyter['port'] == 'auto':
+                lines.append('printf "%s_%s\\n" CLUSTY JUPYTER')
+                lines.append(f'CLUSTY_LISTENING=" $({Cluster.listening_ports_command} | tr "\\n" " ") "')
+                lines.append(f"CLUSTY_PORT=$(for port in $(seq {Cluster.auto_ports.start} "
+                             f"{Cluster.auto_ports.stop - 1}); do case \"$CLUSTY_LISTENING\" in *\" $port \"*) ;; "
+                             f"*) echo $port; break;; esac; done)")
+                lines.append(Cluster.jupyter_command(port="$CLUSTY_PORT", flavor=jupyter['flavor']))
+            elif cmd == 'JUPYTER':
+                lines.append('printf "%s_%s\\n" CLUSTY JUPYTER')
+                lines.append(Cluster.jupyter_command(port=jupyter['port'], flavor=jupyter['flavor']))
+            else:
+                lines.append(cmd)
+        lines += reversed(containers)
+        lines.append('printf "%s_%s %d\\n" CLUSTY EXITED $?')
+
+        return "\n".join(lines) + "\n"
+
+    @traced("cluster.submit")
+    def submit(self, ssh_alias: str, name: str, script: str) -> Allocation:
+        """Write a job script to the job folder of the cluster and submit it, with a single SSH exec"""
+
+        cmd = f"mkdir -p {self.job_folder} && cd {self.job_folder} && cat > {name}.sh && " \
+              f"{self.submit_command(f'{name}.sh')}"
+        result = remote_command(ssh_alias, cmd, input=script, timeout=self.command_timeout)
+        match = self.job_submitted_pattern.search(result.output)
+        if not result.success or match is None:
+            raise RuntimeError(f"Job script '{name}.sh' could not be submitted to {self._name}: {result.output}")
+
+        allocation = Allocation(screen=None, job_id=match.group('job'), state='submitted')
+        print(f"Submitted job script '{name}.sh' to {self._name} as batch job nr. '{allocation.job_id}'")
+
+        return allocation
+
+    def job_output_file(self, name: str, job_id: str, index: Union[int, str] = None) -> str:
+        """Output file of a submitted job script on the cluster, or of a task of a job array"""
+
+        return f"{self.job_folder}/{name}.{job_id}.out" if index is None else \
+            f"{self.job_folder}/{name}.{job_id}.{index}.out"
+
+    @traced("cluster.wait_job")
+    def wait_job(self, ssh_alias: str, name: str, allocation: Allocation, max_wait: float = None,
+                 jupyter_timeout: float = None, local_port: int = None
+                 ) -> Tuple[Allocation, Optional[str], List[str], Optional[int]]:
+        """
+        Follow the output file of a submitted job script until the batch job starts and, if a jupyter timeout is given,
+        until the jupyter server reports its URL. Returns the allocation, the IP address of the node, the local URLs
+        to access the jupyter server (on the local port if given) and the port it listens on in the node. Each poll
+        reads the new lines of the output file only. The output of the commands preceding the jupyter server is not
+        checked for failures, the job exit status telling whether they failed.
+        """
+
+        max_wait = self.batch_wait if max_wait is None else max_wait
+        output_file = self.job_output_file(name, allocation.job_id)
+        output_tail = LogTail(output_file, ssh_alias=ssh_alias)
+        ip_address = None
+        last_line = ''
+        jupyter_launched = False
+
+        start = time.monotonic()
+        last_progress = start
+        while True:
+            lines = output_tail.lines()
+            output = "\n".join(lines)
+            last_line = lines[-1] if lines else last_line
+
+            started = self.job_started_pattern.search(output)
+            if started is not None and not allocation.started:
+                allocation = allocation._replace(state='started', node=started.group('node'))
+                ip_address = started.group('ip')
+                print(f"... batch job nr. '{allocation.job_id}' started on node '{allocation.node}'")
+                start = time.monotonic()
+
+            if not jupyter_launched:
+                jupyter = self.job_jupyter_pattern.search(output)
+                jupyter_launched = jupyter is not None
+                jupyter_output = output[jupyter.end():] if jupyter_launched else ''
+            else:
+                jupyter_output = output
+
+            url = self.jupyter_url_pattern.search(jupyter_output)
+            failure = self.jupyter_failure_pattern.search(jupyter_output)
+            exited = self.job_exited_pattern.search(output)
+            if allocation.started and jupyter_timeout is None:
+                return allocation, ip_address, list(), None
+            elif url is not None:
+                protocol, address, port, path, token = url.groups()
+                url_local = f"{protocol}://127.0.0.1:{port if local_port is None else local_port}{path}?token={token}"
+                print(f"Jupyter launched at: {url.group(0)}")
+                print(f"... access it on your local machine at: {url_local}")
+                return allocation, ip_address, [url_local], int(port)
+            elif failure is not None or exited is not None:
+                raise RuntimeError(f"Batch job nr. '{allocation.job_id}' failed, see {output_file} on {self._name}: "
+                                   f"{last_line}")
+
+            timeout = max_wait if not allocation.started else jupyter_timeout
+            if time.monotonic() - start > timeout:
+                raise TimeoutError(f"Batch job nr. '{allocation.job_id}' did not "
+                                   f"{'start' if not allocation.started else 'report the jupyter URL'} within "
+                                   f"{timeout} seconds.")
+
+            if time.monotonic() - last_progress >= self.batch_progress_period:
+                last_progress = time.monotonic()
+                print(f"... batch job nr. '{allocation.job_id}' {allocation.state} for {last_progress - start:.0f} s")
+            time.sleep(self.job_poll_period)
+
+    @traced("cluster.cancel")
+    def cancel(self, ssh_alias: str, job_ids: List[str]) -> bool:
+        """Cancel batch jobs with a single SSH exec, returning whether the scheduler accepted it"""
+
+        return remote_command(ssh_alias, self.cancel_command(job_ids), timeout=self.command_timeout).success
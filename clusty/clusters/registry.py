@@ -0,0 +1,65 @@
+"""
+Registry of the cluster implementations, by cluster identifier.
+
+Clusters other than the ones shipped with clusty are registered by their packages as entry points of the
+'clusty.clusters' group, named by the cluster identifier and referring to the cluster class:
+
+    entry_points={'clusty.clusters': ['mycluster = mypackage.clusters:MyCluster']}
+
+The entry points are discovered from the metadata of the installed packages, and a cluster class is imported only
+once its cluster is selected.
+"""
+
+import importlib
+from functools import lru_cache
+from typing import Dict, List, Type
+
+entry_point_group = "clusty.clusters"
+
+# Clusters shipped with clusty, available without discovering the entry points, and registered as entry points by
+# setup.py from this listing
+builtin_clusters = {
+    'leomed1': 'clusty.clusters.ETH.leomed1:LeoMed1',
+    'leomed2': 'clusty.clusters.ETH.leomed2:LeoMed2',
+}
+
+
+@lru_cache(maxsize=None)
+def _entry_points() -> Dict[str, str]:
+    """Cluster classes registered as entry points by the installed packages, read from their metadata only"""
+
+    try:
+        from importlib.metadata import entry_points
+    except ImportError:
+        # Python 3.7: backport of importlib.metadata, installed as requirement
+        from importlib_metadata import entry_points
+
+    discovered = entry_points()
+    group = discovered.select(group=entry_point_group) if hasattr(discovered, 'select') \
+        else discovered.get(entry_point_group, list())
+
+    return {entry_point.name: entry_point.value for entry_point in group}
+
+
+def clusters() -> Dict[str, str]:
+    """Registered cluster classes ('module:class') by cluster identifier"""
+
+    return {**_entry_points(), **builtin_clusters}
+
+
+def cluster_ids() -> List[str]:
+    """Identifiers of the registered clusters"""
+
+    return sorted(clusters().keys())
+
+
+def cluster_class(cluster_id: str) -> Type:
+    """Import the class of a registered cluster"""
+
+    reference = builtin_clusters.get(cluster_id) or clusters().get(cluster_id)
+    if reference is None:
+        raise ValueError(f"Invalid cluster name passed in.\n"
+                         f"Valid cluster names: {','.join(cluster_ids())}")
+
+    module_name, class_name = reference.split(':')
+    return getattr(importlib.import_module(module_name), class_name.strip())
@@ -2,11 +2,14 @@
 Author: @matteobe
 """
 
-from typing import Tuple, List
+import os
+import json
+import hashlib
+import itertools
+from typing import Dict, Tuple, List
 from pathlib import Path
 
-import yaml
-
+from clusty.clusters.registry import cluster_ids
 from clusty.utils.validation import validate_schema, format_input_to_list
 
 
@@ -14,14 +17,92 @@ class ConfigsParser:
     """
     Class for parsing the YAML configuration file.
 
-    The default schema is defined in the configs folder under the schema.yaml file.
+    The default schema is defined in the configs folder under the schema.yaml file. It is loaded on the first
+    validation, and the validated configuration files are cached in the .clusty folder next to them.
     """
 
-    with open((Path(__file__).parent / "schema.yaml").resolve(), 'rb') as f:
-        config_schema = yaml.full_load(f)
+    schema_file = (Path(__file__).parent / "schema.yaml").resolve()
+    cache_folder = ".clusty"
+    _config_schema = None
+
+    def __init__(self, configs: dict, validate: bool = True):
+        self._configs = validate_schema(document=configs, schema=ConfigsParser.config_schema()) if validate \
+            else configs
+
+    @classmethod
+    def config_schema(cls) -> dict:
+        """Schema of the configuration files, loaded once, allowing the identifiers of the registered clusters"""
+
+        if cls._config_schema is None:
+            import yaml
+
+            with open(cls.schema_file, 'rb') as f:
+                schema = yaml.full_load(f)
+            # The cluster schema is shared by the single and the multi-cluster configurations
+            schema['cluster']['schema']['id']['allowed'] = cluster_ids()
+            cls._config_schema = schema
+
+        return cls._config_schema
+
+    @classmethod
+    def from_file(cls, config_file: str) -> 'ConfigsParser':
+        """
+        Parse and validate a YAML configuration file. The validated configuration is cached by the hash of the file, of
+        the schema and of the registered clusters, such that an unchanged configuration file is neither parsed nor
+        validated again.
+        """
+
+        config_file = Path(config_file).resolve()
+        with open(config_file, 'rb') as file:
+            content = file.read()
+        with open(cls.schema_file, 'rb') as file:
+            schema = file.read()
+        # The schema allows the identifiers of the registered clusters, which change as packages registering clusters
+        # are installed or removed
+        registered = ",".join(sorted(cluster_ids())).encode()
+        config_hash = hashlib.sha256(content + schema + registered).hexdigest()
+
+        cache_file = config_file.parent / cls.cache_folder / f"{config_file.stem}.configs.json"
+        try:
+            with open(cache_file, 'r') as file:
+                cache = json.load(file)
+            if cache['hash'] == config_hash:
+                return cls(configs=cache['configs'], validate=False)
+        except (OSError, ValueError, KeyError):
+            pass
+
+        import yaml
+
+        parser = cls(configs=yaml.full_load(content))
+
+        # Configurations with values JSON cannot represent (such as dates) are not cached
+        try:
+            cache = json.dumps({'hash': config_hash, 'configs': parser._configs})
+            cache_file.parent.mkdir(parents=True, exist_ok=True)
+            tmp_file = cache_file.with_suffix('.tmp')
+            with open(tmp_file, 'w') as file:
+                file.write(cache)
+            os.replace(tmp_file, cache_file)
+        except (OSError, TypeError, ValueError):
+            pass
+
+        return parser
+
+    def get_clusters_configs(self) -> List['ConfigsParser']:
+        """
+        Get the configurations of each cluster listed in a multi-cluster configuration file, in the single cluster
+        form sharing the batch jobs definitions. Returns an empty list for single cluster configuration files.
+        """
+        if 'clusters' not in self._configs:
+            return list()
+
+        ids = [cluster['id'] for cluster in self._configs['clusters']]
+        duplicates = sorted(set([cluster_id for cluster_id in ids if ids.count(cluster_id) > 1]))
+        if duplicates:
+            raise ValueError(f"Clusters listed more than once: {', '.join(duplicates)}")
 
-    def __init__(self, configs: dict):
-        self._configs = validate_schema(document=configs, schema=ConfigsParser.config_schema)
+        return [ConfigsParser(configs={'cluster': cluster, 'batch_jobs': self._configs['batch_jobs']}, validate=False)
+                for cluster in self._configs['clusters']]
 
     def get_cluster_config(self) -> Tuple[str, str, List[str], List[str], bool]:
 
@@ -34,6 +115,31 @@ class ConfigsParser:
 
         return cluster_name, ssh_alias, batch_jobs, tunnels, setup
 
+    def get_cluster_concurrency(self) -> int:
+        """
+        Get the maximum number of batch jobs to launch concurrently
+        """
+        return self._configs['cluster']['concurrency']
+
+    def get_cluster_pool(self) -> Tuple[Dict[str, int], int, int]:
+        """
+        Get the warm pool of the cluster: the number of allocations kept idle by batch job whose resources they match,
+        the seconds without claims after which the pool is released, and the seconds of walltime left under which an
+        allocation is replaced
+        """
+        pool = self._configs['cluster'].get('pool')
+        if pool is None:
+            return dict(), 0, 0
+
+        for batch_job in pool['batch_jobs']:
+            if batch_job not in self._configs['batch_jobs']:
+                raise ValueError(f"Batch job '{batch_job}' of the pool is not defined.")
+            if self.get_batch_job_backend(batch_job) != 'interactive':
+                raise ValueError(f"Batch job '{batch_job}' of the pool is submitted as a job script, only interactive "
+                                 f"batch jobs can be kept in a pool.")
+
+        return pool['batch_jobs'], pool['idle_time'], pool['refresh_margin']
+
     def get_batch_job_configs(self, batch_job: str) -> dict:
         return self._configs['batch_jobs'][batch_job]
 
@@ -57,6 +163,13 @@ class ConfigsParser:
 
         return batch_configs
 
+    def get_batch_job_max_wait(self, batch_job: str) -> int:
+        """
+        Get the maximum number of seconds to wait for a batch job to start
+        """
+        configs = self.get_batch_job_configs(batch_job)
+        return configs['max_wait']
+
     def get_batch_job_env(self, batch_job: str) -> List[str]:
         """
         Get a batch job environment declarations
@@ -72,6 +185,42 @@ class ConfigsParser:
         configs = self.get_batch_job_configs(batch_job)
         return configs.get('run', list())
 
+    def get_batch_job_backend(self, batch_job: str) -> str:
+        """
+        Get how a batch job is launched: as an interactive allocation in a screen, or as a submitted job script
+        """
+        configs = self.get_batch_job_configs(batch_job)
+        return configs['backend']
+
+    def get_batch_job_sweep(self, batch_job: str) -> List[Dict[str, str]]:
+        """
+        Get the parameter sets of a batch job sweep: the cartesian product of the grid values, followed by the listed
+        parameter sets. Each parameter set is exported as environment variables in one task of a job array.
+        """
+        configs = self.get_batch_job_configs(batch_job)
+        if 'sweep' not in configs:
+            return list()
+
+        if configs['backend'] != 'script':
+            raise ValueError(f"Batch job '{batch_job}' defines a sweep, which requires the script backend.")
+        if 'JUPYTER' in configs.get('run', list()):
+            raise ValueError(f"Batch job '{batch_job}' defines a sweep, whose tasks cannot run jupyter on one port.")
+
+        grid = configs['sweep'].get('grid', dict())
+        parameter_sets = [dict(zip(grid.keys(), values)) for values in itertools.product(*grid.values())] \
+            if grid else list()
+        parameter_sets += configs['sweep'].get('list', list())
+
+        return [{str(name): str(value) for name, value in parameter_set.items()} for parameter_set in parameter_sets]
+
+    def get_batch_job_provisioning(self, batch_job: str) -> str:
+        """
+        Get how the environment declarations and plain commands of a batch job are run: as a single script, or one
+        command at a time
+        """
+        configs = self.get_batch_job_configs(batch_job)
+        return configs['provisioning']
+
     def get_singularity_configs(self, batch_job: str) -> dict:
 
         singularity_configs = dict()
@@ -83,11 +232,12 @@ class ConfigsParser:
 
         return singularity_configs
 
-    # TODO: Add possibility for jupyter lab and R
     def get_jupyter_configs(self, batch_job: str) -> dict:
 
         jupyter_configs = dict()
         configs = self.get_batch_job_configs(batch_job)['jupyter']
         jupyter_configs['port'] = configs.get('port', 8888)
+        jupyter_configs['flavor'] = configs.get('flavor', 'notebook')
+        jupyter_configs['timeout'] = configs.get('timeout', 60)
 
         return jupyter_configs
@@ -0,0 +1,154 @@
+"""
+Author: @matteobe
+"""
+
+import os
+import json
+import fcntl
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, List, Optional
+
+
+class SessionState:
+    """
+    Class recording the screens, batch jobs and tunnels launched for a configuration file, so that they can be stopped
+    or attached to without discovering them again.
+
+    The state is stored in a JSON file in the .clusty folder next to the configuration file, and written after every
+    update, such that a partially completed start can still be stopped.
+    """
+
+    folder = ".clusty"
+
+    def __init__(self, path: Path):
+        self._path = Path(path)
+        self._lock = threading.RLock()
+        self._state = self._empty()
+
+    @classmethod
+    def for_config(cls, config_file: str) -> 'SessionState':
+        """State associated with a configuration file"""
+
+        config_file = Path(config_file).resolve()
+        return cls(path=config_file.parent / cls.folder / f"{config_file.stem}.state.json")
+
+    def for_cluster(self, cluster_id: str) -> 'SessionState':
+        """State of one of the clusters of a multi-cluster configuration file, stored next to this state"""
+
+        return SessionState(path=self._path.with_suffix(f".{cluster_id}.json"))
+
+    def for_pool(self) -> 'SessionState':
+        """State of the warm pool of allocations kept for the configuration file, stored next to this state"""
+
+        return SessionState(path=self._path.with_suffix(".pool.json"))
+
+    @staticmethod
+    def _empty() -> Dict:
+        return {'cluster': None, 'batch_jobs': dict(), 'tunnels': list()}
+
+    @property
+    def path(self) -> Path:
+        return self._path
+
+    @property
+    def cluster(self) -> Optional[Dict]:
+        return self._state['cluster']
+
+    @property
+    def batch_jobs(self) -> Dict[str, Dict]:
+        return self._state['batch_jobs']
+
+    @property
+    def tunnels(self) -> List[Dict]:
+        return self._state['tunnels']
+
+    def load(self) -> bool:
+        """Load the state from file, returning whether a state was recorded"""
+
+        with self._lock:
+            if not self._path.exists():
+                self._state = self._empty()
+                return False
+
+            with open(self._path, 'r') as file:
+                self._state = {**self._empty(), **json.load(file)}
+
+            return self.cluster is not None
+
+    def save(self) -> None:
+        """Write the state to file, replacing the previous one atomically"""
+
+        with self._lock:
+            self._path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = self._path.with_suffix('.tmp')
+            with open(tmp_path, 'w') as file:
+                json.dump(self._state, file, indent=2)
+            os.replace(tmp_path, self._path)
+
+    @contextmanager
+    def file_lock(self):
+        """Lock the state file against other processes, for a sequence of loading, updating and saving the state"""
+
+        self._path.parent.mkdir(parents=True, exist_ok=True)
+        with open(self._path.with_suffix('.lock'), 'w') as file:
+            fcntl.flock(file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(file, fcntl.LOCK_UN)
+
+    def clear(self) -> None:
+        """Forget the state and remove its file"""
+
+        with self._lock:
+            self._state = self._empty()
+            if self._path.exists():
+                self._path.unlink()
+
+    def set_cluster(self, cluster_id: str, screen: str, pid: int = None, ssh_alias: str = None) -> None:
+        """Record the screen logged in to the cluster, dropping the state of any previous session"""
+
+        with self._lock:
+            self._state = self._empty()
+            self._state['cluster'] = {'id': cluster_id, 'screen': screen, 'pid': pid, 'ssh_alias': ssh_alias}
+            self.save()
+
+    def clear_batch_jobs(self) -> None:
+        """Forget the batch jobs and the tunnels, keeping the screen logged in to the cluster"""
+
+        with self._lock:
+            self._state['batch_jobs'] = dict()
+            self._state['tunnels'] = list()
+            self.save()
+
+    def update_batch_job(self, batch_job: str, **fields) -> None:
+        """Record the fields of a batch job (screen, job_id, node, ip_address, urls)"""
+
+        with self._lock:
+            self._state['batch_jobs'].setdefault(batch_job, dict()).update(fields)
+            self.save()
+
+    def remove_batch_job(self, batch_job: str) -> None:
+        """Forget a batch job"""
+
+        with self._lock:
+            self._state['batch_jobs'].pop(batch_job, None)
+            self.save()
+
+    def add_tunnel(self, binding: str, screen: str = None, pid: int = None) -> None:
+        """Record a tunnel port binding and its screen (None for forwardings of the control master connection)"""
+
+        with self._lock:
+            self._state['tunnels'].append({'screen': screen, 'pid': pid, 'binding': binding})
+            self.save()
+
+    def update_tunnel(self, binding: str, screen: str = None, pid: int = None) -> None:
+        """Record the screen now hosting a tunnel port binding (None when forwarded by the control master connection)"""
+
+        with self._lock:
+            for tunnel in self._state['tunnels']:
+                if tunnel['binding'] == binding:
+                    tunnel.update(screen=screen, pid=pid)
+            self.save()
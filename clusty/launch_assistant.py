@@ -3,12 +3,11 @@
 Author: @matteobe
 """
 
+import sys
 import argparse
 from pathlib import Path
 
-import yaml
-
-from clusty.clusters.client import ClusterClient
+from clusty.utils import timing
 
 
 epilog_str = """
@@ -16,8 +15,39 @@ epilog_str = """
 Launch a cluster setup:
     clusty start --config /path/to/custom/config/file\n
 
+Launch it again on the same connection, stopping the batch jobs and tunnels of the previous launch:
+    clusty start --restart --config /path/to/custom/config/file\n
+
 Stop a cluster setup:
     clusty stop --config /path/to/custom/config/file\n
+
+Show the state of the batch jobs and tunnels:
+    clusty status --config /path/to/custom/config/file\n
+
+Probe the tunnels, or keep probing them and forward the dead ones again (until interrupted):
+    clusty tunnels --config /path/to/custom/config/file
+    clusty tunnels --watch --config /path/to/custom/config/file\n
+
+Attach to the screen of a batch job:
+    clusty attach batch_job --config /path/to/custom/config/file\n
+
+Attach to the screen of a batch job of one of several clusters configured:
+    clusty attach leomed2:batch_job --config /path/to/custom/config/file\n
+
+Print the log of the screen of a batch job, following its new output (until interrupted):
+    clusty logs batch_job -f --config /path/to/custom/config/file\n
+
+Run a command in the screen of a batch job:
+    clusty run batch_job "nvidia-smi" --config /path/to/custom/config/file\n
+
+Keep the sessions open in a local agent, to which the other commands are sent while it runs:
+    clusty agent\n
+
+Keep a pool of started batch jobs, claimed by the next starts (until interrupted, or idle):
+    clusty pool --config /path/to/custom/config/file\n
+
+Time the phases of a launch, writing them to a trace file (open it in chrome://tracing or ui.perfetto.dev):
+    clusty start --config /path/to/custom/config/file --timings --trace trace.json\n
 """
 
 
@@ -30,23 +60,88 @@ def cluster_launch_assistant():
     """
 
     parser = argparse.ArgumentParser(formatter_class=argparse.RawDescriptionHelpFormatter, epilog=epilog_str)
-    parser.add_argument('action', nargs='?', default='start', choices=['start', 'stop'])
+    parser.add_argument('action', nargs='?', default='start',
+                        choices=['start', 'stop', 'status', 'tunnels', 'attach', 'logs', 'run', 'pool', 'agent'])
+    parser.add_argument('batch_job', nargs='?', default=None,
+                        help="Batch job to attach to, to print the log of, or to run the command in. By default, "
+                             "attach to (or print the log of) the cluster screen.\n"
+                             "With several clusters configured, give the cluster (leomed2), or the batch job "
+                             "prefixed by its cluster (leomed2:jupyter).")
+    parser.add_argument('command', nargs='?', default=None,
+                        help="Shell command to run in the batch job.")
     parser.add_argument('-c', '--config', type=str,
                         default=str((Path('.') / ".clusty.yaml").resolve()),
                         help="Specify a custom YAML configuration file to be used for the launch assistant.\n"
                              "By default the file .clusty.yaml is used (if it exists in the current directory.")
+    parser.add_argument('--trace', type=str, default=None,
+                        help="Write the timing of each phase to a file in the Chrome trace event format.")
+    parser.add_argument('--timings', action='store_true',
+                        help="Print a summary of the time spent in each phase at the end.")
+    parser.add_argument('--no-agent', action='store_true',
+                        help="Run the action in this process, even if an agent is running.")
+    parser.add_argument('--restart', action='store_true',
+                        help="Stop the batch jobs and tunnels of the previous start, when reusing its connection.")
+    parser.add_argument('-f', '--follow', action='store_true',
+                        help="Keep printing the new output of the log, until interrupted.")
+    parser.add_argument('--watch', action='store_true',
+                        help="Keep probing the tunnels, forwarding the dead ones again, until interrupted.")
 
     args = parser.parse_args()
 
-    with open(args.config) as file:
-        configs = yaml.full_load(file)
-
-    client = ClusterClient(configs=configs)
-
-    if args.action == 'start':
-        client.start()
-    elif args.action == 'stop':
-        client.stop()
+    from clusty import agent
+
+    if args.action == 'agent':
+        agent.Agent().serve()
+        return
+
+    # Actions are sent to the agent if one is running, unless they are timed. A start is sent only if it prompts for
+    # no credentials, and does not restart. Screens held attached by the agent are released before attaching to them
+    if not args.no_agent and args.trace is None and not args.timings and agent.available():
+        if args.action == 'start':
+            served = not args.restart and agent.logged_in(args.config)
+        else:
+            served = args.action in agent.actions
+        if served:
+            sys.exit(agent.request(action=args.action, config_file=args.config, batch_job=args.batch_job,
+                                   command=args.command))
+        if args.action == 'attach':
+            agent.request(action='release', config_file=args.config)
+
+    # The client and the configuration parsing are imported once the arguments are parsed, to answer --help quickly
+    from clusty.clusters.client import ClusterClient
+    from clusty.configs.parser import ConfigsParser
+    from clusty.configs.state import SessionState
+
+    client = ClusterClient(configs=ConfigsParser.from_file(args.config), state=SessionState.for_config(args.config))
+    if args.trace is not None or args.timings:
+        timing.enable()
+
+    try:
+        if args.action == 'start':
+            client.start(restart=args.restart)
+        elif args.action == 'stop':
+            client.stop()
+        elif args.action == 'status':
+            client.status()
+        elif args.action == 'tunnels':
+            client.tunnels(watch=args.watch)
+        elif args.action == 'attach':
+            client.attach(batch_job=args.batch_job)
+        elif args.action == 'logs':
+            client.logs(batch_job=args.batch_job, follow=args.follow)
+        elif args.action == 'run':
+            client.run(batch_job=args.batch_job, command=args.command)
+        elif args.action == 'pool':
+            client.pool()
+    finally:
+        client.release()
+        # Report the timings also when the action failed, since they show where it got stuck
+        if args.trace is not None:
+            timing.write_trace(args.trace)
+            print(f"Timing trace written to {args.trace}")
+        if args.timings:
+            print()
+            print(timing.timings_table())
 
 
 if __name__ == "__main__":
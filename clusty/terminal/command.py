@@ -0,0 +1,128 @@
+"""
+Command execution with completion detection based on sentinel markers
+"""
+
+import re
+import time
+from uuid import uuid4
+from typing import List, NamedTuple, Optional
+
+import pexpect
+
+sentinel = "CLUSTY"
+
+
+class CommandResult(NamedTuple):
+    """Outcome of a command executed in a terminal"""
+
+    command: str
+    exit_code: int
+    duration: float
+    output: str
+
+    @property
+    def success(self) -> bool:
+        return self.exit_code == 0
+
+
+class ScriptResult(NamedTuple):
+    """Outcome of a sequence of commands executed in a terminal as a single script"""
+
+    commands: List[str]
+    exit_codes: List[int]
+    duration: float
+    outputs: List[str]
+
+    @property
+    def success(self) -> bool:
+        return all([exit_code == 0 for exit_code in self.exit_codes])
+
+
+def _after_begin(output: bytes, marker: str) -> bytes:
+    """Output following the begin marker, or the whole output if the begin marker was dropped from a large output"""
+
+    begin = re.search(f"{marker}_begin\\r?\\n".encode(), output)
+    return output if begin is None else output[begin.end():]
+
+
+def run_command(terminal: pexpect.spawn, command: str, timeout: Optional[float] = None) -> CommandResult:
+    """
+    Run a command in a terminal and wait for its completion.
+
+    The command is wrapped by a begin and an end marker, unique to this call. The end marker carries the exit status
+    of the command, so that the function returns as soon as the command is completed. The markers are printed with
+    printf format strings, hence the terminal echo of the typed command never matches the markers themselves. Only the
+    end marker is waited for, the output being taken from the begin marker on. Of an output larger than what the
+    terminal keeps (see clusty.terminal.shell.RingBuffer), the end is returned.
+
+    Args:
+        terminal (pexpect.spawn): terminal, possibly attached to nested screens, running a POSIX shell
+        command (str): shell command to execute
+        timeout (float): maximum number of seconds to wait for the command to complete. Default is to wait forever
+    """
+
+    marker = f"{sentinel}_{uuid4().hex[0:12]}"
+    end_pattern = re.compile(f"{marker}_end_([0-9]+)".encode())
+
+    start = time.monotonic()
+    terminal.sendline(f"printf '%s_begin\\n' {marker}; {command}")
+    terminal.sendline(f"printf '%s_end_%d\\n' {marker} $?")
+
+    response = terminal.expect_list([end_pattern, pexpect.EOF, pexpect.TIMEOUT], timeout=timeout)
+    if response == 1:
+        raise ConnectionError(f"Terminal closed while running command '{command}'.")
+    elif response == 2:
+        raise TimeoutError(f"Command '{command}' did not complete within {timeout} seconds.")
+    duration = time.monotonic() - start
+
+    # The line of the end marker starts with the prompt of the shell, not part of the output
+    exit_code = int(terminal.match.group(1))
+    lines = _after_begin(terminal.before, marker).decode(errors='replace').replace('\r', '').split('\n')[:-1]
+    output = '\n'.join([line for line in lines if marker not in line]).strip()
+
+    return CommandResult(command=command, exit_code=exit_code, duration=duration, output=output)
+
+
+def run_script(terminal: pexpect.spawn, commands: List[str], timeout: Optional[float] = None) -> ScriptResult:
+    """
+    Run a sequence of commands in a terminal as a single script, with one write and one completion check.
+
+    The script is written to a temporary file with a heredoc and sourced, so that the commands run in the shell of the
+    terminal (e.g. exported variables and the working directory persist) while reading their input from the terminal.
+    Each command runs regardless of the exit status of the previous ones. A separator marker is printed after each
+    command, and the end marker carries the exit statuses of all the commands on a single line.
+
+    Args:
+        terminal (pexpect.spawn): terminal, possibly attached to nested screens, running a POSIX shell
+        commands (list): shell commands to execute, in order
+        timeout (float): maximum number of seconds to wait for the script to complete. Default is to wait forever
+    """
+
+    marker = f"{sentinel}_{uuid4().hex[0:12]}"
+    end_pattern = re.compile(f"{marker}_end((?: [0-9]+)*)\\r?\\n".encode())
+    script_file = f"${{TMPDIR:-/tmp}}/{marker}.sh"
+
+    lines = [f"cat > {script_file} <<'{marker}_EOF'", f"printf '%s_begin\\n' {marker}", f"{marker}_status=''"]
+    for command in commands:
+        lines += [command, f"{marker}_status=\"${{{marker}_status}} $?\"", f"printf '%s_step\\n' {marker}"]
+    lines += [f"{marker}_EOF",
+              f". {script_file}; rm -f {script_file}; printf '%s_end%s\\n' {marker} \"${{{marker}_status}}\""]
+
+    start = time.monotonic()
+    terminal.send('\n'.join(lines) + '\n')
+
+    response = terminal.expect_list([end_pattern, pexpect.EOF, pexpect.TIMEOUT], timeout=timeout)
+    if response == 1:
+        raise ConnectionError(f"Terminal closed while running the script of {len(commands)} commands.")
+    elif response == 2:
+        raise TimeoutError(f"Script of {len(commands)} commands did not complete within {timeout} seconds.")
+    duration = time.monotonic() - start
+
+    # The outputs of the first steps are missing if they were dropped from a large output
+    exit_codes = [int(exit_code) for exit_code in terminal.match.group(1).split()]
+    steps = _after_begin(terminal.before, marker).decode(errors='replace').replace('\r', '').split(f"{marker}_step")
+    steps = [''] * (len(exit_codes) + 1 - len(steps)) + steps
+    outputs = ['\n'.join([line for line in step.split('\n') if marker not in line]).strip()
+               for step in steps[:len(exit_codes)]]
+
+    return ScriptResult(commands=list(commands), exit_codes=exit_codes, duration=duration, outputs=outputs)
@@ -0,0 +1,75 @@
+"""
+Incremental reading of log files, such as the logs of the screens and the output files of job scripts
+"""
+
+import os
+import sys
+import time
+import codecs
+from typing import List, Optional
+
+from clusty.terminal.ssh import remote_read
+
+
+class LogTail:
+    """
+    Reader of a log file growing on the local machine, or on an SSH host through the control master connection. The
+    offset of the bytes read so far is kept, such that each read returns the new output only, and patterns are matched
+    once on each line. Multi-byte characters split between two reads are decoded once complete.
+    """
+
+    read_timeout = 30
+    follow_period = 1.0
+
+    def __init__(self, path: str, ssh_alias: str = None, offset: int = 0):
+        self.path = path
+        self.ssh_alias = ssh_alias
+        self.offset = offset
+        self._decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+        self._partial_line = ''
+
+    def read(self) -> str:
+        """New output since the previous read, with the line endings of the terminal normalized"""
+
+        if self.ssh_alias is None:
+            data = self._read_local()
+        else:
+            data = remote_read(self.ssh_alias, self.path, offset=self.offset, timeout=self.read_timeout)
+        self.offset += len(data)
+
+        return self._decoder.decode(data).replace('\r\n', '\n')
+
+    def _read_local(self) -> bytes:
+        path = os.path.expanduser(os.path.expandvars(self.path))
+        try:
+            with open(path, 'rb') as file:
+                # A file truncated since the previous read (e.g. a new screen of the same name) is read from the start
+                if os.fstat(file.fileno()).st_size < self.offset:
+                    self.offset = 0
+                    self._decoder.reset()
+                file.seek(self.offset)
+                return file.read()
+        except FileNotFoundError:
+            return b''
+
+    def lines(self) -> List[str]:
+        """New complete lines since the previous read, the last line being returned once terminated"""
+
+        # A line ending split between two reads leaves the carriage return at the end of the line
+        *lines, self._partial_line = (self._partial_line + self.read()).split('\n')
+        return [line.rstrip('\r') for line in lines]
+
+    def follow(self, period: float = None, stream=None, until: Optional[float] = None) -> None:
+        """Write the new output to the stream (the standard output by default) until interrupted, or the deadline"""
+
+        period = self.follow_period if period is None else period
+        stream = sys.stdout if stream is None else stream
+        try:
+            while until is None or time.monotonic() < until:
+                text = self.read()
+                if text:
+                    stream.write(text)
+                    stream.flush()
+                time.sleep(period)
+        except KeyboardInterrupt:
+            pass
@@ -2,26 +2,61 @@
 Author: @matteobe
 """
 
-import time
 import re
 from uuid import uuid4
-from typing import List, Tuple, Union
+from typing import List, NamedTuple, Optional, Union
 import pexpect
 
+from clusty.terminal.command import run_command
 from clusty.terminal.shell import Shell
+from clusty.terminal.ssh import control_options
+from clusty.utils.polling import wait_until
+from clusty.utils.timing import traced
 from clusty.utils.validation import format_input_to_list
 
 
+class ScreenInfo(NamedTuple):
+    """Screen session as listed by screen -ls"""
+
+    pid: int
+    name: str
+    date: Optional[str]
+    state: str
+
+    @property
+    def id(self) -> str:
+        """Session identifier, unique across screens with the same name"""
+        return f"{self.pid}.{self.name}"
+
+    @property
+    def detached(self) -> bool:
+        return self.state.lower().endswith("detached")
+
+
 class Screen:
     """
     Screen class packages utilities for creating and attaching to screens
     """
 
-    wait_period = 1
+    list_timeout = 10
+
+    # Polling of the screen state after create, kill and detach operations
+    poll_interval = 0.05
+    poll_deadline = 10
+
+    # Logs of the screens, in the home folder of the host running them, flushed every log_flush seconds
+    log_folder = "$HOME/.clusty/logs"
+    log_flush = 1
+
+    @classmethod
+    def log_file(cls, name: str) -> str:
+        """Log file of a screen, on the host running it"""
+        return f"{cls.log_folder}/{name}.log"
 
     @classmethod
+    @traced("screen.create")
     def create(cls, name: str = None, unique: bool = True, terminal: pexpect.spawn = None) -> str:
-        """Create new detached screen and change the name if not unique"""
+        """Create new detached screen, logging its output to its log file, and change the name if not unique"""
 
         terminal_passed_in = (terminal is not None)
         terminal = Shell() if terminal is None else terminal
@@ -31,70 +66,86 @@ class Screen:
         if unique and len(screen_list):
             name = f"{name}_{str(uuid4().hex[0:4])}"
 
-        terminal.sendline(f"screen -dmS {name}")
-        time.sleep(Screen.wait_period)
+        run_command(terminal, f"screen -dmS {name}", timeout=cls.list_timeout)
+        created = wait_until(lambda: len(cls.list(name=name, exact_name_match=True, terminal=terminal)) > 0,
+                             interval=cls.poll_interval, deadline=cls.poll_deadline)
+
+        # The log file is truncated first, since screen appends to it
+        if created:
+            log_file = cls.log_file(name)
+            run_command(terminal, f'mkdir -p "{cls.log_folder}" && : > "{log_file}" && '
+                                  f'screen -S {name} -X logfile "{log_file}" && '
+                                  f'screen -S {name} -X logfile flush {cls.log_flush} && screen -S {name} -X log on',
+                        timeout=cls.list_timeout)
 
         if not terminal_passed_in:
             terminal.close(force=True)
 
+        if not created:
+            raise TimeoutError(f"Screen '{name}' not created within {cls.poll_deadline} seconds.")
+
         return name
 
-    @staticmethod
-    def kill(name: str, terminal: pexpect.spawn = None) -> None:
-        """Kill a screen with the given name or identifier"""
+    @classmethod
+    @traced("screen.kill")
+    def kill(cls, name: str, terminal: pexpect.spawn = None) -> bool:
+        """Kill a screen with the given name or identifier, returning whether the screen is gone"""
 
         terminal_passed_in = (terminal is not None)
         terminal = Shell() if terminal is None else terminal
-        if terminal is None:
-            terminal = Shell()
 
-        cmd = f"screen -XS {name} kill"
-        terminal.sendline(cmd)
-        time.sleep(Screen.wait_period)
+        run_command(terminal, f"screen -XS {name} kill", timeout=cls.list_timeout)
+        killed = wait_until(lambda: len(cls.list(name=name, exact_name_match=True, terminal=terminal)) == 0,
+                            interval=cls.poll_interval, deadline=cls.poll_deadline)
 
         if not terminal_passed_in:
             terminal.close(force=True)
 
+        return killed
+
     @classmethod
     def kill_all(cls, name: str = None, exact_name_match: bool = True) -> None:
         """Kill all screens which match the passed-in name exactly or partially (depending on exact_name_match flag)"""
 
         screen_list = cls.list(name=name, exact_name_match=exact_name_match)
         for screen in screen_list:
-            cls.kill(name=screen[0])
+            cls.kill(name=screen.id)
 
-    @staticmethod
-    def list(name: str = None, exact_name_match: bool = False, terminal: pexpect.spawn = None) \
-            -> List[Tuple[str, str, bool]]:
-        """Retrieve a list with the screen IDs associated with a given screen name, if None, retrieve all screen IDs"""
+    # Screen -ls line: PID.name, optional date and state. Escape sequences are replaced by whitespace before matching,
+    # since screen may render whitespace as cursor movements when listing from inside another screen
+    escape_pattern = re.compile(r"\x1b\[[0-9;?]*[A-Za-z]|\x1b[()][A-Za-z0-9]|\x1b[=>]")
+    screen_pattern = re.compile(r"^\s*([0-9]+)\.(\S+?)\s+(?:\(([0-9][^)]*)\)\s+)?"
+                                r"\((Attached|Detached|Multi, attached|Multi, detached|Dead \?\?\?|Remote or dead)\)",
+                                re.MULTILINE)
+
+    @classmethod
+    @traced("screen.list")
+    def list(cls, name: str = None, exact_name_match: bool = False, terminal: pexpect.spawn = None) \
+            -> List[ScreenInfo]:
+        """Retrieve a list with the screens associated with a given screen name, if None, retrieve all screens"""
 
         cmd = "screen -ls" if name is None else f"screen -ls {name}"
 
         if terminal is None:
             terminal = pexpect.spawn(cmd)
-            screen_list = terminal.read().decode()
+            screen_list = terminal.read().decode(errors='replace')
             terminal.close()
         else:
-            terminal.sendline(cmd)
-            # IMPROVE: Somehow screen -ls doesn't trigger a EOF for matching, and only matches the TIMEOUT. Current
-            #  workaround avoids an error, but is not technically correct. The downside of the current method is that
-            #  the execution needs to wait for the timeout in order to continue.
-            #  The before property stores ALL the shell output, not just the output of the screen.
-            terminal.expect_list([pexpect.EOF, pexpect.TIMEOUT], timeout=Screen.wait_period)
-            screen_list = terminal.before.decode()
-
-        # IMPROVE: Check why \s+ regex not matching whitespace in the screen -ls name output
-        screen_pattern = re.compile(r"([0-9]{3,6})\.(\w+).+(\(Detached\)|\(Attached\))", re.MULTILINE)
-        matched_screens = screen_pattern.findall(screen_list)
-        matched_screens = list(set(matched_screens))
-
-        # Select the screens to return
-        screens = list()
-        for screen_id, screen_name, attach_status in matched_screens:
-            add_screen = False if exact_name_match and not screen_name == name else True
+            # Only the output delimited by the command markers is parsed, which excludes any previous shell output
+            screen_list = run_command(terminal, cmd, timeout=Screen.list_timeout).output
+
+        return cls.parse(screen_list, name=name if exact_name_match else None)
+
+    @classmethod
+    def parse(cls, screen_list: str, name: str = None) -> List[ScreenInfo]:
+        """Parse the output of screen -ls, keeping only the screens with the given name if specified"""
+
+        screen_list = cls.escape_pattern.sub(' ', screen_list).replace('\r', '')
 
-            if add_screen:
-                screen = (screen_id, screen_name, True if attach_status == "(Detached)" else False)
+        screens = list()
+        for pid, screen_name, date, state in cls.screen_pattern.findall(screen_list):
+            screen = ScreenInfo(pid=int(pid), name=screen_name, date=date if date else None, state=state)
+            if (name is None or name in (screen.name, screen.id, pid)) and screen not in screens:
                 screens.append(screen)
 
         return screens
@@ -118,9 +169,16 @@ class Screen:
 
         return terminal
 
-    @staticmethod
-    def detach(terminal: pexpect.spawn, level: int = 1) -> None:
-        """Implements the screen detach procedure for a terminal"""
+    # Notice printed by screen once detached
+    detached_pattern = re.compile(rb"\[detached from [0-9]+\.")
+
+    @classmethod
+    @traced("screen.detach")
+    def detach(cls, terminal: pexpect.spawn, level: int = 1) -> bool:
+        """Implements the screen detach procedure for a terminal, returning whether the detach notice was received"""
+
+        # Discard pending output, so that only the notice of this detach is matched
+        terminal.expect_list([pexpect.EOF, pexpect.TIMEOUT], timeout=0)
 
         terminal.sendcontrol('a')
         # For nested screen, multiple Ctrl-a signals plus a final a keystroke must be send in order to detach correctly
@@ -129,7 +187,10 @@ class Screen:
         if level > 1:
             terminal.send('a')
         terminal.sendcontrol('d')
-        time.sleep(Screen.wait_period)
+        response = terminal.expect_list([cls.detached_pattern, pexpect.EOF, pexpect.TIMEOUT],
+                                        timeout=cls.poll_deadline)
+
+        return response != 2
 
     @classmethod
     def detach_nested(cls, terminal: pexpect.spawn, depth: int = 1, terminate: bool = False) -> None:
@@ -142,3 +203,62 @@ class Screen:
 
         if terminate:
             terminal.close(force=True)
+
+
+class ScreenSession:
+    """
+    Terminal attached to a nested sequence of screens (listed from outward to inward) for the duration of a sequence
+    of operations, so that the screens are attached and detached only once.
+
+    The session is a re-entrant context manager: entering an attached session reuses the terminal, and only the
+    outermost exit detaches from the screens.
+
+    With an SSH alias, the screens run on the SSH host and are attached in a terminal of their own, logged in through
+    the control master connection, such that several sessions are attached at the same time without credentials.
+    """
+
+    def __init__(self, screens: Union[str, List[str]], ssh_alias: str = None):
+        self.screens = format_input_to_list(screens)
+        self.ssh_alias = ssh_alias
+        self.terminal = None
+        self._depth = 0
+
+    @property
+    def name(self) -> str:
+        """Name of the innermost screen"""
+        return self.screens[-1]
+
+    @property
+    def attached(self) -> bool:
+        return self.terminal is not None
+
+    @traced("screen.session.attach")
+    def attach(self) -> pexpect.spawn:
+        """Attach to the nested screens, unless already attached"""
+
+        if not self.attached:
+            terminal = None
+            if self.ssh_alias is not None:
+                terminal = Shell()
+                terminal.sendline(f"ssh {control_options()} {self.ssh_alias}")
+            self.terminal = Screen.attach_nested(screens=self.screens, terminal=terminal)
+
+        return self.terminal
+
+    @traced("screen.session.detach")
+    def detach(self) -> None:
+        """Detach from the nested screens and close the terminal"""
+
+        if self.attached:
+            Screen.detach_nested(terminal=self.terminal, depth=len(self.screens), terminate=True)
+            self.terminal = None
+
+    def __enter__(self) -> 'ScreenSession':
+        self.attach()
+        self._depth += 1
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb) -> None:
+        self._depth -= 1
+        if self._depth == 0:
+            self.detach()
@@ -1,10 +1,51 @@
 """
-Create a shell terminal using pexpect
+Create a shell terminal using pexpect, with bounded buffering of the output
 """
 
+import io
+
 import pexpect
 
 
-class Shell(pexpect.spawn):
+class RingBuffer(io.BytesIO):
+    """
+    Bytes buffer keeping the last capacity bytes written. The older bytes are dropped once twice as many are written,
+    such that trimming takes constant time per byte written.
+    """
+
+    capacity = 8 << 20
+
+    def write(self, data) -> int:
+        written = super().write(data)
+        if self.tell() > 2 * self.capacity:
+            kept = self.getvalue()[-self.capacity:]
+            self.seek(0)
+            self.truncate()
+            super().write(kept)
+
+        return written
+
+
+class Terminal(pexpect.spawn):
+    """
+    Terminal running a command, with memory and match time independent of how much output the processes attached to it
+    print. The output is read in chunks of up to maxread bytes, patterns are matched within the last searchwindowsize
+    bytes, and the output preceding a match (before) keeps its last RingBuffer.capacity bytes.
+
+    The search window is as large as a read, since pexpect searches only the last searchwindowsize bytes of a read:
+    each read is searched whole, along with the end of the previous one for patterns split between two reads.
+    """
+
+    maxread = 65536
+    searchwindowsize = 65536
+
+    def __init__(self, command: str, **kwargs):
+        super().__init__(command, maxread=self.maxread, searchwindowsize=self.searchwindowsize, **kwargs)
+        self.buffer_type = RingBuffer
+        self._buffer = RingBuffer()
+        self._before = RingBuffer()
+
+
+class Shell(Terminal):
     def __init__(self):
         super().__init__('sh')
@@ -1,12 +1,23 @@
 """SSH configuration functions"""
 
+import time
+import subprocess
 from pathlib import Path
 
+import pexpect
+
+from clusty.terminal.command import CommandResult
+
 ssh_config_file_str = "~/.ssh/config"
 ssh_config_file = Path(ssh_config_file_str).expanduser().resolve()
 indent = "\n\t"
 end = "\n\n"
 
+# Connection multiplexing: the control master socket is kept alive in the background after the login session ends
+control_path = "~/.ssh/clusty-%C"
+control_persist = "12h"
+control_timeout = 10
+
 
 def config_control_master() -> None:
     """The control master configuration in the ssh config file allows for multiple logins to the same SSH host
@@ -23,6 +34,66 @@ def config_control_master() -> None:
     print(f"ssh-config: Added Control Master to {ssh_config_file_str}")
 
 
+def control_options() -> str:
+    """SSH options creating a control master connection, or reusing the existing one"""
+
+    return f"-o ControlMaster=auto -o ControlPath={control_path} -o ControlPersist={control_persist}"
+
+
+def control_command(ssh_alias: str, command: str, binding: str = None) -> bool:
+    """
+    Send a control command (check, forward, cancel, exit) to the control master connection of an SSH host, returning
+    whether it succeeded. Port forwarding commands require the binding ([bind_address:]port:host:hostport).
+    """
+
+    cmd = f"ssh -o ControlPath={control_path} -O {command}"
+    if binding is not None:
+        cmd += f" -L {binding}"
+    cmd += f" {ssh_alias}"
+
+    _, exit_status = pexpect.run(cmd, withexitstatus=True, timeout=control_timeout)
+
+    return exit_status == 0
+
+
+def remote_command(ssh_alias: str, command: str, input: str = None, timeout: float = None) -> CommandResult:
+    """
+    Run a command on an SSH host with a single exec through the control master connection, writing the optional input
+    to its standard input. The connection never prompts for credentials, hence it fails if no login is alive.
+    """
+
+    cmd = ["ssh"] + control_options().split() + ["-o", "BatchMode=yes", ssh_alias, command]
+
+    start = time.monotonic()
+    try:
+        process = subprocess.run(cmd, input=input, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                                 universal_newlines=True, timeout=timeout)
+    except subprocess.TimeoutExpired:
+        raise TimeoutError(f"Command '{command}' on {ssh_alias} did not complete within {timeout} seconds.")
+
+    return CommandResult(command=command, exit_code=process.returncode, duration=time.monotonic() - start,
+                         output=process.stdout.strip())
+
+
+def remote_read(ssh_alias: str, path: str, offset: int = 0, timeout: float = None) -> bytes:
+    """
+    Read the bytes of a file on an SSH host from the given offset on, with a single exec through the control master
+    connection. The path is expanded by the shell of the host (~ and variables), and a missing file reads as empty.
+    """
+
+    command = f"tail -c +{offset + 1} {path} 2>/dev/null"
+    cmd = ["ssh"] + control_options().split() + ["-o", "BatchMode=yes", ssh_alias, command]
+
+    try:
+        process = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, timeout=timeout)
+    except subprocess.TimeoutExpired:
+        raise TimeoutError(f"Reading {path} on {ssh_alias} did not complete within {timeout} seconds.")
+    if process.returncode == 255:
+        raise ConnectionError(f"Connection to {ssh_alias} failed while reading {path}.")
+
+    return process.stdout
+
+
 def config_host(ssh_alias: str, host_name: str, user: str, ssh_key: str = None, proxy_jump: str = None,
                 proxy_host_name: str = None, forward_port: int = None) -> None:
     """Add host configuration to the SSH config file depending on options passed in"""
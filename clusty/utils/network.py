@@ -0,0 +1,79 @@
+"""
+Helper functions for probing network ports
+"""
+
+import time
+import socket
+from typing import Iterable, Optional, Set
+
+
+def port_open(port: int, host: str = '127.0.0.1', timeout: float = 0.5) -> bool:
+    """Check whether a TCP connection to the given host and port can be established"""
+
+    return connect_latency(port=port, host=host, timeout=timeout) is not None
+
+
+def connect_latency(port: int, host: str = '127.0.0.1', timeout: float = 0.5) -> Optional[float]:
+    """Seconds taken to establish a TCP connection to the given host and port, None if it cannot be established"""
+
+    start = time.monotonic()
+    try:
+        with socket.create_connection((host, port), timeout=timeout):
+            return time.monotonic() - start
+    except OSError:
+        return None
+
+
+def http_latency(url: str, timeout: float = 2.0) -> Optional[float]:
+    """
+    Seconds taken to get the response to a GET request of the URL, whatever its status, None if no response arrives.
+    Certificates are not verified, since the local end of a tunnel does not match them anyway.
+    """
+
+    import ssl
+    import http.client
+    from urllib.parse import urlsplit
+
+    url = urlsplit(url)
+    if url.scheme == 'https':
+        context = ssl.create_default_context()
+        context.check_hostname = False
+        context.verify_mode = ssl.CERT_NONE
+        connection = http.client.HTTPSConnection(url.hostname, url.port, timeout=timeout, context=context)
+    else:
+        connection = http.client.HTTPConnection(url.hostname, url.port, timeout=timeout)
+
+    start = time.monotonic()
+    try:
+        connection.request('GET', url.path or '/')
+        connection.getresponse().read()
+        return time.monotonic() - start
+    except (OSError, http.client.HTTPException):
+        return None
+    finally:
+        connection.close()
+
+
+def local_port(binding: str) -> int:
+    """Local port of an SSH port forwarding binding ([bind_address:]port:host:hostport)"""
+
+    return int(binding.split(':')[-3])
+
+
+def free_local_port(ports: Iterable[int], exclude: Set[int] = frozenset(), host: str = '127.0.0.1') -> int:
+    """
+    First port of the candidates on which a local server can listen. Ports are probed by binding to them, which takes
+    no round trip, and without address reuse, such that ports of connections closing are not picked.
+    """
+
+    for port in ports:
+        if port in exclude:
+            continue
+        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as probe:
+            try:
+                probe.bind((host, port))
+                return port
+            except OSError:
+                continue
+
+    raise RuntimeError("No free local port among the candidates.")
@@ -0,0 +1,80 @@
+"""
+Helper functions for readable console output of tasks running concurrently
+"""
+
+import sys
+import threading
+from contextlib import contextmanager
+
+_thread_state = threading.local()
+
+
+class PrefixedStream:
+    """
+    Text stream prefixing each line with the prefix assigned to the thread writing it.
+    Lines are buffered per thread and written as a whole, so that the output of concurrent threads does not interleave
+    within a line.
+    """
+
+    def __init__(self, stream):
+        self._stream = stream
+        self._lock = threading.Lock()
+
+    def write(self, text: str) -> int:
+        buffer = getattr(_thread_state, 'buffer', '') + text
+        *lines, buffer = buffer.split('\n')
+        _thread_state.buffer = buffer
+        if lines:
+            self._write_lines(lines)
+
+        return len(text)
+
+    def flush(self) -> None:
+        buffer = getattr(_thread_state, 'buffer', '')
+        if buffer:
+            _thread_state.buffer = ''
+            self._write_lines([buffer], newline=False)
+        self._stream.flush()
+
+    def _write_lines(self, lines, newline: bool = True) -> None:
+        prefix = getattr(_thread_state, 'prefix', '')
+        text = '\n'.join([f"{prefix}{line}" for line in lines]) + ('\n' if newline else '')
+        with self._lock:
+            self._stream.write(text)
+            self._stream.flush()
+
+    def __getattr__(self, item):
+        return getattr(self._stream, item)
+
+
+@contextmanager
+def prefixed_stdout():
+    """
+    Replace the standard output with a stream prefixing the lines according to the thread writing them. Nested uses
+    keep the outer stream, such that the lines are prefixed once.
+    """
+
+    if isinstance(sys.stdout, PrefixedStream):
+        yield
+        return
+
+    stdout = sys.stdout
+    sys.stdout = PrefixedStream(stdout)
+    try:
+        yield
+    finally:
+        sys.stdout.flush()
+        sys.stdout = stdout
+
+
+@contextmanager
+def output_prefix(prefix: str):
+    """Prefix all the lines printed by the current thread"""
+
+    previous_prefix = getattr(_thread_state, 'prefix', '')
+    _thread_state.prefix = prefix
+    try:
+        yield
+    finally:
+        sys.stdout.flush()
+        _thread_state.prefix = previous_prefix
@@ -0,0 +1,30 @@
+"""
+Helper functions for waiting on events by polling
+"""
+
+import time
+from typing import Callable
+
+
+def wait_until(condition: Callable[[], bool], interval: float = 0.05, deadline: float = 10,
+               max_interval: float = 1) -> bool:
+    """
+    Poll a condition until it is met or the deadline expires, doubling the interval between polls up to max_interval.
+    Returns whether the condition was met.
+
+    Args:
+        condition (callable): function without arguments returning True once the awaited event happened
+        interval (float): seconds to wait after the first poll
+        deadline (float): maximum number of seconds to wait for the condition to be met
+        max_interval (float): maximum number of seconds between two polls
+    """
+
+    end = time.monotonic() + deadline
+    while not condition():
+        remaining = end - time.monotonic()
+        if remaining <= 0:
+            return False
+        time.sleep(min(interval, remaining))
+        interval = min(interval * 2, max_interval)
+
+    return True
@@ -2,7 +2,7 @@
 Author: @matteobe
 """
 
-from typing import List, Dict
+from typing import List, Dict, Sequence
 
 
 def replace_by_dict(values: List[str], replace: Dict[str, str]) -> List[str]:
@@ -14,3 +14,18 @@ def replace_by_dict(values: List[str], replace: Dict[str, str]) -> List[str]:
         values = [item.replace(substring, replacement) for item in values]
 
     return values
+
+
+def format_table(headers: Sequence[str], rows: List[Sequence]) -> str:
+    """
+    Format rows of values as a table with aligned columns, replacing missing values by a dash
+    """
+
+    rows = [["-" if value is None else str(value) for value in row] for row in rows]
+    widths = [max([len(header)] + [len(row[idx]) for row in rows]) for idx, header in enumerate(headers)]
+
+    lines = ["  ".join([header.ljust(width) for header, width in zip(headers, widths)]).rstrip(),
+             "  ".join(["-" * width for width in widths])]
+    lines += ["  ".join([value.ljust(width) for value, width in zip(row, widths)]).rstrip() for row in rows]
+
+    return "\n".join(lines)
@@ -0,0 +1,128 @@
+"""
+Helper functions for timing the phases of the operations on the cluster, as nested spans exported in the Chrome trace
+event format (chrome://tracing, https://ui.perfetto.dev) or summarized in a table
+"""
+
+import os
+import json
+import time
+import functools
+import threading
+from contextlib import contextmanager
+from typing import Callable, Dict, List, NamedTuple
+
+from clusty.utils.string import format_table
+
+_thread_state = threading.local()
+_lock = threading.Lock()
+_spans = list()
+_enabled = False
+
+
+class Span(NamedTuple):
+    """Timed phase, with the attributes inherited from the enclosing spans of the same thread"""
+
+    name: str
+    start: float
+    duration: float
+    thread: int
+    thread_name: str
+    depth: int
+    args: Dict
+
+
+def enable(enabled: bool = True) -> None:
+    """Start (or stop) recording spans, dropping the spans recorded so far"""
+
+    global _enabled
+    with _lock:
+        _enabled = enabled
+        _spans.clear()
+
+
+def spans() -> List[Span]:
+    """Spans recorded so far, in order of completion"""
+
+    with _lock:
+        return list(_spans)
+
+
+@contextmanager
+def span(name: str, **args):
+    """
+    Time the enclosed block as a span, nested in the span currently open in the same thread. The attributes (e.g.
+    cluster, batch_job) are attached to the span and to all the spans nested in it.
+    """
+
+    if not _enabled:
+        yield
+        return
+
+    stack = getattr(_thread_state, 'stack', None)
+    if stack is None:
+        stack = _thread_state.stack = list()
+    args = {**(stack[-1] if stack else dict()), **{key: value for key, value in args.items() if value is not None}}
+
+    stack.append(args)
+    start = time.time()
+    try:
+        yield
+    finally:
+        duration = time.time() - start
+        stack.pop()
+        thread = threading.current_thread()
+        with _lock:
+            _spans.append(Span(name=name, start=start, duration=duration, thread=thread.ident,
+                               thread_name=thread.name, depth=len(stack), args=args))
+
+
+def traced(name: str) -> Callable:
+    """Decorator timing each call of a function as a span"""
+
+    def decorator(function: Callable) -> Callable:
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return function(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def write_trace(path: str) -> None:
+    """Write the recorded spans to a file in the Chrome trace event format"""
+
+    recorded = spans()
+    pid = os.getpid()
+    threads = {recorded_span.thread: recorded_span.thread_name for recorded_span in recorded}
+    events = [{'name': 'thread_name', 'ph': 'M', 'pid': pid, 'tid': thread, 'args': {'name': thread_name}}
+              for thread, thread_name in threads.items()]
+    events += [{'name': recorded_span.name, 'cat': 'clusty', 'ph': 'X', 'pid': pid, 'tid': recorded_span.thread,
+                'ts': round(recorded_span.start * 1e6), 'dur': round(recorded_span.duration * 1e6),
+                'args': recorded_span.args} for recorded_span in recorded]
+
+    with open(path, 'w') as file:
+        json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, file)
+
+
+def timings_table() -> str:
+    """Table summarizing the recorded spans by name, in order of first start"""
+
+    durations = dict()
+    for recorded_span in sorted(spans(), key=lambda recorded: recorded.start):
+        durations.setdefault(recorded_span.name, list()).append(recorded_span.duration)
+
+    rows = [[name, len(values), f"{sum(values):.2f}", f"{sum(values) / len(values):.2f}", f"{max(values):.2f}"]
+            for name, values in durations.items()]
+    return format_table(['Phase', 'Calls', 'Total (s)', 'Mean (s)', 'Max (s)'], rows)
+
+
+def percentile(values: List[float], q: float) -> float:
+    """Percentile q (between 0 and 100) of the values, by linear interpolation between the closest ranks"""
+
+    values = sorted(values)
+    rank = (len(values) - 1) * q / 100
+    lower = int(rank)
+    upper = min(lower + 1, len(values) - 1)
+    return values[lower] + (values[upper] - values[lower]) * (rank - lower)
@@ -2,9 +2,13 @@
 Helper functions for validation purpose
 """
 
+import threading
 from typing import List, Dict
 
-from cerberus import Validator
+# Validators by schema, created on the first validation against the schema. Cerberus is imported along with the first
+# validator only, since it is slow to import and not needed for configuration files validated before
+_validators = dict()
+_validators_lock = threading.Lock()
 
 
 # --------------------- INPUT VALIDATION -------------------- #
@@ -35,16 +39,32 @@ def validate_schema(document: Dict, schema: Dict, allow_unknown: bool = False, r
         require_all (bool): require all keys to be present. Default is True
     """
 
-    v = Validator(allow_unknow=allow_unknown, require_all=require_all)
-    normalized_document = v.normalized(document=document, schema=schema)
+    with _validators_lock:
+        v = _validator(schema=schema, allow_unknown=allow_unknown, require_all=require_all)
+        normalized_document = v.normalized(document=document)
+        valid = v.validate(document=normalized_document)
 
-    if not v.validate(document=normalized_document, schema=schema):
+    if not valid:
         raise ValidationError(f"Document is invalid according to the pre-defined schema.\n"
                               f"The following errors where detected: {v.errors}")
 
     return normalized_document
 
 
+def _validator(schema: Dict, allow_unknown: bool, require_all: bool):
+    """Validator bound to a schema, which cerberus checks and compiles once, when the validator is created"""
+
+    key = (id(schema), allow_unknown, require_all)
+    cached_schema, validator = _validators.get(key, (None, None))
+    if cached_schema is not schema:
+        from cerberus import Validator
+
+        validator = Validator(schema, allow_unknow=allow_unknown, require_all=require_all)
+        _validators[key] = (schema, validator)
+
+    return validator
+
+
 # --------------------- INPUT PARSING -------------------- #
 def format_input_to_list(item_to_format):
 
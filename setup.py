@@ -2,6 +2,7 @@ from os import path
 from setuptools import setup
 
 from clusty import __version__
+from clusty.clusters.registry import builtin_clusters, entry_point_group
 
 # Project
 NAME = 'clusty'
@@ -68,7 +69,8 @@ setup(name=NAME,
       entry_points={
           'console_scripts': [
               'clusty = clusty.launch_assistant:cluster_launch_assistant'
-          ]
+          ],
+          entry_point_group: [f"{cluster_id} = {reference}" for cluster_id, reference in builtin_clusters.items()]
       },
       include_package_data=True,
       zip_safe=False)
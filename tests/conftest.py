@@ -0,0 +1,74 @@
+"""
+Fixtures and helpers shared by the tests, running them against the fake cluster
+"""
+
+import shutil
+import subprocess
+import sys
+
+import pytest
+
+from clusty.terminal.screen import Screen
+from clusty.terminal.shell import Shell
+from tests.fake_cluster import FakeCluster
+
+
+requires_screen = pytest.mark.skipif(shutil.which("screen") is None, reason="GNU screen is not installed")
+
+
+def imported_modules(statement: str, modules: list) -> list:
+    """Modules among the given ones imported by a statement, run in a new interpreter"""
+
+    code = f"import sys; {statement}; print(' '.join([m for m in {modules!r} if m in sys.modules]))"
+    return subprocess.run([sys.executable, "-c", code], stdout=subprocess.PIPE, universal_newlines=True,
+                          check=True).stdout.split()
+
+
+@pytest.fixture
+def fake_cluster(tmp_path, monkeypatch):
+    """
+    Factory of fake clusters, taking the FakeCluster arguments. The fake executables are put on the PATH, and the
+    job scripts and screens left over by the test are killed afterwards.
+    """
+
+    clusters = list()
+
+    def create(**kwargs) -> FakeCluster:
+        cluster = FakeCluster(root=tmp_path / f"cluster{len(clusters)}", **kwargs)
+        for variable, value in cluster.environ().items():
+            monkeypatch.setenv(variable, value)
+        clusters.append(cluster)
+        return cluster
+
+    yield create
+
+    for cluster in clusters:
+        cluster.shutdown()
+
+    if shutil.which("screen") is not None:
+        for cluster in clusters:
+            monkeypatch.setenv("SCREENDIR", str(cluster.screens))
+            for screen in Screen.list():
+                Screen.kill(screen.id)
+
+
+@pytest.fixture
+def shell_screens(monkeypatch):
+    """
+    Screens standing for local shells: attaching to nested screens opens a local shell (or keeps the terminal passed
+    in), and detaching closes it. The screens attached and the depths detached are recorded in order.
+    """
+
+    events = list()
+
+    def attach_nested(screens, terminal=None):
+        events.append(('attach', screens))
+        return Shell() if terminal is None else terminal
+
+    def detach_nested(terminal, depth=1, terminate=False):
+        events.append(('detach', depth))
+        terminal.close(force=True)
+
+    monkeypatch.setattr(Screen, 'attach_nested', attach_nested)
+    monkeypatch.setattr(Screen, 'detach_nested', detach_nested)
+    yield events
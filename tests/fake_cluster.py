@@ -0,0 +1,330 @@
+"""
+Stand-in cluster made of fake executables (ssh, bsub, srun, sbatch, bjobs, squeue, bkill, scancel, hostname,
+singularity, jupyter), to be put on the PATH in place of the real ones, with configurable latencies, queue waits and
+failure modes.
+
+The "remote" shells are local shells, and the nested screens are local screens, isolated in their own screen directory.
+"""
+
+import os
+import stat
+import signal
+from pathlib import Path
+from typing import Iterable
+
+token = "0123456789abcdef" * 3
+
+scripts = {
+    'ssh': '''
+control=""; master=""; binding=""
+while [ $# -gt 0 ]; do
+  case "$1" in
+    -O) control="$2"; shift 2;;
+    -L) binding="$2"; shift 2;;
+    -o) case "$2" in ControlMaster=*) master=1;; esac; shift 2;;
+    -*) shift;;
+    *) break;;
+  esac
+done
+host="$1"
+shift
+
+# Control commands on the simulated control master connection
+if [ -n "$control" ]; then
+  case "$control" in
+    check) [ -f "$STATE/master.$host" ];;
+    cancel) [ -f "$STATE/master.$host" ] || exit 1
+      grep -vxF -- "$binding" "$STATE/forwards" > "$STATE/forwards.tmp" 2>/dev/null
+      mv "$STATE/forwards.tmp" "$STATE/forwards";;
+    forward) [ -f "$STATE/master.$host" ] && echo "$binding" >> "$STATE/forwards";;
+    exit) [ -f "$STATE/master.$host" ] && rm -f "$STATE/master.$host";;
+  esac
+  exit $?
+fi
+
+# Remote commands run in the home folder of the simulated cluster, through the control master connection only
+export HOME="$STATE/home"
+cd "$HOME"
+if [ $# -gt 0 ]; then
+  if [ ! -f "$STATE/master.$host" ]; then
+    echo "Permission denied (keyboard-interactive)."
+    exit 255
+  fi
+  sleep {latency}
+  exec sh -c "$*"
+fi
+
+# Login shell on the simulated cluster
+sleep {login_delay}
+if [ -n "{fail_ssh}" ]; then
+  echo "ssh: connect to host fake-cluster port 22: Connection refused"
+  exit 255
+fi
+[ -n "$master" ] && touch "$STATE/master.$host"
+echo "Welcome to the fake cluster"
+exec sh -i
+''',
+    'fake-submit': '''
+# Usage: fake-submit JOB OUTPUT SCRIPT VARIABLE, running a job script in the background once it leaves the queue
+setsid sh -c 'sleep "$1"; touch "$2/jobs/$3"; export "$4=$3"; exec bash "$5"' fake-job {queue_wait} "$STATE" "$1" \\
+  "$4" "$3" > "$2" 2>&1 < /dev/null &
+echo $! > "$STATE/pids/$1"
+''',
+    'sbatch': '''
+sleep {latency}
+if [ -n "{fail_sbatch}" ]; then
+  echo "sbatch: error: Batch job submission failed: Invalid partition name specified"
+  exit 1
+fi
+output=$(sed -n 's/^#SBATCH --output=//p' "$1")
+array=$(sed -n 's/^#SBATCH --array=1-//p' "$1")
+if [ -n "$array" ]; then
+  for index in $(seq 1 "$array"); do
+    SLURM_ARRAY_TASK_ID=$index fake-submit "$$_$index" "$(echo "$output" | sed "s/%A/$$/; s/%a/$index/")" "$1" \\
+      SLURM_JOB_ID
+  done
+else
+  fake-submit "$$" "$(echo "${{output:-slurm-%j.out}}" | sed "s/%j/$$/")" "$1" SLURM_JOB_ID
+fi
+echo "Submitted batch job $$"
+''',
+    'bsub': '''
+sleep {latency}
+if [ -n "{fail_bsub}" ]; then
+  echo "Request aborted by esub. Job not submitted."
+  exit 1
+fi
+
+# Job script read from the standard input
+if [ "$1" != "-Is" ]; then
+  script="$STATE/scripts/$$.sh"
+  cat > "$script"
+  output=$(sed -n 's/^#BSUB -o //p' "$script" | sed "s/%J/$$/")
+  array=$(sed -n 's/^#BSUB -J ".*\\[1-\\([0-9]*\\)\\]"$/\\1/p' "$script")
+  if [ -n "$array" ]; then
+    for index in $(seq 1 "$array"); do
+      LSB_JOBINDEX=$index fake-submit "$$[$index]" "$(echo "$output" | sed "s/%I/$index/")" "$script" LSB_JOBID
+    done
+  else
+    fake-submit "$$" "${{output:-$$.out}}" "$script" LSB_JOBID
+  fi
+  echo "Job <$$> is submitted to queue <normal.4h>."
+  exit 0
+fi
+
+# Interactive batch job
+echo "Job <$$> is submitted to queue <normal.4h>."
+echo "<<Waiting for dispatch ...>>"
+sleep {queue_wait}
+touch "$STATE/jobs/$$"
+echo "<<Starting on fake-node>>"
+LSB_JOBID=$$ exec sh -i
+''',
+    'scancel': '''
+for job in "$@"; do
+  for pid_file in "$STATE/pids/$job" "$STATE/pids/$job"_* "$STATE/pids/$job"[[]*; do
+    [ -f "$pid_file" ] && kill -- -"$(cat "$pid_file")" 2>/dev/null
+    rm -f "$pid_file" "$STATE/jobs/${{pid_file##*/}}"
+  done
+done
+exit 0
+''',
+    'bkill': '''
+for job in "$@"; do
+  for pid_file in "$STATE/pids/$job" "$STATE/pids/$job"_* "$STATE/pids/$job"[[]*; do
+    [ -f "$pid_file" ] && kill -- -"$(cat "$pid_file")" 2>/dev/null
+    rm -f "$pid_file" "$STATE/jobs/${{pid_file##*/}}"
+  done
+  echo "Job <$job> is being terminated"
+done
+exit 0
+''',
+    'srun': '''
+sleep {latency}
+if [ -n "{fail_srun}" ]; then
+  echo "srun: error: Unable to allocate resources: Invalid partition name specified"
+  exit 1
+fi
+if [ -n "{queued}" ]; then
+  echo "srun: job $$ queued and waiting for resources"
+  sleep {queue_wait}
+  echo "srun: job $$ has been allocated resources"
+fi
+touch "$STATE/jobs/$$"
+while [ $# -gt 0 ] && [ "$1" != "--pty" ]; do shift; done
+shift
+SLURM_JOB_ID=$$ exec "$@"
+''',
+    'bjobs': '''
+sleep {latency}
+for job in "$@"; do
+  case "$job" in
+    *[!0-9]*) ;;
+    *) for task in "$STATE/jobs/$job" "$STATE/jobs/$job"[[]*; do
+         index=0; case "$task" in *]) index="${{task##*/$job[}}"; index="${{index%]}}";; esac
+         [ -f "$task" ] && echo "$job|$index|RUN|59:00 L|fake-node|1|0 Mbytes"
+       done;;
+  esac
+done
+exit 0
+''',
+    'squeue': '''
+sleep {latency}
+while [ $# -gt 0 ] && [ "$1" != "--jobs" ]; do shift; done
+for job in $(echo "$2" | tr ',' ' '); do
+  for task in "$STATE/jobs/$job" "$STATE/jobs/$job"_*; do
+    [ -f "$task" ] && echo "${{task##*/}}|RUNNING|59:00|fake-node|1|10G"
+  done
+done
+exit 0
+''',
+    'hostname': '''
+if [ "$1" = "-i" ]; then echo "127.0.0.1"; else echo "fake-node"; fi
+''',
+    'singularity': '''
+action="$1"; shift
+while [ $# -gt 0 ]; do
+  case "$1" in
+    -H|-B) shift 2;;
+    -*) shift;;
+    *) break;;
+  esac
+done
+image="$1"
+shift
+sleep {singularity_startup}
+if [ -n "{fail_singularity}" ]; then
+  echo "FATAL:   could not open image: failed to retrieve path"
+  exit 255
+fi
+if [ "$action" = "exec" ]; then
+  exec "$@"
+fi
+SINGULARITY_CONTAINER="$image" PS1="Singularity> " exec sh -i
+''',
+    'jupyter': '''
+flavor="$1"; ip="127.0.0.1"; port="8888"
+while [ $# -gt 0 ]; do
+  case "$1" in
+    --ip=*) ip="${{1#--ip=}}";;
+    --port) port="$2"; shift;;
+  esac
+  shift
+done
+sleep {jupyter_startup}
+if [ -n "{fail_jupyter}" ]; then
+  echo "Traceback (most recent call last):"
+  echo "OSError: [Errno 99] Cannot assign requested address"
+  exit 1
+fi
+path="/"; [ "$flavor" = "lab" ] && path="/lab"
+echo "[I 10:00:00.000 ServerApp] Jupyter Server is running at:"
+echo "[I 10:00:00.000 ServerApp] http://$ip:$port$path?token={token}"
+exec sleep 86400
+''',
+    'open': '''
+exit 0
+''',
+}
+
+
+def benchmark_configs(cluster_id: str, n_jobs: int, concurrency: int, backend: str = 'interactive') -> dict:
+    """
+    Configuration launching n_jobs jupyter servers inside singularity containers on the fake cluster, each with its
+    tunnel
+    """
+
+    batch_jobs = [f"job{idx}" for idx in range(n_jobs)]
+    return {
+        'cluster': {
+            'id': cluster_id,
+            'host': 'fake-cluster',
+            'concurrency': concurrency,
+            'batch_jobs': batch_jobs,
+            'tunnels': [f"{8100 + idx}:{batch_job}:{8100 + idx}" for idx, batch_job in enumerate(batch_jobs)],
+        },
+        'batch_jobs': {
+            batch_job: {
+                'duration': 1,
+                'cpu': 1,
+                'memory': 1,
+                'max_wait': 60,
+                'backend': backend,
+                'env': ['PROJECT_DIR=/tmp'],
+                'run': ['SINGULARITY', 'cd $PROJECT_DIR', 'JUPYTER'],
+                'singularity': {'image': '$PROJECT_DIR/image.img', 'bindings': ['$PROJECT_DIR:/opt/project']},
+                'jupyter': {'port': 8100 + idx, 'flavor': 'lab'},
+            } for idx, batch_job in enumerate(batch_jobs)
+        },
+    }
+
+
+class FakeCluster:
+    """
+    Fake cluster executables written to a folder, with the simulated latencies (in seconds) and the commands that fail
+
+    Args:
+        root (Path): folder where the executables (bin) and the simulated cluster state (state) are stored
+        latency (float): delay of every scheduler command
+        login_delay (float): delay of the SSH login
+        queue_wait (float): time batch jobs wait in the queue before starting
+        singularity_startup (float): startup time of singularity containers
+        jupyter_startup (float): startup time of jupyter servers
+        failures (iterable): names of the commands that fail (ssh, bsub, srun, sbatch, singularity, jupyter)
+    """
+
+    def __init__(self, root: Path, latency: float = 0.0, login_delay: float = 0.0, queue_wait: float = 0.0,
+                 singularity_startup: float = 0.0, jupyter_startup: float = 0.0, failures: Iterable[str] = ()):
+        self.root = Path(root)
+        self.bin = self.root / "bin"
+        self.state = self.root / "state"
+        self.screens = self.root / "screens"
+
+        for folder in [self.bin, self.state / "jobs", self.state / "pids", self.state / "scripts", self.state / "home",
+                       self.screens]:
+            folder.mkdir(parents=True, exist_ok=True)
+        self.screens.chmod(0o700)
+
+        values = {'latency': latency, 'login_delay': login_delay, 'queue_wait': queue_wait,
+                  'singularity_startup': singularity_startup, 'jupyter_startup': jupyter_startup,
+                  'queued': "1" if queue_wait > 0 else "", 'token': token}
+        values.update({f"fail_{command}": "1" if command in failures else ""
+                       for command in ['ssh', 'bsub', 'srun', 'sbatch', 'singularity', 'jupyter']})
+
+        for command, script in scripts.items():
+            path = self.bin / command
+            path.write_text(f"#!/bin/sh\n# Fake {command}\nSTATE=\"{self.state}\"\n" + script.format(**values))
+            path.chmod(path.stat().st_mode | stat.S_IXUSR | stat.S_IXGRP | stat.S_IXOTH)
+
+    def login(self, ssh_alias: str = "fake-cluster") -> None:
+        """Simulate a login having opened the control master connection to an SSH host"""
+
+        (self.state / f"master.{ssh_alias}").touch()
+
+    def shutdown(self) -> None:
+        """Terminate the submitted job scripts still running"""
+
+        for pid_file in (self.state / "pids").iterdir():
+            try:
+                os.killpg(int(pid_file.read_text()), signal.SIGTERM)
+            except (ProcessLookupError, PermissionError, ValueError):
+                pass
+            pid_file.unlink()
+
+    def environ(self) -> dict:
+        """Environment variables putting the fake executables first on the PATH and isolating the screens"""
+
+        return {'PATH': f"{self.bin}{os.pathsep}{os.environ.get('PATH', '')}", 'SCREENDIR': str(self.screens)}
+
+    @property
+    def forwards(self) -> list:
+        """Port bindings forwarded through the simulated control master connection"""
+
+        forwards = self.state / "forwards"
+        return forwards.read_text().split() if forwards.exists() else list()
+
+    @property
+    def jobs(self) -> list:
+        """Identifiers of the batch jobs started on the fake cluster"""
+
+        return sorted([job.name for job in (self.state / "jobs").iterdir()])
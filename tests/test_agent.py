@@ -0,0 +1,104 @@
+"""
+Tests of the local agent serving the actions of the command line over a Unix domain socket
+"""
+
+import tempfile
+import threading
+from pathlib import Path
+
+import pytest
+import yaml
+
+from clusty import agent
+from clusty.clusters.client import ClusterClient
+from clusty.configs.state import SessionState
+from clusty.terminal.screen import ScreenSession
+from clusty.terminal.shell import Shell
+from tests.fake_cluster import benchmark_configs
+
+
+@pytest.fixture
+def running_agent():
+    """Agent serving in a thread, on a socket in a short temporary path (socket paths are limited to ~100 bytes)"""
+
+    with tempfile.TemporaryDirectory() as folder:
+        server = agent.Agent(path=Path(folder) / "agent.sock")
+        thread = threading.Thread(target=server.serve_forever)
+        thread.start()
+        yield server
+        server.shutdown()
+        server.server_close()
+        thread.join()
+
+
+def test_agent(running_agent, tmp_path, capsys):
+    config_file = tmp_path / "config.yaml"
+    config_file.write_text(yaml.dump(benchmark_configs(cluster_id='leomed2', n_jobs=1, concurrency=1)))
+
+    assert agent.available(running_agent.path)
+    assert not agent.available(tmp_path / "missing.sock")
+    with pytest.raises(RuntimeError):
+        agent.Agent(path=running_agent.path)
+
+    assert agent.request('status', config_file, path=running_agent.path) == 0
+    assert capsys.readouterr().out == f"No session recorded in {tmp_path / '.clusty' / 'config.state.json'}.\n"
+    client = running_agent.client(config_file)
+
+    # The client is kept until the configuration file changes
+    assert agent.request('run', config_file, batch_job='job0', command='hostname', path=running_agent.path) == 1
+    assert "No session recorded" in capsys.readouterr().err
+    assert running_agent.client(config_file) is client
+
+    config_file.write_text(config_file.read_text() + "\n")
+    assert running_agent.client(config_file) is not client
+
+    assert agent.request('attach', config_file, path=running_agent.path) == 1
+    assert agent.request('status', tmp_path / "missing.yaml", path=running_agent.path) == 1
+    assert "FileNotFoundError" in capsys.readouterr().err
+
+
+def test_logged_in(fake_cluster, tmp_path):
+    # Start is sent to the agent only once the connections are open, since it would prompt for credentials otherwise
+    config_file = tmp_path / "config.yaml"
+    configs = benchmark_configs(cluster_id='leomed2', n_jobs=1, concurrency=1)
+    config_file.write_text(yaml.dump(configs))
+
+    fake_cluster()
+    assert not agent.logged_in(config_file)
+    fake_cluster().login()
+    assert agent.logged_in(config_file)
+
+    config_file.write_text(yaml.dump({**configs, 'cluster': {**configs['cluster'], 'setup': True}}))
+    assert not agent.logged_in(config_file)
+
+
+def test_run_then_status(running_agent, tmp_path, capsys, monkeypatch):
+    # The screens held attached by run are released before status attaches to the cluster screen
+    events = list()
+
+    def attach(session):
+        events.append('attach')
+        session.terminal = Shell()
+        return session.terminal
+
+    def detach(session):
+        if session.attached:
+            events.append('detach')
+            session.terminal.close(force=True)
+            session.terminal = None
+
+    monkeypatch.setattr(ScreenSession, 'attach', attach)
+    monkeypatch.setattr(ScreenSession, 'detach', detach)
+    monkeypatch.setattr(ClusterClient, 'status', lambda self: events.append('status'))
+
+    config_file = tmp_path / "config.yaml"
+    config_file.write_text(yaml.dump(benchmark_configs(cluster_id='leomed2', n_jobs=1, concurrency=1)))
+    state = SessionState.for_config(config_file)
+    state.set_cluster(cluster_id='leomed2', screen='leomed2', ssh_alias='fake-cluster')
+    state.update_batch_job('job0', screen='job0')
+
+    assert agent.request('run', config_file, batch_job='job0', command='echo hi', path=running_agent.path) == 0
+    assert agent.request('run', config_file, batch_job='job0', command='echo again', path=running_agent.path) == 0
+    assert capsys.readouterr().out == "hi\nagain\n"
+    assert agent.request('status', config_file, path=running_agent.path) == 0
+    assert events == ['attach', 'detach', 'status']
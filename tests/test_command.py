@@ -0,0 +1,30 @@
+"""
+Tests of the command execution with sentinel markers, run in a local shell
+"""
+
+from clusty.terminal.command import run_command, run_script
+from clusty.terminal.shell import Shell
+
+
+def test_run_command():
+    terminal = Shell()
+    result = run_command(terminal, "echo hello; false", timeout=10)
+
+    assert result.exit_code == 1
+    assert result.output == "hello"
+    terminal.close(force=True)
+
+
+def test_run_script():
+    terminal = Shell()
+    commands = ["export GREETING=hello", "cd /", "echo $GREETING; pwd", "ls /nonexistent", "echo done"]
+    result = run_script(terminal, commands, timeout=10)
+
+    assert not result.success
+    assert result.exit_codes == [0, 0, 0, 2, 0]
+    assert result.outputs[2] == "hello\n/"
+    assert result.outputs[4] == "done"
+
+    # The script runs in the shell of the terminal, hence the environment and working directory persist
+    assert run_command(terminal, "echo $GREETING; pwd", timeout=10).output == "hello\n/"
+    terminal.close(force=True)
@@ -0,0 +1,41 @@
+"""
+Tests of the configuration files parsing, validation and caching
+"""
+
+import pytest
+import yaml
+
+from clusty.configs.parser import ConfigsParser
+from clusty.utils import validation
+from tests.conftest import imported_modules
+from tests.fake_cluster import benchmark_configs
+
+
+def test_lazy_imports():
+    assert imported_modules("import clusty.launch_assistant", ['yaml', 'cerberus', 'pexpect']) == []
+    assert imported_modules("import clusty.clusters.client", ['yaml', 'cerberus']) == []
+
+
+def test_cached_configs(tmp_path, monkeypatch):
+    config_file = tmp_path / "config.yaml"
+    config_file.write_text(yaml.dump(benchmark_configs(cluster_id='leomed2', n_jobs=2, concurrency=1)))
+    parser = ConfigsParser.from_file(config_file)
+    assert (tmp_path / ".clusty" / "config.configs.json").exists()
+
+    def validate_schema(*args, **kwargs):
+        raise AssertionError("Unchanged configuration validated again")
+
+    monkeypatch.setattr("clusty.configs.parser.validate_schema", validate_schema)
+    cached_parser = ConfigsParser.from_file(config_file)
+    assert cached_parser.get_cluster_config() == parser.get_cluster_config()
+    assert cached_parser.get_batch_job_specs('job1') == parser.get_batch_job_specs('job1')
+
+    config_file.write_text(config_file.read_text().replace("leomed2", "leomed1"))
+    with pytest.raises(AssertionError):
+        ConfigsParser.from_file(config_file)
+
+
+def test_cached_validator():
+    schema = ConfigsParser.config_schema()
+    assert schema is ConfigsParser.config_schema()
+    assert validation._validator(schema, False, True) is validation._validator(schema, False, True)
@@ -0,0 +1,199 @@
+"""
+Tests of the scheduler and jupyter output parsing against the fake cluster, run in a local shell
+"""
+
+import time
+
+import pexpect
+import pytest
+
+from clusty.clusters import LeoMed1, LeoMed2
+from clusty.clusters.cluster import Allocation, Cluster
+from clusty.configs.parser import ConfigsParser
+from clusty.terminal.command import run_command
+from clusty.terminal.shell import Shell
+from clusty.utils.polling import wait_until
+from tests.fake_cluster import token
+
+
+def test_lsf_allocation(fake_cluster):
+    fake_cluster(queue_wait=0.5)
+    cluster = LeoMed1()
+    terminal = Shell()
+    terminal.sendline(cluster.batch_command(duration=1, cpu=1, memory=1, gpu=0, gpu_model=None))
+    allocation = cluster.wait_allocation(terminal, Allocation(screen="batch"), timeout=10)
+
+    assert allocation.started
+    assert allocation.node == "fake-node"
+    assert allocation.job_id is not None
+
+    result = run_command(terminal, cluster.status_command([allocation.job_id]), timeout=10)
+    assert result.output.startswith(f"{allocation.job_id}|0|RUN|")
+    assert cluster.parse_status(result.output, [allocation.job_id])[allocation.job_id].state == "RUN"
+    terminal.close(force=True)
+
+
+def test_slurm_allocation(fake_cluster):
+    for queue_wait in [0, 0.5]:
+        fake_cluster(queue_wait=queue_wait)
+        cluster = LeoMed2()
+        terminal = Shell()
+        terminal.sendline(cluster.batch_command(duration=1, cpu=1, memory=1, gpu=0, gpu_model=None))
+        allocation = cluster.wait_allocation(terminal, Allocation(screen="batch"), timeout=10)
+
+        assert allocation.started
+        assert allocation.node == "fake-node"
+
+        result = run_command(terminal, cluster.status_command([allocation.job_id]), timeout=10)
+        assert result.output.startswith(f"{allocation.job_id}|RUNNING|")
+        terminal.close(force=True)
+
+
+def test_failed_allocation(fake_cluster):
+    for cluster, failure in [(LeoMed1(), 'bsub'), (LeoMed2(), 'srun')]:
+        fake_cluster(failures=[failure])
+        terminal = Shell()
+        terminal.sendline(cluster.batch_command(duration=1, cpu=1, memory=1, gpu=0, gpu_model=None))
+        allocation = cluster.wait_allocation(terminal, Allocation(screen="batch"), timeout=10)
+
+        assert allocation.failed
+        terminal.close(force=True)
+
+
+def test_jupyter_output(fake_cluster):
+    fake_cluster(jupyter_startup=0.2)
+    terminal = Shell()
+    terminal.sendline("jupyter lab --no-browser --ip=$(hostname -i) --port 8102")
+    terminal.expect(Cluster.jupyter_url_pattern.pattern.encode(), timeout=10)
+
+    protocol, address, port, path, url_token = [group.decode() for group in terminal.match.groups()]
+    assert (address, port, path, url_token) == ("127.0.0.1", "8102", "/lab", token)
+    terminal.close(force=True)
+
+    fake_cluster(failures=['jupyter'])
+    terminal = Shell()
+    terminal.sendline("jupyter notebook --no-browser --ip=$(hostname -i) --port 8102")
+    response = terminal.expect([Cluster.jupyter_url_pattern.pattern.encode(),
+                                Cluster.jupyter_failure_pattern.pattern.encode(), pexpect.EOF], timeout=10)
+    assert response == 1
+    terminal.close(force=True)
+
+
+def test_launch_singularity(fake_cluster, shell_screens):
+    # The launch returns as soon as the container shell runs, and fails if the container does not start
+    fake_cluster(singularity_startup=0.5)
+    cluster = LeoMed2()
+    start = time.monotonic()
+    cluster.launch_singularity(screens=['leomed2', 'job0'], image='image.img', bindings=['/tmp:/opt/project'])
+    assert time.monotonic() - start < 5
+
+    fake_cluster(failures=['singularity'])
+    with pytest.raises(RuntimeError):
+        cluster.launch_singularity(screens=['leomed2', 'job0'], image='image.img')
+    assert [event for event, _ in shell_screens] == ['attach', 'detach'] * 2
+
+
+def test_job_script(fake_cluster, monkeypatch):
+    monkeypatch.setattr(Cluster, 'job_poll_period', 0.2)
+    jupyter = {'port': 8102, 'flavor': 'lab'}
+    singularity = {'image': 'image.img', 'home_dir': '$HOME', 'bindings': ['/tmp:/opt/project'], 'gpu': False}
+
+    for cluster in [LeoMed1(), LeoMed2()]:
+        fake = fake_cluster(queue_wait=0.5, jupyter_startup=0.2)
+        fake.login()
+        script = cluster.job_script(name="notebook", commands=['SINGULARITY', 'cd /opt', 'JUPYTER'],
+                                    env=['export PROJECT_DIR=/tmp'], singularity=singularity, jupyter=jupyter)
+        allocation = cluster.submit(ssh_alias="fake-cluster", name="notebook", script=script)
+        allocation, ip_address, links, port = cluster.wait_job(ssh_alias="fake-cluster", name="notebook",
+                                                               allocation=allocation, max_wait=10, jupyter_timeout=10)
+
+        assert allocation.started
+        assert (allocation.node, ip_address) == ("fake-node", "127.0.0.1")
+        assert links == [f"http://127.0.0.1:8102/lab?token={token}"]
+        assert port == 8102
+        assert fake.jobs == [allocation.job_id]
+
+        assert cluster.cancel(ssh_alias="fake-cluster", job_ids=[allocation.job_id])
+        assert fake.jobs == []
+
+
+def test_failed_job_script(fake_cluster, monkeypatch):
+    monkeypatch.setattr(Cluster, 'job_poll_period', 0.2)
+    fake = fake_cluster(failures=['jupyter'])
+    fake.login()
+    cluster = LeoMed2()
+    script = cluster.job_script(name="notebook", commands=['JUPYTER'], jupyter={'port': 8102, 'flavor': 'notebook'})
+    allocation = cluster.submit(ssh_alias="fake-cluster", name="notebook", script=script)
+
+    with pytest.raises(RuntimeError):
+        cluster.wait_job(ssh_alias="fake-cluster", name="notebook", allocation=allocation, max_wait=10,
+                         jupyter_timeout=10)
+
+    fake_cluster(failures=['sbatch']).login()
+    with pytest.raises(RuntimeError):
+        cluster.submit(ssh_alias="fake-cluster", name="notebook", script=script)
+
+
+def test_commands_before_jupyter(fake_cluster, monkeypatch):
+    # Failures printed by the commands preceding the jupyter server are left to the exit status of the job
+    monkeypatch.setattr(Cluster, 'job_poll_period', 0.2)
+    fake_cluster(jupyter_startup=0.2).login()
+    cluster = LeoMed2()
+    script = cluster.job_script(name="notebook", commands=['nvidia-smi || true', 'JUPYTER'],
+                                jupyter={'port': 8102, 'flavor': 'notebook'})
+    allocation = cluster.submit(ssh_alias="fake-cluster", name="notebook", script=script)
+    allocation, ip_address, links, port = cluster.wait_job(ssh_alias="fake-cluster", name="notebook",
+                                                           allocation=allocation, max_wait=10, jupyter_timeout=10)
+    assert links == [f"http://127.0.0.1:8102/?token={token}"]
+
+    assert Cluster.jupyter_failure_pattern.search("[I 10:00:00 NotebookApp] Serving\n[C 10:00:01 NotebookApp] Bad")
+    assert not Cluster.jupyter_failure_pattern.search("[I 10:00:00 NotebookApp] [C ")
+
+
+def test_sweep(fake_cluster):
+    configs = ConfigsParser({
+        'cluster': {'id': 'leomed2', 'batch_jobs': ['train']},
+        'batch_jobs': {'train': {'backend': 'script', 'run': ['echo "seed $SEED lr $LR"'],
+                                 'sweep': {'grid': {'SEED': [1, 2], 'LR': [0.1, 0.01]}, 'list': [{'SEED': 3}]}}},
+    })
+    sweep = configs.get_batch_job_sweep('train')
+    assert len(sweep) == 5
+
+    for cluster in [LeoMed1(), LeoMed2()]:
+        fake = fake_cluster()
+        fake.login()
+        script = cluster.job_script(name="train", commands=configs.get_batch_job_commands('train'), sweep=sweep)
+        allocation = cluster.submit(ssh_alias="fake-cluster", name="train", script=script)
+
+        output_files = [fake.state / "home" / cluster.job_output_file("train", allocation.job_id, index)[2:]
+                        for index in range(1, len(sweep) + 1)]
+        assert wait_until(lambda: all([output_file.exists() and "EXITED" in output_file.read_text()
+                                       for output_file in output_files]))
+        assert [output_file.read_text().splitlines()[1] for output_file in output_files] == \
+            ["seed 1 lr 0.1", "seed 1 lr 0.01", "seed 2 lr 0.1", "seed 2 lr 0.01", "seed 3 lr "]
+
+        assert cluster.cancel(ssh_alias="fake-cluster", job_ids=[allocation.job_id])
+        assert fake.jobs == []
+
+
+def test_array_job_status(fake_cluster):
+    # The tasks of job arrays are listed by their own identifier, by LSF (jobid[index]) as by Slurm (jobid_index)
+    sweep = [{'SEED': str(seed)} for seed in range(1, 4)]
+    for cluster, task_id in [(LeoMed1(), "{}[{}]"), (LeoMed2(), "{}_{}")]:
+        fake = fake_cluster()
+        fake.login()
+        script = cluster.job_script(name="train", commands=['sleep 60'], sweep=sweep)
+        array = cluster.submit(ssh_alias="fake-cluster", name="train", script=script)
+        single = cluster.submit(ssh_alias="fake-cluster", name="single",
+                                script=cluster.job_script(name="single", commands=['sleep 60']))
+        assert wait_until(lambda: len(fake.jobs) == 4)
+
+        terminal = Shell()
+        result = run_command(terminal, cluster.status_command([array.job_id, single.job_id]), timeout=10)
+        statuses = cluster.parse_status(result.output, [array.job_id, single.job_id])
+        task_ids = [task_id.format(array.job_id, index) for index in range(1, 4)]
+        assert sorted(statuses) == sorted(task_ids + [single.job_id])
+        assert all([status.node == "fake-node" for status in statuses.values()])
+        terminal.close(force=True)
+
+        assert cluster.cancel(ssh_alias="fake-cluster", job_ids=[array.job_id, single.job_id])
@@ -0,0 +1,44 @@
+"""
+Benchmark of the command line startup: the import time of the modules, and the time to load a configuration file,
+validated or cached.
+
+The benchmarks are deselected by default, run them with: pytest -m benchmark
+"""
+
+import subprocess
+import sys
+import time
+
+import pytest
+import yaml
+
+from clusty.configs.parser import ConfigsParser
+from clusty.utils.string import format_table
+from tests.fake_cluster import benchmark_configs
+
+
+def import_time(module: str, repeat: int = 5) -> float:
+    """Best cumulative import time of a module in seconds, each time imported by a new interpreter"""
+
+    times = list()
+    for _ in range(repeat):
+        output = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                                stderr=subprocess.PIPE, universal_newlines=True, check=True).stderr
+        times.append(int(output.strip().splitlines()[-1].split('|')[1]) / 1e6)
+
+    return min(times)
+
+
+@pytest.mark.benchmark
+def test_startup(tmp_path):
+    rows = [[f"import {module}", f"{import_time(module) * 1000:.1f}"]
+            for module in ['clusty.launch_assistant', 'clusty.clusters.client', 'yaml', 'cerberus']]
+
+    config_file = tmp_path / "config.yaml"
+    config_file.write_text(yaml.dump(benchmark_configs(cluster_id='leomed2', n_jobs=20, concurrency=4)))
+    for label in ["load configuration (validated)", "load configuration (cached)"]:
+        start = time.perf_counter()
+        ConfigsParser.from_file(config_file)
+        rows.append([label, f"{(time.perf_counter() - start) * 1000:.1f}"])
+
+    print(format_table(['Step', 'Time (ms)'], rows))
@@ -0,0 +1,72 @@
+"""
+End-to-end benchmark of starting and stopping configurations of 1 to 20 batch jobs on the fake cluster, reporting the
+wall time of each phase of the launch, and failing when a phase exceeds its budget.
+
+The benchmarks are deselected by default, run them with: pytest -m benchmark
+"""
+
+import math
+from typing import Dict
+
+import pytest
+
+from clusty.clusters import LeoMed1, LeoMed2
+from clusty.clusters.client import ClusterClient
+from clusty.configs.state import SessionState
+from clusty.utils import timing
+from tests.conftest import requires_screen
+from tests.fake_cluster import benchmark_configs
+
+
+def phase_budgets(n_jobs: int, concurrency: int) -> Dict[str, float]:
+    """
+    Wall time budgets in seconds of the phases of a launch on the fake cluster of the benchmark, twice the times
+    measured for each step: the login, the allocation and provisioning of each wave of batch jobs launched
+    concurrently (allocation 1.2 s, then IP address, environment, singularity and jupyter: 2 to 4 s), and a tunnel to
+    forward and a batch job to stop per batch job
+    """
+
+    waves = math.ceil(n_jobs / concurrency)
+    return {
+        'client.login': 5.0,
+        'client.batch_jobs': 5.0 + 10.5 * waves,
+        'client.tunnels': 2.0 + 0.5 * n_jobs,
+        'client.stop': 5.0 + 0.5 * n_jobs,
+    }
+
+
+@pytest.mark.benchmark
+@requires_screen
+@pytest.mark.parametrize('cluster_class', [LeoMed1, LeoMed2])
+@pytest.mark.parametrize('n_jobs, concurrency', [(1, 1), (5, 1), (5, 5), (20, 4)])
+@pytest.mark.parametrize('backend', ['interactive', 'script'])
+def test_launch(fake_cluster, monkeypatch, tmp_path, cluster_class, n_jobs, concurrency, backend):
+    cluster = fake_cluster(latency=0.1, login_delay=0.5, queue_wait=1, singularity_startup=0.5, jupyter_startup=1)
+    monkeypatch.setattr(cluster_class, 'job_poll_period', 0.5)
+    timing.enable()
+
+    configs = benchmark_configs(cluster_id=cluster_class.__name__.lower(), n_jobs=n_jobs, concurrency=concurrency,
+                                backend=backend)
+    state = SessionState(path=tmp_path / "benchmark.state.json")
+
+    ClusterClient(configs, state=state).start()
+
+    assert len(cluster.jobs) == n_jobs
+    assert len(cluster.forwards) == n_jobs
+    assert all('urls' in batch_job for batch_job in state.batch_jobs.values())
+
+    ClusterClient(configs, state=state).stop()
+    assert not state.path.exists()
+
+    timing.write_trace(tmp_path / "trace.json")
+    print(f"{cluster_class.__name__}: {n_jobs} {backend} batch jobs, concurrency {concurrency}")
+    print(timing.timings_table())
+
+    durations = dict()
+    for recorded_span in timing.spans():
+        durations[recorded_span.name] = durations.get(recorded_span.name, 0.0) + recorded_span.duration
+    timing.enable(False)
+
+    over_budget = {phase: f"{durations[phase]:.2f} s > {budget:.2f} s"
+                   for phase, budget in phase_budgets(n_jobs, concurrency).items() if durations[phase] > budget}
+    assert not over_budget, f"Phases over budget: {over_budget}"
@@ -0,0 +1,104 @@
+"""
+Tests of the incremental reading of log files, locally and through the SSH connection to the fake cluster
+"""
+
+import io
+import time
+
+from clusty.clusters.client import ClusterClient
+from clusty.configs.state import SessionState
+from clusty.terminal.log import LogTail
+from clusty.terminal.screen import Screen
+from tests.fake_cluster import benchmark_configs
+
+
+def test_local_log_tail(tmp_path):
+    log_file = tmp_path / "screen.log"
+    log_tail = LogTail(str(log_file))
+    assert log_tail.read() == ""
+
+    # Lines are returned once terminated, and characters once their bytes are all written
+    log_file.write_bytes(b"first\r\nsec")
+    assert log_tail.lines() == ["first"]
+    character = "é".encode()
+    with open(log_file, 'ab') as file:
+        file.write(b"ond " + character[:1])
+    assert log_tail.lines() == []
+    with open(log_file, 'ab') as file:
+        file.write(character[1:] + b"\n")
+    assert log_tail.lines() == ["second é"]
+    assert log_tail.offset == log_file.stat().st_size
+
+    # A truncated file is read from the start
+    log_file.write_bytes(b"new\n")
+    assert log_tail.read() == "new\n"
+
+    stream = io.StringIO()
+    log_tail.follow(period=0.01, stream=stream, until=time.monotonic() + 0.1)
+    assert stream.getvalue() == ""
+
+
+def test_remote_log_tail(fake_cluster, tmp_path):
+    fake_cluster().login()
+    log_file = tmp_path / "job.out"
+    log_file.write_text("CLUSTY_STARTED 1 fake-node 127.0.0.1\n")
+
+    log_tail = LogTail(str(log_file), ssh_alias="fake-cluster")
+    assert log_tail.lines() == ["CLUSTY_STARTED 1 fake-node 127.0.0.1"]
+    with open(log_file, 'a') as file:
+        file.write("CLUSTY_EXITED 0\n")
+    assert log_tail.lines() == ["CLUSTY_EXITED 0"]
+    assert LogTail(str(tmp_path / "missing.out"), ssh_alias="fake-cluster").read() == ""
+
+
+def test_logs(fake_cluster, tmp_path, monkeypatch, capsys):
+    fake_cluster().login()
+    monkeypatch.setattr(Screen, 'log_folder', str(tmp_path / "logs"))
+    (tmp_path / "logs").mkdir()
+    (tmp_path / "logs" / "leomed2.log").write_text("Welcome\n")
+    (tmp_path / "logs" / "job0.log").write_text("jupyter lab\n")
+    (tmp_path / "job1.out").write_text("CLUSTY_STARTED 1 fake-node 127.0.0.1\n")
+
+    state = SessionState(path=tmp_path / "config.state.json")
+    state.set_cluster(cluster_id='leomed2', screen='leomed2', ssh_alias='fake-cluster')
+    state.update_batch_job('job0', screen='job0', job_id='1')
+    state.update_batch_job('job1', screen=None, job_id='2', output_file=str(tmp_path / "job1.out"))
+    client = ClusterClient(benchmark_configs(cluster_id='leomed2', n_jobs=2, concurrency=1), state=state)
+
+    client.logs()
+    client.logs('job0')
+    client.logs('job1')
+    assert capsys.readouterr().out == "Welcome\njupyter lab\nCLUSTY_STARTED 1 fake-node 127.0.0.1\n"
+
+
+def test_array_logs(fake_cluster, tmp_path, monkeypatch, capsys):
+    # The output file of each task is read from its own offset, its lines prefixed by the task index
+    fake_cluster().login()
+    output_files = [tmp_path / f"train.7.{index}.out" for index in range(1, 3)]
+    output_files[0].write_text("seed 1\n")
+    output_files[1].write_text("seed 2\nlr 0.1\n")
+
+    state = SessionState(path=tmp_path / "config.state.json")
+    state.set_cluster(cluster_id='leomed2', screen='leomed2', ssh_alias='fake-cluster')
+    state.update_batch_job('job0', screen=None, job_id='7', sweep=[{'SEED': '1'}, {'SEED': '2'}],
+                           output_file=str(tmp_path / "train.7.*.out"),
+                           output_files=[str(output_file) for output_file in output_files])
+    client = ClusterClient(benchmark_configs(cluster_id='leomed2', n_jobs=1, concurrency=1), state=state)
+
+    client.logs('job0')
+    assert capsys.readouterr().out == "[1] seed 1\n[2] seed 2\n[2] lr 0.1\n"
+
+    # Following prints the output, until interrupted while waiting for more
+    with open(output_files[1], 'a') as file:
+        file.write("EXITED\n")
+    sleep = time.sleep
+
+    def interrupt_follow(seconds):
+        if seconds == LogTail.follow_period:
+            raise KeyboardInterrupt
+        sleep(seconds)
+
+    monkeypatch.setattr(LogTail, 'follow_period', 0.123)
+    monkeypatch.setattr(time, 'sleep', interrupt_follow)
+    client.logs('job0', follow=True)
+    assert capsys.readouterr().out == "[1] seed 1\n[2] seed 2\n[2] lr 0.1\n[2] EXITED\n"
@@ -0,0 +1,66 @@
+"""
+Tests of the configuration files launching batch jobs on several clusters concurrently
+"""
+
+import pytest
+
+from clusty.clusters.client import ClusterClient
+from clusty.configs.parser import ConfigsParser
+from clusty.configs.state import SessionState
+from clusty.utils.validation import ValidationError
+from tests.conftest import requires_screen
+from tests.fake_cluster import benchmark_configs
+
+
+def multi_cluster_configs(n_jobs: int) -> dict:
+    """Configuration launching n_jobs jupyter servers on each of the two clusters, on distinct ports"""
+
+    leomed1 = benchmark_configs(cluster_id='leomed1', n_jobs=n_jobs, concurrency=n_jobs)
+    leomed2 = benchmark_configs(cluster_id='leomed2', n_jobs=2 * n_jobs, concurrency=n_jobs)
+    leomed2['cluster']['batch_jobs'] = leomed2['cluster']['batch_jobs'][n_jobs:]
+    leomed2['cluster']['tunnels'] = leomed2['cluster']['tunnels'][n_jobs:]
+    leomed2['cluster']['host'] = 'fake-cluster2'
+
+    return {'clusters': [leomed1['cluster'], leomed2['cluster']], 'batch_jobs': leomed2['batch_jobs']}
+
+
+def test_clusters_configs(tmp_path):
+    configs = multi_cluster_configs(n_jobs=2)
+    clusters_configs = ConfigsParser(configs).get_clusters_configs()
+
+    assert [cluster_configs.get_cluster_config()[:3] for cluster_configs in clusters_configs] == \
+        [('leomed1', 'fake-cluster', ['job0', 'job1']), ('leomed2', 'fake-cluster2', ['job2', 'job3'])]
+    assert ConfigsParser(benchmark_configs(cluster_id='leomed1', n_jobs=1, concurrency=1)).get_clusters_configs() == []
+
+    state = SessionState(path=tmp_path / "multi.state.json")
+    assert state.for_cluster('leomed2').path == tmp_path / "multi.state.leomed2.json"
+
+    client = ClusterClient(configs, state=state)
+    for target in [None, 'job4', 'leomed3:job0']:
+        with pytest.raises(ValueError):
+            client.attach(batch_job=target)
+
+    with pytest.raises(ValueError):
+        ConfigsParser({**configs, 'clusters': configs['clusters'][:1] * 2}).get_clusters_configs()
+    with pytest.raises(ValidationError):
+        ConfigsParser({**configs, 'cluster': configs['clusters'][0]})
+
+
+@requires_screen
+def test_multi_cluster_launch(fake_cluster, tmp_path):
+    cluster = fake_cluster(latency=0.1, login_delay=0.5, queue_wait=0.5, jupyter_startup=0.5)
+    configs = multi_cluster_configs(n_jobs=2)
+    state = SessionState(path=tmp_path / "multi.state.json")
+
+    ClusterClient(configs, state=state).start()
+
+    assert len(cluster.jobs) == 4
+    assert len(cluster.forwards) == 4
+    for cluster_id, batch_jobs in [('leomed1', ['job0', 'job1']), ('leomed2', ['job2', 'job3'])]:
+        cluster_state = state.for_cluster(cluster_id)
+        assert cluster_state.load()
+        assert sorted(cluster_state.batch_jobs.keys()) == batch_jobs
+
+    ClusterClient(configs, state=state).stop()
+    assert cluster.jobs == []
+    assert not list(tmp_path.glob("multi.state.*"))
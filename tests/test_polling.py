@@ -0,0 +1,51 @@
+"""
+Tests of the polling helpers, on a fake clock advanced by the sleeps
+"""
+
+import pytest
+
+from clusty.utils import polling
+from clusty.utils.polling import wait_until
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """Fake clock, recording the duration of each sleep"""
+
+    class Clock:
+        now = 0.0
+        sleeps = list()
+
+        @classmethod
+        def sleep(cls, seconds):
+            cls.sleeps.append(seconds)
+            cls.now += seconds
+
+    monkeypatch.setattr(polling.time, 'monotonic', lambda: Clock.now)
+    monkeypatch.setattr(polling.time, 'sleep', Clock.sleep)
+    return Clock
+
+
+def test_condition_met(clock):
+    polls = iter([False, False, False, True])
+    assert wait_until(lambda: next(polls), interval=0.1, deadline=10)
+    assert clock.sleeps == pytest.approx([0.1, 0.2, 0.4])
+
+
+def test_condition_met_right_away(clock):
+    assert wait_until(lambda: True, interval=0.1, deadline=10)
+    assert clock.sleeps == list()
+
+
+def test_poll_period(clock):
+    # The interval doubles after each poll, up to the maximum interval
+    assert not wait_until(lambda: False, interval=0.25, deadline=5, max_interval=1)
+    assert clock.sleeps == pytest.approx([0.25, 0.5, 1, 1, 1, 1, 0.25])
+
+
+def test_deadline(clock):
+    # The last sleep is cut short at the deadline, and the condition is polled once more before giving up
+    polls = list()
+    assert not wait_until(lambda: polls.append(clock.now), interval=1, deadline=2.5, max_interval=1)
+    assert clock.now == pytest.approx(2.5)
+    assert polls == pytest.approx([0, 1, 2, 2.5])
@@ -0,0 +1,61 @@
+"""
+Tests of the warm pool of allocations claimed by the starts
+"""
+
+import threading
+
+import pytest
+
+from clusty.clusters.client import ClusterClient
+from clusty.configs.parser import ConfigsParser
+from clusty.configs.state import SessionState
+from clusty.utils.polling import wait_until
+from tests.conftest import requires_screen
+from tests.fake_cluster import benchmark_configs
+
+
+def pool_configs(idle_time: int = 3600, backend: str = 'interactive') -> dict:
+    configs = benchmark_configs(cluster_id='leomed2', n_jobs=1, concurrency=1, backend=backend)
+    configs['cluster']['pool'] = {'batch_jobs': {'job0': 1}, 'idle_time': idle_time}
+    return configs
+
+
+def test_pool_configs(tmp_path):
+    assert ConfigsParser(pool_configs()).get_cluster_pool() == ({'job0': 1}, 3600, 600)
+    assert ConfigsParser(benchmark_configs(cluster_id='leomed2', n_jobs=1, concurrency=1)).get_cluster_pool() == \
+        (dict(), 0, 0)
+    with pytest.raises(ValueError):
+        ConfigsParser(pool_configs(backend='script')).get_cluster_pool()
+
+    state = SessionState(path=tmp_path / "pool.state.json")
+    pool_state = state.for_pool()
+    assert pool_state.path == tmp_path / "pool.state.pool.json"
+    with pool_state.file_lock():
+        pool_state.set_cluster(cluster_id='leomed2', screen='leomed2_pool', ssh_alias='fake-cluster')
+        pool_state.update_batch_job('pool_job0', job_id='1')
+        pool_state.remove_batch_job('pool_job0')
+    assert pool_state.load() and pool_state.batch_jobs == dict()
+
+
+@requires_screen
+def test_claim_pool_allocation(fake_cluster, monkeypatch, tmp_path):
+    fake_cluster(queue_wait=0.5, jupyter_startup=0.2)
+    monkeypatch.setattr(ClusterClient, 'pool_poll_period', 0.2)
+    configs = pool_configs(idle_time=5)
+    state = SessionState(path=tmp_path / "pool.state.json")
+    pool_state = state.for_pool()
+
+    pool = threading.Thread(target=ClusterClient(configs, state=state).pool)
+    pool.start()
+    assert wait_until(lambda: pool_state.load() and any([entry['state'] == 'started'
+                                                         for entry in pool_state.batch_jobs.values()]), deadline=30)
+    pooled_job_id = list(pool_state.batch_jobs.values())[0]['job_id']
+
+    ClusterClient(configs, state=state).start()
+    assert state.batch_jobs['job0']['job_id'] == pooled_job_id
+    assert 'urls' in state.batch_jobs['job0']
+
+    ClusterClient(configs, state=state).stop()
+    pool.join(timeout=60)
+    assert not pool.is_alive()
+    assert not pool_state.path.exists()
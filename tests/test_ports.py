@@ -0,0 +1,71 @@
+"""
+Tests of the automatic choice of the jupyter ports, on the local machine and on the nodes
+"""
+
+import re
+import socket
+
+import pytest
+
+from clusty.clusters import LeoMed2
+from clusty.clusters.cluster import Cluster
+from clusty.configs.parser import ConfigsParser
+from clusty.terminal.command import run_command
+from clusty.terminal.shell import Shell
+from clusty.utils.network import free_local_port
+from clusty.utils.validation import ValidationError
+from tests.fake_cluster import benchmark_configs, token
+
+
+@pytest.fixture
+def listening_port():
+    """Port of a local server listening on all the interfaces"""
+
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as server:
+        server.bind(('', 0))
+        server.listen()
+        yield server.getsockname()[1]
+
+
+def test_free_local_port(listening_port):
+    assert free_local_port([listening_port, listening_port + 1]) == listening_port + 1
+    assert free_local_port([listening_port, 0], exclude={listening_port}) == 0
+    with pytest.raises(RuntimeError):
+        free_local_port([listening_port])
+
+
+def test_listening_ports(listening_port):
+    terminal = Shell()
+    result = run_command(terminal, Cluster.listening_ports_command, timeout=10)
+    terminal.close(force=True)
+
+    assert str(listening_port) in re.findall(r"^\s*([0-9]{1,5})\s*$", result.output, re.MULTILINE)
+
+
+def test_auto_port_configs():
+    configs = benchmark_configs(cluster_id='leomed2', n_jobs=1, concurrency=1)
+    configs['batch_jobs']['job0']['jupyter']['port'] = 'auto'
+    assert ConfigsParser(configs).get_jupyter_configs('job0')['port'] == 'auto'
+
+    configs['batch_jobs']['job0']['jupyter']['port'] = 'any'
+    with pytest.raises(ValidationError):
+        ConfigsParser(configs)
+
+
+def test_auto_port_job_script(fake_cluster, monkeypatch, listening_port):
+    monkeypatch.setattr(Cluster, 'job_poll_period', 0.2)
+    monkeypatch.setattr(Cluster, 'auto_ports', range(listening_port, listening_port + 2))
+    fake = fake_cluster(queue_wait=0.2)
+    fake.login()
+
+    # The job script skips the ports listened on by the node, while the local URL uses the local port
+    cluster = LeoMed2()
+    script = cluster.job_script(name="notebook", commands=['JUPYTER'], jupyter={'port': 'auto', 'flavor': 'lab'})
+    allocation = cluster.submit(ssh_alias="fake-cluster", name="notebook", script=script)
+    allocation, ip_address, links, port = cluster.wait_job(ssh_alias="fake-cluster", name="notebook",
+                                                           allocation=allocation, max_wait=10, jupyter_timeout=10,
+                                                           local_port=9100)
+
+    assert port == listening_port + 1
+    assert links == [f"http://127.0.0.1:9100/lab?token={token}"]
+    cluster.cancel(ssh_alias="fake-cluster", job_ids=[allocation.job_id])
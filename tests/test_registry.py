@@ -0,0 +1,95 @@
+"""
+Tests of the cluster registry, with a cluster registered as entry point by a fake installed package
+"""
+
+import sys
+import shutil
+import builtins
+
+import pytest
+
+from clusty.clusters import registry
+from clusty.configs.parser import ConfigsParser
+from clusty.utils.validation import ValidationError
+from tests.conftest import imported_modules
+from tests.fake_cluster import benchmark_configs
+
+plugin_module = '''
+from clusty.clusters.ETH.leomed2 import LeoMed2
+
+
+class InHouse(LeoMed2):
+    """Slurm cluster of the lab"""
+'''
+
+
+@pytest.fixture
+def plugin(tmp_path, monkeypatch):
+    """Package 'inhouse_clusters' registering the cluster 'inhouse' as entry point, installed in a temporary folder"""
+
+    (tmp_path / "inhouse_clusters.py").write_text(plugin_module)
+    dist_info = tmp_path / "inhouse_clusters-1.0.dist-info"
+    dist_info.mkdir()
+    (dist_info / "METADATA").write_text("Metadata-Version: 2.1\nName: inhouse-clusters\nVersion: 1.0\n")
+    (dist_info / "entry_points.txt").write_text("[clusty.clusters]\ninhouse = inhouse_clusters:InHouse\n")
+
+    monkeypatch.syspath_prepend(str(tmp_path))
+    monkeypatch.setattr(ConfigsParser, '_config_schema', None)
+    registry._entry_points.cache_clear()
+    yield
+    sys.modules.pop("inhouse_clusters", None)
+    registry._entry_points.cache_clear()
+
+
+def test_builtin_clusters():
+    assert {'leomed1', 'leomed2'} <= set(registry.cluster_ids())
+    assert registry.cluster_class('leomed2').__name__ == 'LeoMed2'
+    with pytest.raises(ValueError):
+        registry.cluster_class('unknown')
+
+    # Neither the cluster classes nor the entry points metadata are loaded until a cluster is selected
+    assert imported_modules("import clusty.clusters.client",
+                            ['clusty.clusters.ETH.leomed1', 'clusty.clusters.ETH.leomed2', 'importlib.metadata']) == []
+
+
+def test_plugin_cluster(plugin):
+    assert 'inhouse' in registry.cluster_ids()
+    assert "inhouse_clusters" not in sys.modules
+
+    configs = ConfigsParser({'cluster': {'id': 'inhouse', 'batch_jobs': ['job']},
+                             'batch_jobs': {'job': {'run': ['hostname']}}})
+    assert configs.get_cluster_config()[0] == 'inhouse'
+
+    cluster = registry.cluster_class('inhouse')()
+    assert type(cluster).__name__ == 'InHouse'
+    assert cluster.submit_command("job.sh") == "sbatch job.sh"
+
+
+def test_plugin_cluster_cached_configs(plugin, tmp_path, monkeypatch):
+    # The cached configuration of a cluster is validated again once the package registering it is removed
+    import yaml
+
+    config_file = tmp_path / "config.yaml"
+    config_file.write_text(yaml.dump(benchmark_configs(cluster_id='inhouse', n_jobs=1, concurrency=1)))
+    assert ConfigsParser.from_file(config_file).get_cluster_config()[0] == 'inhouse'
+
+    shutil.rmtree(tmp_path / "inhouse_clusters-1.0.dist-info")
+    registry._entry_points.cache_clear()
+    monkeypatch.setattr(ConfigsParser, '_config_schema', None)
+    with pytest.raises(ValidationError):
+        ConfigsParser.from_file(config_file)
+
+
+def test_plugin_cluster_backport(plugin, monkeypatch):
+    # Before Python 3.8, the registry reads the entry points with the importlib_metadata backport
+    import importlib.metadata
+
+    def import_before_38(name, globals=None, *args, **kwargs):
+        if name == 'importlib.metadata' and (globals or dict()).get('__name__') == registry.__name__:
+            raise ImportError(f"No module named '{name}'")
+        return builtin_import(name, globals, *args, **kwargs)
+
+    builtin_import = builtins.__import__
+    monkeypatch.setattr(builtins, '__import__', import_before_38)
+    monkeypatch.setitem(sys.modules, 'importlib_metadata', importlib.metadata)
+    assert 'inhouse' in registry.cluster_ids()
@@ -0,0 +1,94 @@
+"""
+Tests of the screen sessions, with screens standing for local shells
+"""
+
+import pytest
+
+from clusty.terminal.command import run_command
+from clusty.terminal.screen import Screen, ScreenInfo, ScreenSession
+
+
+screen_list = """There are screens on:
+\t4242.job-0.run\t(10/18/2026 09:15:02 AM)\t(Detached)
+\t17.leomed2\t(Attached)
+\t903.pts-1.login_node\t(18.10.2026 21:03:44)\t(Multi, attached)
+3 Sockets in /run/screen/S-user.
+"""
+
+
+def test_parse():
+    assert Screen.parse(screen_list) == [
+        ScreenInfo(pid=4242, name='job-0.run', date='10/18/2026 09:15:02 AM', state='Detached'),
+        ScreenInfo(pid=17, name='leomed2', date=None, state='Attached'),
+        ScreenInfo(pid=903, name='pts-1.login_node', date='18.10.2026 21:03:44', state='Multi, attached'),
+    ]
+    assert [screen.detached for screen in Screen.parse(screen_list)] == [True, False, False]
+
+
+def test_parse_name():
+    # Screens are matched by name, identifier or PID
+    assert [screen.id for screen in Screen.parse(screen_list, name='job-0.run')] == ['4242.job-0.run']
+    assert [screen.id for screen in Screen.parse(screen_list, name='17.leomed2')] == ['17.leomed2']
+    assert [screen.id for screen in Screen.parse(screen_list, name='903')] == ['903.pts-1.login_node']
+    assert Screen.parse(screen_list, name='job-0') == list()
+
+
+def test_parse_no_screens():
+    assert Screen.parse("No Sockets found in /run/screen/S-user.\r\n") == list()
+
+
+def test_remote_session(fake_cluster, shell_screens):
+    # Screens on the SSH host are attached in a terminal of their own, logged in through the control master connection
+    fake = fake_cluster()
+    fake.login()
+    with ScreenSession(screens=['job0'], ssh_alias='fake-cluster') as session:
+        assert run_command(session.terminal, 'echo "$HOME"', timeout=10).output == str(fake.state / "home")
+
+    assert shell_screens == [('attach', ['job0']), ('detach', 1)]
+
+
+def test_parse_escapes():
+    # Listing from inside another screen may render the whitespace as cursor movements
+    listing = "There is a screen on:\r\n\x1b[8C17.leomed2\x1b[1C(Detached)\r\n1 Socket in /run/screen/S-user.\r\n"
+    assert Screen.parse(listing) == [ScreenInfo(pid=17, name='leomed2', date=None, state='Detached')]
+
+
+def test_nested_session(monkeypatch):
+    # Entering the session again reuses its terminal: the screens are attached once and detached once, on the last exit
+    events, fake_terminal = list(), object()
+
+    def attach_nested(screens, terminal=None):
+        events.append(('attach', screens))
+        return fake_terminal
+
+    def detach_nested(terminal, depth=1, terminate=False):
+        events.append(('detach', terminal, depth, terminate))
+
+    monkeypatch.setattr(Screen, 'attach_nested', attach_nested)
+    monkeypatch.setattr(Screen, 'detach_nested', detach_nested)
+
+    session = ScreenSession(screens=['leomed2', 'job0'])
+    with session:
+        assert session.terminal is fake_terminal
+        with session as inner:
+            assert inner.terminal is fake_terminal
+        assert session.attached
+        assert events == [('attach', ['leomed2', 'job0'])]
+
+    assert not session.attached
+    assert events == [('attach', ['leomed2', 'job0']), ('detach', fake_terminal, 2, True)]
+
+
+def test_session_error(monkeypatch):
+    # The screens are detached when an operation of the session fails
+    events = list()
+    monkeypatch.setattr(Screen, 'attach_nested', lambda screens, terminal=None: events.append('attach') or object())
+    monkeypatch.setattr(Screen, 'detach_nested', lambda terminal, depth=1, terminate=False: events.append('detach'))
+
+    session = ScreenSession(screens='leomed2')
+    with pytest.raises(RuntimeError):
+        with session:
+            raise RuntimeError("Failed operation")
+
+    assert not session.attached
+    assert events == ['attach', 'detach']
@@ -0,0 +1,72 @@
+"""
+Tests of the session state recorded by start, and of its reuse by a later start on the same connection
+"""
+
+import pytest
+
+from clusty.clusters import LeoMed2
+from clusty.clusters.client import ClusterClient
+from clusty.configs.state import SessionState
+from clusty.terminal.screen import Screen
+from tests.conftest import requires_screen
+from tests.fake_cluster import benchmark_configs
+
+
+def test_clear_batch_jobs(tmp_path):
+    state = SessionState(path=tmp_path / "config.state.json")
+    state.set_cluster(cluster_id='leomed2', screen='leomed2', pid=123, ssh_alias='fake-cluster')
+    state.update_batch_job('job0', screen=None, job_id='1')
+    state.add_tunnel(binding="8100:127.0.0.1:8100")
+
+    state.clear_batch_jobs()
+    assert state.load()
+    assert state.cluster['screen'] == 'leomed2'
+    assert (state.batch_jobs, state.tunnels) == (dict(), list())
+
+
+def test_reused_login(fake_cluster, tmp_path, monkeypatch):
+    # The batch jobs and tunnels recorded by the previous start are only stopped when restarting
+    fake = fake_cluster()
+    fake.login()
+    cluster = LeoMed2()
+    script = cluster.job_script(name="job0", commands=['sleep 60'])
+    allocation = cluster.submit(ssh_alias="fake-cluster", name="job0", script=script)
+    assert cluster.forward(binding="8100:127.0.0.1:8100", ssh_alias="fake-cluster")
+
+    state = SessionState(path=tmp_path / "config.state.json")
+    state.set_cluster(cluster_id='leomed2', screen='leomed2', ssh_alias='fake-cluster')
+    state.update_batch_job('job0', screen=None, job_id=allocation.job_id)
+    state.add_tunnel(binding="8100:127.0.0.1:8100")
+    monkeypatch.setattr(Screen, 'list', classmethod(lambda cls, **kwargs: ['leomed2']))
+
+    client = ClusterClient(benchmark_configs(cluster_id='leomed2', n_jobs=1, concurrency=1), state=state)
+    client.set_cluster(cluster='leomed2')
+    jobs, forwards = fake.jobs, fake.forwards
+    with pytest.raises(RuntimeError, match="'job0'"):
+        client._recorded_login(cluster_id='leomed2', ssh_alias='fake-cluster')
+    assert (fake.jobs, fake.forwards) == (jobs, forwards)
+    assert client._recorded_login(cluster_id='leomed2', ssh_alias='fake-cluster', restart=True) == 'leomed2'
+    assert (fake.jobs, fake.forwards) == (list(), list())
+    assert state.load()
+    assert (state.batch_jobs, state.tunnels) == (dict(), list())
+
+
+@requires_screen
+def test_start_twice(fake_cluster, tmp_path):
+    cluster = fake_cluster(latency=0.1, queue_wait=0.5, jupyter_startup=0.5)
+    configs = benchmark_configs(cluster_id='leomed2', n_jobs=2, concurrency=2, backend='script')
+    state = SessionState(path=tmp_path / "config.state.json")
+
+    ClusterClient(configs, state=state).start()
+    first_jobs = cluster.jobs
+    with pytest.raises(RuntimeError):
+        ClusterClient(configs, state=state).start()
+    ClusterClient(configs, state=state).start(restart=True)
+
+    assert len(cluster.jobs) == 2 and not set(first_jobs) & set(cluster.jobs)
+    assert len(cluster.forwards) == 2
+    assert sorted(state.batch_jobs.keys()) == ['job0', 'job1']
+    assert len(state.tunnels) == 2
+
+    ClusterClient(configs, state=state).stop()
+    assert cluster.jobs == []
@@ -0,0 +1,59 @@
+"""
+Tests of the bounded buffering of the terminal output, against a chatty local shell
+"""
+
+from clusty.terminal.command import run_command, run_script
+from clusty.terminal.shell import RingBuffer, Shell
+
+
+def test_ring_buffer(monkeypatch):
+    monkeypatch.setattr(RingBuffer, 'capacity', 1000)
+    buffer = RingBuffer()
+    for idx in range(100):
+        buffer.write(bytes([idx]) * 100)
+        assert buffer.tell() <= 2 * RingBuffer.capacity
+
+    assert buffer.getvalue()[-RingBuffer.capacity:] == b"".join([bytes([idx]) * 100 for idx in range(90, 100)])
+
+
+def test_chatty_terminal(monkeypatch):
+    monkeypatch.setattr(RingBuffer, 'capacity', 1 << 16)
+    terminal = Shell()
+
+    # Megabytes printed before the pattern keep the buffers bounded, and the output preceding the match keeps its end
+    terminal.sendline("yes chatty 2>/dev/null | head -c 4200000; printf '%s_%s\\n' CHATTY DONE")
+    terminal.expect("CHATTY_DONE", timeout=30)
+    assert len(terminal.before) <= 2 * RingBuffer.capacity
+    assert terminal.before.rstrip().endswith(b"chatty")
+
+    result = run_command(terminal, "yes chatty 2>/dev/null | head -c 1000000 | wc -c", timeout=30)
+    assert (result.exit_code, result.output) == (0, "1000000")
+    terminal.close(force=True)
+
+
+def test_large_output():
+    terminal = Shell()
+
+    # A pattern followed by much more output within the same read is found
+    terminal.sendline("printf '%s_%s\\n' LARGE OUTPUT; head -c 200000 /dev/zero | tr '\\000' x; echo")
+    terminal.expect("LARGE_OUTPUT", timeout=30)
+
+    result = run_command(terminal, "seq 1 200000", timeout=30)
+    assert result.success
+    assert result.output.split() == [str(number) for number in range(1, 200001)]
+
+    result = run_script(terminal, ["seq 1 100000", "echo done"], timeout=30)
+    assert result.exit_codes == [0, 0]
+    assert result.outputs[0].split()[-1] == "100000" and result.outputs[1] == "done"
+    terminal.close(force=True)
+
+
+def test_output_larger_than_kept(monkeypatch):
+    # The end of an output larger than what the terminal keeps is returned
+    monkeypatch.setattr(RingBuffer, 'capacity', 1 << 16)
+    terminal = Shell()
+    result = run_command(terminal, "seq 1 200000", timeout=30)
+    assert result.success
+    assert result.output.split()[-1] == "200000"
+    assert len(result.output) <= 2 * RingBuffer.capacity
+    terminal.close(force=True)
@@ -0,0 +1,124 @@
+"""
+Tests of the timing spans, of their export as a Chrome trace and of their summary table
+"""
+
+import json
+import threading
+from types import SimpleNamespace
+
+import pytest
+
+from clusty.utils import timing
+from clusty.utils.timing import span, spans, timings_table, traced, write_trace
+
+
+@pytest.fixture
+def recording():
+    """Records the spans for the duration of the test"""
+
+    timing.enable()
+    yield
+    timing.enable(False)
+
+
+@pytest.fixture
+def clock(recording, monkeypatch):
+    """Fake clock of the spans, advancing by one second at each reading"""
+
+    readings = iter(range(1000))
+    monkeypatch.setattr(timing, 'time', SimpleNamespace(time=lambda: float(next(readings))))
+
+
+def test_disabled():
+    timing.enable(False)
+    with span("client.start"):
+        pass
+    assert spans() == list()
+
+
+def test_nesting(clock):
+    @traced("screen.create")
+    def create():
+        with span("screen.list"):
+            pass
+
+    with span("client.start"):
+        create()
+
+    assert [(recorded.name, recorded.depth) for recorded in spans()] == \
+           [("screen.list", 2), ("screen.create", 1), ("client.start", 0)]
+    assert [(recorded.start, recorded.duration) for recorded in spans()] == [(2, 1), (1, 3), (0, 5)]
+
+
+def test_inherited_args(clock):
+    # Nested spans inherit the attributes of the enclosing spans, overridden by their own, but missing values are not
+    with span("client.start", cluster="leomed2"):
+        with span("client.batch_job", batch_job="job0"):
+            with span("client.provision", cluster="euler", batch_job=None):
+                pass
+        with span("client.tunnel"):
+            pass
+
+    assert {recorded.name: recorded.args for recorded in spans()} == {
+        "client.provision": {"cluster": "euler", "batch_job": "job0"},
+        "client.batch_job": {"cluster": "leomed2", "batch_job": "job0"},
+        "client.tunnel": {"cluster": "leomed2"},
+        "client.start": {"cluster": "leomed2"},
+    }
+
+
+def test_threads(recording):
+    # Spans of different threads are nested in the spans of their own thread only
+    def provision(batch_job):
+        with span("client.provision", batch_job=batch_job):
+            with span("screen.create"):
+                pass
+
+    with span("client.start", cluster="leomed2"):
+        threads = [threading.Thread(target=provision, args=(f"job{idx}",), name=f"job{idx}") for idx in range(3)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    recorded = spans()
+    assert len(recorded) == 7
+    for thread in threads:
+        created, provisioned = [recorded_span for recorded_span in recorded if recorded_span.thread_name == thread.name]
+        assert (created.name, created.depth) == ("screen.create", 1)
+        assert (provisioned.name, provisioned.depth) == ("client.provision", 0)
+        assert created.args == provisioned.args == {"batch_job": thread.name}
+    assert recorded[-1].name == "client.start" and recorded[-1].thread == threading.get_ident()
+
+
+def test_write_trace(clock, tmp_path):
+    with span("client.start", cluster="leomed2"):
+        with span("client.login"):
+            pass
+
+    write_trace(tmp_path / "trace.json")
+    with open(tmp_path / "trace.json") as file:
+        trace = json.load(file)
+
+    thread = threading.current_thread()
+    assert trace['displayTimeUnit'] == 'ms'
+    metadata, login, start = trace['traceEvents']
+    assert metadata == {'name': 'thread_name', 'ph': 'M', 'pid': metadata['pid'], 'tid': thread.ident,
+                        'args': {'name': thread.name}}
+    assert login == {'name': 'client.login', 'cat': 'clusty', 'ph': 'X', 'pid': metadata['pid'], 'tid': thread.ident,
+                     'ts': 1000000, 'dur': 1000000, 'args': {'cluster': 'leomed2'}}
+    assert (start['name'], start['ts'], start['dur']) == ('client.start', 0, 3000000)
+
+
+def test_timings_table(clock):
+    with span("client.start"):
+        for _ in range(2):
+            with span("screen.create"):
+                pass
+
+    assert timings_table().split("\n") == [
+        "Phase          Calls  Total (s)  Mean (s)  Max (s)",
+        "-------------  -----  ---------  --------  -------",
+        "client.start   1      5.00       5.00      5.00",
+        "screen.create  2      2.00       1.00      1.00",
+    ]
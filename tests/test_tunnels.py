@@ -0,0 +1,121 @@
+"""
+Tests of the tunnels monitor, probing local servers standing for the local ends of the tunnels
+"""
+
+import time
+import socket
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+import pytest
+
+from clusty.clusters import LeoMed2
+from clusty.clusters.client import ClusterClient
+from clusty.configs.state import SessionState
+from clusty.utils.network import connect_latency, http_latency
+from clusty.utils.timing import percentile
+from tests.fake_cluster import benchmark_configs
+
+
+class _ApiHandler(BaseHTTPRequestHandler):
+    """Jupyter API answering with its version"""
+
+    def do_GET(self):
+        self.send_response(200 if self.path == '/api' else 404)
+        self.end_headers()
+        self.wfile.write(b'{"version": "6.0.0"}')
+
+    def log_message(self, *args):
+        pass
+
+
+def serve_api(port: int = 0) -> HTTPServer:
+    server = HTTPServer(('127.0.0.1', port), _ApiHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+@pytest.fixture
+def jupyter_api():
+    """Port of a local server answering the requests to the jupyter API"""
+
+    server = serve_api()
+    yield server.server_address[1]
+    server.shutdown()
+    server.server_close()
+
+
+def free_port() -> int:
+    with socket.socket() as probe:
+        probe.bind(('127.0.0.1', 0))
+        return probe.getsockname()[1]
+
+
+def test_percentile():
+    assert percentile([3, 1, 2], 50) == 2
+    assert percentile([1, 2], 50) == 1.5
+    assert percentile([5], 99) == 5
+    assert percentile(list(range(101)), 95) == 95
+
+
+def test_latencies(jupyter_api):
+    assert connect_latency(jupyter_api) >= 0
+    assert http_latency(f"http://127.0.0.1:{jupyter_api}/api") >= 0
+    assert http_latency(f"http://127.0.0.1:{jupyter_api}/missing") is not None
+
+    closed_port = free_port()
+    assert connect_latency(closed_port) is None
+    assert http_latency(f"http://127.0.0.1:{closed_port}/api") is None
+
+
+def tunnels_client(tmp_path, ports) -> ClusterClient:
+    state = SessionState(path=tmp_path / "config.state.json")
+    state.set_cluster(cluster_id='leomed2', screen='leomed2', ssh_alias='fake-cluster')
+    for idx, port in enumerate(ports):
+        state.add_tunnel(binding=f"{port}:job{idx}:8888")
+        state.update_batch_job(f"job{idx}", urls=[f"http://127.0.0.1:{port}/lab?token=abc"])
+
+    return ClusterClient(benchmark_configs(cluster_id='leomed2', n_jobs=1, concurrency=1), state=state)
+
+
+def test_probe_tunnels(tmp_path, capsys, jupyter_api):
+    closed_port = free_port()
+    tunnels_client(tmp_path, [jupyter_api, closed_port]).tunnels()
+
+    output = capsys.readouterr().out
+    assert f"Tunnel '{closed_port}:job1:8888' is down." in output
+    rows = {line.split()[0]: line.split() for line in output.splitlines() if line[:1].isdigit()}
+    assert rows[f"{jupyter_api}:job0:8888"][1:5] == ["up", "1", "0", "0"]
+    assert rows[f"{closed_port}:job1:8888"][1:5] == ["down", "1", "1", "0"]
+
+    tunnels_client(tmp_path, []).tunnels()
+    assert capsys.readouterr().out.startswith("No tunnel recorded")
+
+
+def test_watch_tunnels(tmp_path, capsys, monkeypatch):
+    # The dead tunnel is forwarded again through the control master connection, then probed up
+    port = free_port()
+    servers = list()
+    monkeypatch.setattr(LeoMed2, 'cancel_forward', lambda self, binding, ssh_alias=None: True)
+    monkeypatch.setattr(LeoMed2, 'forward',
+                        lambda self, binding, ssh_alias=None: servers.append(serve_api(port)) or True)
+
+    sleep = time.sleep
+    rounds = iter(range(2))
+
+    def interrupt_after_rounds(seconds):
+        if next(rounds, None) is None:
+            raise KeyboardInterrupt
+        sleep(0.01)
+
+    monkeypatch.setattr(time, 'sleep', interrupt_after_rounds)
+    tunnels_client(tmp_path, [port]).tunnels(watch=True)
+    monkeypatch.undo()
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+    output = capsys.readouterr().out
+    assert f"... forwarded '{port}:job0:8888' again through the connection to fake-cluster" in output
+    row = [line.split() for line in output.splitlines() if line.startswith(f"{port}:job0")][-1]
+    assert row[1:5] == ["up", "3", "1", "1"]